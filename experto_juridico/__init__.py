@@ -0,0 +1,6 @@
+"""Componentes reutilizables de Experto Jurídico (sin dependencia de la interfaz).
+
+Importar el paquete no arranca la interfaz ni abre conexiones: openai,
+python-docx, PyPDF2 y Pillow se importan dentro de las funciones que los usan,
+la primera vez que se necesitan (``scripts/medir_arranque.py`` lo comprueba).
+"""
@@ -0,0 +1,296 @@
+"""Almacén de valoraciones en SQLite (modo WAL) con agregados incrementales.
+
+Cada valoración se inserta en la misma transacción que actualiza una fila de
+agregados (total, suma e histograma por estrellas), de modo que las
+estadísticas se leen en O(1) sin recorrer el historial. ``BEGIN IMMEDIATE``
+serializa los escritores entre sesiones y procesos; con WAL las lecturas no
+se bloquean mientras tanto.
+
+Para la analítica, cada valoración guarda además el contexto de la sesión que
+la dejó (área, rol, formato y latencia de generación) y actualiza en la misma
+transacción un rollup diario materializado por esas dimensiones. Las consultas
+de analítica leen solo el rollup (días × combinaciones), nunca la tabla de
+valoraciones completa.
+"""
+from __future__ import annotations
+
+import csv
+import os
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+RUTA_POR_DEFECTO = os.getenv("EJ_FEEDBACK_DB", "feedbacks.db")
+ESTRELLAS = range(1, 6)
+SIN_DATO = "(sin dato)"
+
+# Bandas de latencia de generación (segundos) para correlacionar con la valoración
+BANDAS_LATENCIA = ((30, "< 30 s"), (60, "30-60 s"), (120, "60-120 s"), (300, "2-5 min"))
+BANDA_MAXIMA = "> 5 min"
+
+DIMENSIONES = {
+    "dia": "Día",
+    "area": "Área",
+    "rol": "Rol",
+    "formato": "Formato",
+    "banda_latencia": "Latencia de generación",
+}
+
+_COLUMNAS_ESTRELLAS = ", ".join(f"e{i} INTEGER NOT NULL DEFAULT 0" for i in ESTRELLAS)
+
+_ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
+    comentario TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS agregados (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    suma INTEGER NOT NULL DEFAULT 0,
+    {_COLUMNAS_ESTRELLAS}
+);
+INSERT OR IGNORE INTO agregados (id) VALUES (1);
+CREATE TABLE IF NOT EXISTS feedback_diario (
+    dia TEXT NOT NULL,
+    area TEXT NOT NULL,
+    rol TEXT NOT NULL,
+    formato TEXT NOT NULL,
+    banda_latencia TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    suma INTEGER NOT NULL DEFAULT 0,
+    latencia_suma_ms INTEGER NOT NULL DEFAULT 0,
+    latencia_n INTEGER NOT NULL DEFAULT 0,
+    {_COLUMNAS_ESTRELLAS},
+    PRIMARY KEY (dia, area, rol, formato, banda_latencia)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+
+
+# Columnas de contexto añadidas a la tabla feedback (migración desde el esquema inicial)
+_COLUMNAS_CONTEXTO = {"area": "TEXT", "rol": "TEXT", "formato": "TEXT", "latencia_ms": "INTEGER"}
+
+
+def banda_latencia(latencia_ms: int | None) -> str:
+    """Banda legible para una latencia de generación en milisegundos."""
+    if latencia_ms is None:
+        return SIN_DATO
+    segundos = latencia_ms / 1000
+    for limite, nombre in BANDAS_LATENCIA:
+        if segundos < limite:
+            return nombre
+    return BANDA_MAXIMA
+
+
+@dataclass(frozen=True)
+class ContextoFeedback:
+    """Contexto de la sesión que deja la valoración."""
+
+    area: str | None = None
+    rol: str | None = None
+    formato: str | None = None
+    latencia_ms: int | None = None
+
+
+@dataclass(frozen=True)
+class Estadisticas:
+    total: int
+    suma: int
+    histograma: dict[int, int]
+
+    @property
+    def promedio(self) -> float:
+        return self.suma / self.total if self.total else 0.0
+
+
+class AlmacenFeedback:
+    """Valoraciones persistentes y seguras frente a sesiones concurrentes."""
+
+    def __init__(self, ruta: str | Path = RUTA_POR_DEFECTO):
+        self.ruta = str(ruta)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+            existentes = {fila[1] for fila in con.execute("PRAGMA table_info(feedback)")}
+            for columna, tipo in _COLUMNAS_CONTEXTO.items():
+                if columna not in existentes:
+                    con.execute(f"ALTER TABLE feedback ADD COLUMN {columna} {tipo}")
+        self._rellenar_rollup()
+
+    @contextmanager
+    def _conexion(self):
+        # Conexiones cortas: sqlite3 no comparte conexiones entre hilos y
+        # Streamlit atiende cada sesión en su propio hilo.
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            con.execute("PRAGMA synchronous=NORMAL")
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    @staticmethod
+    def _acumular_rollup(con: sqlite3.Connection, fecha: str, rating: int, contexto: ContextoFeedback) -> None:
+        latencia = contexto.latencia_ms
+        con.execute(
+            f"""
+            INSERT INTO feedback_diario
+                (dia, area, rol, formato, banda_latencia, total, suma, latencia_suma_ms, latencia_n, e{rating})
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, 1)
+            ON CONFLICT (dia, area, rol, formato, banda_latencia) DO UPDATE SET
+                total = total + 1,
+                suma = suma + excluded.suma,
+                latencia_suma_ms = latencia_suma_ms + excluded.latencia_suma_ms,
+                latencia_n = latencia_n + excluded.latencia_n,
+                e{rating} = e{rating} + 1
+            """,
+            (
+                fecha[:10] or SIN_DATO,
+                contexto.area or SIN_DATO,
+                contexto.rol or SIN_DATO,
+                contexto.formato or SIN_DATO,
+                banda_latencia(latencia),
+                rating,
+                latencia or 0,
+                int(latencia is not None),
+            ),
+        )
+
+    @classmethod
+    def _insertar(
+        cls,
+        con: sqlite3.Connection,
+        fecha: str,
+        rating: int,
+        comentario: str,
+        contexto: ContextoFeedback = ContextoFeedback(),
+    ) -> int:
+        cursor = con.execute(
+            "INSERT INTO feedback (fecha, rating, comentario, area, rol, formato, latencia_ms) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fecha, rating, comentario, contexto.area, contexto.rol, contexto.formato, contexto.latencia_ms),
+        )
+        con.execute(
+            f"UPDATE agregados SET total = total + 1, suma = suma + ?, e{rating} = e{rating} + 1 WHERE id = 1",
+            (rating,),
+        )
+        cls._acumular_rollup(con, fecha, rating, contexto)
+        return cursor.lastrowid
+
+    def registrar(
+        self,
+        rating: int,
+        comentario: str = "",
+        fecha: str | None = None,
+        contexto: ContextoFeedback | None = None,
+    ) -> int:
+        """Guarda una valoración y actualiza los agregados y el rollup diario; devuelve su id."""
+        rating = int(rating)
+        if rating not in ESTRELLAS:
+            raise ValueError("La valoración debe estar entre 1 y 5 estrellas")
+        with self._transaccion() as con:
+            return self._insertar(
+                con, fecha or datetime.now().isoformat(), rating, comentario or "", contexto or ContextoFeedback()
+            )
+
+    def _rellenar_rollup(self) -> None:
+        """Construye el rollup desde la tabla de valoraciones si aún está vacío.
+
+        Solo ocurre una vez, al migrar una base creada antes de la analítica.
+        """
+        with self._transaccion() as con:
+            if con.execute("SELECT 1 FROM feedback_diario LIMIT 1").fetchone():
+                return
+            filas = con.execute(
+                "SELECT fecha, rating, area, rol, formato, latencia_ms FROM feedback"
+            )
+            for fecha, rating, area, rol, formato, latencia_ms in filas.fetchall():
+                self._acumular_rollup(con, fecha, rating, ContextoFeedback(area, rol, formato, latencia_ms))
+
+    def resumen_por(self, dimension: str, desde: str | None = None, hasta: str | None = None) -> list[dict]:
+        """Agregados por una dimensión del rollup, opcionalmente entre dos fechas (YYYY-MM-DD)."""
+        if dimension not in DIMENSIONES:
+            raise ValueError(f"Dimensión no soportada: {dimension}")
+        condiciones, parametros = [], []
+        if desde:
+            condiciones.append("dia >= ?")
+            parametros.append(desde)
+        if hasta:
+            condiciones.append("dia <= ?")
+            parametros.append(hasta)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        estrellas = ", ".join(f"SUM(e{i})" for i in ESTRELLAS)
+        with self._conexion() as con:
+            filas = con.execute(
+                f"""
+                SELECT {dimension}, SUM(total), SUM(suma), SUM(latencia_suma_ms), SUM(latencia_n), {estrellas}
+                FROM feedback_diario {where}
+                GROUP BY {dimension}
+                ORDER BY {dimension}
+                """,
+                parametros,
+            ).fetchall()
+        resultado = []
+        for valor, total, suma, latencia_suma, latencia_n, *histograma in filas:
+            resultado.append({
+                DIMENSIONES[dimension]: valor,
+                "Valoraciones": total,
+                "Promedio": round(suma / total, 2) if total else 0.0,
+                "Latencia media (s)": round(latencia_suma / latencia_n / 1000, 1) if latencia_n else None,
+                **{f"{i} ⭐": n for i, n in zip(ESTRELLAS, histograma)},
+            })
+        return resultado
+
+    def estadisticas(self) -> Estadisticas:
+        """Total, suma e histograma por estrellas (lectura de una sola fila)."""
+        with self._conexion() as con:
+            fila = con.execute(
+                f"SELECT total, suma, {', '.join(f'e{i}' for i in ESTRELLAS)} FROM agregados WHERE id = 1"
+            ).fetchone()
+        return Estadisticas(fila[0], fila[1], dict(zip(ESTRELLAS, fila[2:])))
+
+    def importar_csv(self, ruta_csv: str | Path) -> int:
+        """Importa una única vez el CSV heredado (fecha, rating, comentario).
+
+        Devuelve cuántas filas se importaron (0 si ya se había importado o no existe).
+        """
+        ruta_csv = Path(ruta_csv)
+        if not ruta_csv.exists() or ruta_csv.stat().st_size == 0:
+            return 0
+        clave = f"csv_importado:{ruta_csv.resolve()}"
+        with self._transaccion() as con:
+            if con.execute("SELECT 1 FROM meta WHERE clave = ?", (clave,)).fetchone():
+                return 0
+            importadas = 0
+            with open(ruta_csv, newline="", encoding="utf-8") as f:
+                for fila in csv.DictReader(f):
+                    try:
+                        rating = int(float(fila["rating"]))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if rating not in ESTRELLAS:
+                        continue
+                    self._insertar(con, fila.get("fecha") or "", rating, fila.get("comentario") or "")
+                    importadas += 1
+            con.execute(
+                "INSERT INTO meta (clave, valor) VALUES (?, ?)",
+                (clave, datetime.now().isoformat()),
+            )
+        return importadas
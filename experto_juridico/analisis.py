@@ -0,0 +1,76 @@
+"""Vía de análisis de un documento: qué se envía al asistente y cómo se registra.
+
+Antes de llamar al asistente se decide cuánto hay que enviarle:
+
+- ``sin_cambios``: el expediente ya se analizó tal cual; se reutiliza el análisis.
+- ``incremental``: versión nueva de un expediente con poco material añadido;
+  se envían solo los párrafos nuevos junto con el análisis anterior.
+- ``etapa_local``: el clasificador local reconoce la etapa con confianza
+  suficiente; al asistente solo se le piden las soluciones.
+- ``completo``: análisis del documento completo.
+
+Solo la vía completa deja el documento entero en el thread; con las demás,
+quien pida después un escrito debe enviárselo (``redactar(documento=...)``).
+Las versiones anteriores se buscan entre las del mismo usuario.
+
+La aplicación ejecuta cada vía con su propia caché; el procesamiento por
+lotes usa ``ejecutar`` directamente.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from experto_juridico import asistente, etapas, versiones
+
+
+@dataclass(frozen=True)
+class Plan:
+    via: str
+    anterior: versiones.VersionCaso | None = None
+    cambios: versiones.Diferencia | None = None
+    etapa: str | None = None  # etiqueta de la etapa clasificada localmente
+
+    @property
+    def envia_documento(self) -> bool:
+        """Si la vía envía el documento completo al thread (no un extracto, los párrafos nuevos o nada)."""
+        return self.via == "completo"
+
+
+def planificar(texto: str, area: str, rol: str, almacen: versiones.AlmacenVersiones | None = None,
+               usuario: str | None = None) -> Plan:
+    """Elige la vía de análisis; sin ``almacen`` no se buscan versiones anteriores."""
+    anterior = almacen.buscar_anterior(texto, area, rol, usuario) if almacen is not None else None
+    cambios = versiones.diferencia(anterior, texto) if anterior else None
+    if cambios is not None and cambios.sin_cambios:
+        versiones.ANALISIS_VERSIONES.inc(tipo="sin_cambios")
+        return Plan("sin_cambios", anterior, cambios)
+    if cambios is not None and cambios.incremental:
+        return Plan("incremental", anterior, cambios)
+    if (prediccion := etapas.predecir_confiable(texto)) is not None:
+        return Plan("etapa_local", anterior, cambios, prediccion.etiqueta)
+    return Plan("completo", anterior, cambios)
+
+
+def ejecutar(plan: Plan, texto: str, assistant_id: str, area: str, rol: str, thread_id: str,
+             registrar: asistente.Registrar = asistente.sin_registro) -> dict | None:
+    """Análisis del documento por la vía del plan (``None`` si el asistente falla)."""
+    if plan.via == "sin_cambios":
+        return plan.anterior.analisis
+    if plan.via == "incremental":
+        return asistente.analizar_incremental(
+            plan.cambios.nuevo, plan.anterior.analisis, assistant_id, area, rol, thread_id, registrar
+        )
+    if plan.via == "etapa_local":
+        return asistente.pedir_soluciones(texto, plan.etapa, assistant_id, area, rol, thread_id, registrar)
+    return asistente.analizar(texto, assistant_id, area, rol, thread_id, registrar)
+
+
+def registrar_version(plan: Plan, texto: str, area: str, rol: str, analisis: dict,
+                      almacen: versiones.AlmacenVersiones, usuario: str | None = None) -> versiones.VersionCaso:
+    """Registra el texto analizado como versión (la siguiente de la anterior, si la hay)."""
+    version = almacen.registrar(texto, area, rol, analisis, plan.anterior, usuario)
+    versiones.ANALISIS_VERSIONES.inc(tipo=plan.via)
+    if plan.via == "incremental":
+        enviado = min(len(texto), asistente.MAX_DOC_CHARS)
+        versiones.CARACTERES_EVITADOS.inc(max(enviado - len(plan.cambios.nuevo), 0))
+    return version
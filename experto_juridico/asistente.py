@@ -0,0 +1,361 @@
+"""Llamadas al asistente de OpenAI (análisis y redacción), sin Streamlit.
+
+Las funciones reciben de forma explícita el thread de OpenAI en el que
+conversan y, opcionalmente, una función ``registrar(role, contenido,
+metadata)`` que guarda cada mensaje en el historial; así las usan tanto la
+aplicación (con el thread y el caso de la sesión) como el procesamiento por
+lotes (un thread por expediente).
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Callable, Optional
+
+from experto_juridico import formatos, metricas
+
+ASSISTANT_IDS = {
+    "Derecho Civil": "asst_JEqVhFH9ertyrJTGFNq1zIZ0",
+    "Derecho de Familia": "asst_k72lXItROiR9tgnDBiqmWf9j",
+}
+
+ROLES_PROCESALES = ["Demandante", "Demandado"]
+
+MAX_DOC_CHARS = 100_000  # límite para evitar desbordar tokens
+# Con la etapa ya clasificada localmente basta un extracto: el inicio (partes,
+# pretensión) y sobre todo el final (actuaciones más recientes). El thread
+# solo recibe ese extracto; para redactar hay que enviarle el documento completo
+MAX_DOC_CHARS_SOLUCIONES = 30_000
+
+ESTADOS_FINALES = {"completed", "failed", "cancelled", "expired"}
+
+# Alias evaluado al importar: sin ``dict | None``, que no existe antes de Python 3.10
+Registrar = Callable[[str, str, Optional[dict]], None]
+
+
+def sin_registro(role: str, contenido: str, metadata: dict | None = None) -> None:
+    pass
+
+
+def crear_thread() -> str:
+    """Crea un thread nuevo y devuelve su id."""
+    import openai
+
+    return openai.beta.threads.create().id
+
+
+def esperar_runs_activos(thread_id: str) -> None:
+    """Espera a que terminen los runs en curso del thread (no admite mensajes mientras tanto)."""
+    import openai
+
+    with metricas.medir("asistente_espera_runs_activos"):
+        runs = openai.beta.threads.runs.list(thread_id=thread_id)
+        for run in runs.data:
+            if run.status not in ESTADOS_FINALES:
+                while True:
+                    time.sleep(1)
+                    run = openai.beta.threads.runs.retrieve(
+                        thread_id=thread_id,
+                        run_id=run.id
+                    )
+                    if run.status in ESTADOS_FINALES:
+                        break
+
+
+def enviar_mensaje_y_esperar(mensaje: str, assistant_id: str, thread_id: str) -> str | None:
+    """Envía un mensaje al thread y espera la respuesta."""
+    import openai
+
+    # Verificar y esperar si hay runs activos
+    esperar_runs_activos(thread_id)
+
+    # Agregar el mensaje al thread existente
+    with metricas.medir("asistente_crear_mensaje"):
+        openai.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=mensaje
+        )
+
+    # Ejecutar el asistente
+    with metricas.medir("asistente_crear_run"):
+        run = openai.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id
+        )
+
+    # Esperar la respuesta
+    with metricas.medir("asistente_sondeo_run"):
+        while run.status not in ESTADOS_FINALES:
+            time.sleep(1)
+            run = openai.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id
+            )
+
+    metricas.RUNS.inc(estado=run.status)
+    if run.status != "completed":
+        return None
+    metricas.registrar_uso(getattr(run, "usage", None))
+
+    # Obtener la última respuesta
+    with metricas.medir("asistente_obtener_mensajes"):
+        messages = openai.beta.threads.messages.list(
+            thread_id=thread_id
+        )
+    return messages.data[0].content[0].text.value.strip()
+
+
+def agregar_documento(document_text: str, thread_id: str) -> str:
+    """Deja el documento en el thread como contexto, sin ejecutar el asistente (id del mensaje)."""
+    import openai
+
+    esperar_runs_activos(thread_id)
+    with metricas.medir("asistente_crear_mensaje"):
+        return openai.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=mensaje_documento(document_text[:MAX_DOC_CHARS]),
+        ).id
+
+
+def interpretar_json(reply: str, assistant_id: str, thread_id: str) -> dict:
+    """Convierte la respuesta del asistente en JSON, pidiéndole que la corrija si no lo es."""
+    try:
+        data = json.loads(reply)
+    except json.JSONDecodeError:
+        # Intentar repararlo con un modelo de corrección rápida
+        with metricas.medir("reparacion_json"):
+            mensaje_correccion = "Corrige para que sea JSON válido sin comentarios.\n\n" + reply
+            reply_corregido = enviar_mensaje_y_esperar(mensaje_correccion, assistant_id, thread_id)
+            data = json.loads(reply_corregido)
+
+    return data
+
+
+###############################################################################
+# Prompts
+###############################################################################
+
+def mensaje_analisis(doc_chunk: str, area: str, rol: str) -> str:
+    """Prompt del análisis completo: etapa procesal y tres soluciones."""
+    return (
+        f"Actúa como asistente jurídico en favor del {rol}. "
+        "Analiza el siguiente documento legal y responde EXCLUSIVAMENTE "
+                    "con un JSON que contenga las claves 'etapa_proceso' (string) "
+        "y 'soluciones' (lista de EXACTAMENTE 3 strings numerados del 1-3, "
+        f"que representen las mejores opciones legales para el {rol} "
+        "en el siguiente paso procesal). No incluyas ningún texto adicional.\n\n"
+                    f"Área de especialidad: {area}.\n\nDocumento:\n{doc_chunk}"
+    )
+
+
+def mensaje_incremental(nuevo_chunk: str, analisis_previo: dict, area: str, rol: str) -> str:
+    """Prompt que actualiza un análisis previo con el material nuevo del expediente."""
+    return (
+        f"Actúa como asistente jurídico en favor del {rol}. "
+        "Ya analizaste una versión anterior de este expediente, con este resultado:\n"
+        f"{json.dumps(analisis_previo, ensure_ascii=False)}\n\n"
+        "Desde entonces se incorporaron al expediente los fragmentos nuevos que siguen "
+        "('[...]' separa fragmentos no contiguos). Actualiza el análisis teniendo en cuenta "
+        "el material nuevo y responde EXCLUSIVAMENTE con un JSON que contenga las claves "
+        "'etapa_proceso' (string) y 'soluciones' (lista de EXACTAMENTE 3 strings numerados "
+        f"del 1-3, que representen las mejores opciones legales para el {rol} en el siguiente "
+        "paso procesal). No incluyas ningún texto adicional.\n\n"
+        f"Área de especialidad: {area}.\n\nFragmentos nuevos:\n{nuevo_chunk}"
+    )
+
+
+def mensaje_soluciones(doc_chunk: str, etapa: str, area: str, rol: str) -> str:
+    """Prompt reducido: solo las soluciones, con la etapa ya conocida."""
+    return (
+        f"Actúa como asistente jurídico en favor del {rol}. "
+        f"El siguiente documento legal está en la {etapa.lower()}. Responde EXCLUSIVAMENTE "
+        "con un JSON que contenga la clave 'soluciones' (lista de EXACTAMENTE 3 strings "
+        f"numerados del 1-3, que representen las mejores opciones legales para el {rol} "
+        "en el siguiente paso procesal). No incluyas ningún texto adicional.\n\n"
+        f"Área de especialidad: {area}.\n\nDocumento:\n{doc_chunk}"
+    )
+
+
+def mensaje_documento(doc_chunk: str) -> str:
+    """Documento del caso como contexto de los escritos que se pidan después."""
+    return (
+        "Este es el documento completo del expediente. No respondas todavía: úsalo "
+        "como base de hechos para los escritos que te pida a continuación.\n\n"
+        f"Documento:\n{doc_chunk}"
+    )
+
+
+def extremos_documento(texto: str, limite: int) -> str:
+    """Inicio (un tercio del límite) y final (el resto) de un texto largo."""
+    if len(texto) <= limite:
+        return texto
+    inicio = limite // 3
+    return f"{texto[:inicio]}\n[...]\n{texto[-(limite - inicio):]}"
+
+
+###############################################################################
+# Plantillas de redacción
+###############################################################################
+
+# Versión del texto de los prompts. Forma parte de la clave de los resultados
+# cacheados (análisis de la aplicación, huella de los casos de los lotes): hay
+# que subirla con cualquier cambio en los prompts o en las plantillas.
+PROMPT_VERSION = 2
+
+INSTRUCCIONES_COMUNES = """INSTRUCCIONES GENERALES:
+- Usa lenguaje claro y motivado (art. 122 CPC, art. 50 LOPJ)
+- Emplea conectores lógicos ("primero", "además", "por ende")
+- Mantén un tono empático pero firme
+- Vincula los hechos con derechos fundamentales afectados
+- Verifica plazos procesales
+- Cumple el Código de Ética del PJ y checklist CPC
+"""
+
+_ESTRUCTURAS = {
+    "ESCRITO": """Redacta un ESCRITO JUDICIAL siguiendo EXACTAMENTE esta estructura:
+
+1. ENCABEZADO: órgano, expediente N°, materia (mayúsculas centradas)
+2. IDENTIFICACIÓN: datos completos de partes y apoderados (DNI/RUC, domicilio, casilla, poder)
+3. EXPOSICIÓN FÁCTICA: usa método PASTOR (Problem-Amplify-Story-Transformation-Offer-Request)
+4. FUNDAMENTOS DE DERECHO: normas (CPC, CC, Constitución) y precedentes con conectores lógicos
+5. PETITORIO: ítems numerados con verbos imperativos
+6. MEDIOS PROBATORIOS: lista ANEXO 1-n con descripción y folios
+7. FIRMA Y CIERRE: lugar, fecha, firma, CAPE, casilla
+""",
+    "REGULAR": """Redacta una PIEZA PROCESAL COMPLETA siguiendo EXACTAMENTE esta estructura:
+
+1. ENCABEZADO: órgano, tipo de acción, expediente
+2. PARTES Y APODERADOS: datos completos y legitimación
+3. COMPETENCIA: fundamento legal (territorial/cuantía)
+4. PETITORIO: pretensiones principales y subsidiarias valoradas
+5. FUNDAMENTOS DE HECHO: cronología con cierre jurídico
+6. FUNDAMENTOS DE DERECHO: artículos y precedentes (incluir arts. 2-3-139 Const.)
+7. REQUISITOS DE ADMISIBILIDAD: checklist CPC 130-135
+8. MEDIOS PROBATORIOS: descripción + finalidad probatoria
+9. ANEXOS: documentos numerados y foliados
+10. PLAZO/AGRAVIO: cómputo detallado si aplica
+11. PETICIÓN Y COSTAS: art. 56 CPC
+12. FIRMA Y CIERRE: datos completos con CAPE
+""",
+}
+
+# Prefijo fijo de cada formato, compilado una sola vez al importar: estructura
+# e instrucciones comunes son idénticas byte a byte en todos los pedidos, de
+# modo que el proveedor puede reutilizar el procesamiento del prefijo (caché
+# de prompts). Lo que varía por caso va siempre al final.
+PLANTILLAS_REDACCION = {
+    formato: f"{estructura}\n{INSTRUCCIONES_COMUNES}" for formato, estructura in _ESTRUCTURAS.items()
+}
+
+_DATOS_CASO = "\nÁrea: {area}\nRol procesal: {rol}\nEtapa actual: {etapa}\nSolución elegida: {solucion}\n"
+
+
+def generar_prompt_redaccion(formato: str, solucion: str, area: str, rol: str, etapa: str) -> str:
+    """Genera el prompt específico según el formato requerido (prefijo fijo y datos del caso)."""
+    prefijo = PLANTILLAS_REDACCION.get(formato, PLANTILLAS_REDACCION["REGULAR"])
+    return prefijo + _DATOS_CASO.format(area=area, rol=rol, etapa=etapa, solucion=solucion)
+
+###############################################################################
+# Análisis y redacción
+###############################################################################
+
+def analizar(document_text: str, assistant_id: str, area: str, rol: str, thread_id: str,
+             registrar: Registrar = sin_registro) -> dict | None:
+    """Envía el documento al asistente y obtiene la etapa procesal y soluciones."""
+    # Reducir a tamaño manejable
+    doc_chunk = document_text[:MAX_DOC_CHARS]
+
+    # Registrar la consulta en el historial
+    registrar('user', doc_chunk, {'area': area, 'assistant_id': assistant_id, 'rol': rol})
+
+    reply = enviar_mensaje_y_esperar(mensaje_analisis(doc_chunk, area, rol), assistant_id, thread_id)
+    if not reply:
+        registrar('assistant', 'Error: No se pudo completar el análisis', {'status': 'failed'})
+        return None
+
+    # Registrar la respuesta en el historial (área y rol permiten filtrar la búsqueda)
+    registrar('assistant', reply, {'thread_id': thread_id, 'area': area, 'rol': rol})
+
+    return interpretar_json(reply, assistant_id, thread_id)
+
+
+def analizar_incremental(nuevo_material: str, analisis_previo: dict, assistant_id: str, area: str, rol: str,
+                         thread_id: str, registrar: Registrar = sin_registro) -> dict | None:
+    """Actualiza un análisis previo enviando solo el material nuevo del expediente."""
+    nuevo_chunk = nuevo_material[:MAX_DOC_CHARS]
+    registrar('user', nuevo_chunk, {
+        'area': area, 'assistant_id': assistant_id, 'rol': rol, 'incremental': True,
+    })
+
+    mensaje = mensaje_incremental(nuevo_chunk, analisis_previo, area, rol)
+    reply = enviar_mensaje_y_esperar(mensaje, assistant_id, thread_id)
+    if not reply:
+        registrar('assistant', 'Error: No se pudo completar el análisis', {'status': 'failed'})
+        return None
+
+    registrar('assistant', reply, {'thread_id': thread_id, 'area': area, 'rol': rol, 'incremental': True})
+    return interpretar_json(reply, assistant_id, thread_id)
+
+
+def pedir_soluciones(document_text: str, etapa: str, assistant_id: str, area: str, rol: str,
+                     thread_id: str, registrar: Registrar = sin_registro) -> dict | None:
+    """Pide solo las soluciones, con la etapa procesal ya determinada localmente.
+
+    Envía un extracto del documento (``MAX_DOC_CHARS_SOLUCIONES``); ``None`` si
+    el asistente falla o su respuesta no trae soluciones.
+    """
+    doc_chunk = extremos_documento(document_text, MAX_DOC_CHARS_SOLUCIONES)
+    registrar('user', doc_chunk, {
+        'area': area, 'assistant_id': assistant_id, 'rol': rol, 'etapa_local': etapa,
+    })
+
+    reply = enviar_mensaje_y_esperar(mensaje_soluciones(doc_chunk, etapa, area, rol), assistant_id, thread_id)
+    if not reply:
+        registrar('assistant', 'Error: No se pudo completar el análisis', {'status': 'failed'})
+        return None
+
+    registrar('assistant', reply, {'thread_id': thread_id, 'area': area, 'rol': rol, 'etapa_local': etapa})
+    data = interpretar_json(reply, assistant_id, thread_id)
+    soluciones = data.get('soluciones') if isinstance(data, dict) else None
+    if not isinstance(soluciones, list) or not soluciones:
+        return None
+    return {'etapa_proceso': etapa, 'soluciones': soluciones}
+
+
+def redactar(solution: str, stage: str, assistant_id: str, area: str, rol: str, thread_id: str,
+             registrar: Registrar = sin_registro, documento: str | None = None) -> str | None:
+    """Solicita al asistente la redacción del escrito judicial (``None`` si falla).
+
+    Con ``documento``, se deja antes en el thread: hace falta cuando el análisis
+    no le envió el documento completo (análisis reutilizado, incremental o sobre
+    un extracto), porque el escrito se redacta con lo que el thread contiene.
+    """
+    if documento is not None:
+        agregar_documento(documento, thread_id)
+
+    # Determinar el formato necesario
+    formato = formatos.determinar_formato(solution)
+
+    # Generar el prompt específico
+    prompt = generar_prompt_redaccion(formato, solution, area, rol, stage)
+
+    # Registrar la solicitud de redacción
+    registrar('user', prompt, {
+        'area': area,
+        'stage': stage,
+        'solution': solution,
+        'formato': formato,
+        'rol': rol,
+        'assistant_id': assistant_id
+    })
+
+    response = enviar_mensaje_y_esperar(prompt, assistant_id, thread_id)
+    if not response:
+        return None
+
+    # Registrar la respuesta
+    registrar('assistant', response, {'thread_id': thread_id, 'formato': formato, 'area': area, 'rol': rol})
+
+    return response
@@ -0,0 +1,586 @@
+"""Modo diferido del procesamiento por lotes, sobre la Batch API de OpenAI.
+
+Para trabajo masivo sin urgencia, en lugar de un run interactivo del
+asistente por documento (con sondeo cada segundo) las solicitudes de análisis
+y de redacción se empaquetan en archivos JSONL y se envían como lotes
+asíncronos: el rendimiento lo limita la cuota de la Batch API y no el
+sondeo, y cuestan menos.
+
+La Batch API no admite Assistants, así que cada solicitud es una
+chat completion autocontenida con los mismos prompts que el modo interactivo
+(``asistente.mensaje_analisis`` y ``asistente.generar_prompt_redaccion``): la
+redacción reenvía el documento y el análisis como turnos previos, en lugar de
+apoyarse en el thread. Las instrucciones propias de cada asistente no viajan;
+se sustituyen por ``EJ_BATCH_INSTRUCCIONES``. Como todas las solicitudes de un
+caso empiezan igual, llevan la misma ``prompt_cache_key`` para que el
+proveedor reutilice ese prefijo.
+
+Cada ejecución avanza el estado: recoge los lotes terminados, escribe las
+salidas (las mismas que el modo interactivo: ``<caso>.analisis.json`` y
+``<caso>.borrador-<n>.docx``) y envía lo que falta: el análisis de los casos
+nuevos y la redacción de los casos ya analizados. ``manifiesto.json`` guarda
+los lotes, su estado y qué solicitud (``custom_id``) corresponde a cada caso.
+Con ``--esperar`` repite hasta terminar; con ``--local`` usa un sustituto sin
+red que responde al instante, para pruebas.
+
+Uso:
+    python -m experto_juridico.batch expedientes/ --area "Derecho Civil" --rol Demandante --soluciones 1,2
+    python -m experto_juridico.batch expedientes/ --area "Derecho Civil" --rol Demandante --esperar
+    python -m experto_juridico.batch expedientes/ --area "Derecho Civil" --rol Demandante --local --esperar --intervalo 0
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Iterator, Protocol
+
+from experto_juridico import asistente, exportacion, formatos, lote, metricas
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "/v1/chat/completions"
+MODELO = os.getenv("EJ_BATCH_MODELO", "gpt-4o")
+RUTA_INSTRUCCIONES = os.getenv("EJ_BATCH_INSTRUCCIONES")
+INSTRUCCIONES_POR_DEFECTO = (
+    "Eres un asistente jurídico experto en {area} del ordenamiento peruano. Respondes con "
+    "precisión técnica, citando normas y jurisprudencia pertinentes, y sigues al pie de la "
+    "letra el formato de respuesta que se te pide."
+)
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+DIRECTORIO_LOTES = "lotes"
+# Límites de la Batch API por archivo de entrada (con margen en el tamaño)
+MAX_SOLICITUDES_LOTE = 50_000
+MAX_BYTES_LOTE = 190 * 1024 * 1024
+ESTADOS_FINALES = {"completed", "failed", "expired", "cancelled"}
+INTERVALO = 60
+
+SOLICITUDES_BATCH = metricas.REGISTRO.contador(
+    "experto_juridico_batch_solicitudes_total",
+    "Solicitudes de la Batch API por fase (analisis, redaccion) y resultado (enviada, completada, error).",
+    ("fase", "resultado"),
+)
+
+
+def instrucciones(area: str) -> str:
+    """Mensaje de sistema que sustituye a las instrucciones del asistente."""
+    if RUTA_INSTRUCCIONES:
+        return Path(RUTA_INSTRUCCIONES).read_text(encoding="utf-8").format(area=area)
+    return INSTRUCCIONES_POR_DEFECTO.format(area=area)
+
+
+def mensajes_analisis(texto: str, area: str, rol: str) -> list[dict]:
+    doc_chunk = texto[:asistente.MAX_DOC_CHARS]
+    return [
+        {"role": "system", "content": instrucciones(area)},
+        {"role": "user", "content": asistente.mensaje_analisis(doc_chunk, area, rol)},
+    ]
+
+
+def mensajes_redaccion(texto: str, analisis: dict, solucion: str, area: str, rol: str) -> list[dict]:
+    """La conversación del modo interactivo: documento, análisis y pedido de redacción."""
+    formato = formatos.determinar_formato(solucion)
+    prompt = asistente.generar_prompt_redaccion(formato, solucion, area, rol, analisis.get("etapa_proceso", ""))
+    return mensajes_analisis(texto, area, rol) + [
+        {"role": "assistant", "content": json.dumps(analisis, ensure_ascii=False)},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def solicitud(custom_id: str, mensajes: list[dict], respuesta_json: bool) -> dict:
+    # Las solicitudes de un caso comparten el prefijo (sistema, documento y, en
+    # la redacción, el análisis y la plantilla fija): con la misma clave de
+    # caché el proveedor las enruta juntas y reutiliza ese prefijo
+    clave = custom_id.partition("-")[0]
+    cuerpo = {"model": MODELO, "messages": mensajes,
+              "prompt_cache_key": f"ej-v{asistente.PROMPT_VERSION}-{clave}"}
+    if respuesta_json:
+        # Garantiza JSON válido: no hay turno para pedir que se corrija
+        cuerpo["response_format"] = {"type": "json_object"}
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": cuerpo}
+
+
+###############################################################################
+# Backends
+###############################################################################
+
+@dataclass(frozen=True)
+class EstadoLote:
+    id: str
+    estado: str
+    archivo_salida: str | None = None
+    archivo_errores: str | None = None
+    total: int = 0
+    completadas: int = 0
+    fallidas: int = 0
+    creado: float = 0.0
+    terminado: float | None = None
+
+
+class Backend(Protocol):
+    def subir(self, ruta: Path) -> str: ...
+    def crear(self, archivo_id: str, metadata: dict[str, str]) -> EstadoLote: ...
+    def consultar(self, lote_id: str) -> EstadoLote: ...
+    def descargar(self, archivo_id: str, destino: Path) -> None: ...
+
+
+class BackendOpenAI:
+    """Batch API de OpenAI (el cliente se importa al crear el backend)."""
+
+    def __init__(self):
+        import openai
+
+        self._openai = openai
+
+    @staticmethod
+    def _estado(batch) -> EstadoLote:
+        conteos = batch.request_counts
+        return EstadoLote(
+            id=batch.id,
+            estado=batch.status,
+            archivo_salida=batch.output_file_id,
+            archivo_errores=batch.error_file_id,
+            total=conteos.total if conteos else 0,
+            completadas=conteos.completed if conteos else 0,
+            fallidas=conteos.failed if conteos else 0,
+            creado=float(batch.created_at),
+            terminado=batch.completed_at or batch.failed_at or batch.expired_at or batch.cancelled_at,
+        )
+
+    def subir(self, ruta: Path) -> str:
+        with open(ruta, "rb") as f:
+            return self._openai.files.create(file=f, purpose="batch").id
+
+    def crear(self, archivo_id: str, metadata: dict[str, str]) -> EstadoLote:
+        return self._estado(self._openai.batches.create(
+            input_file_id=archivo_id, endpoint=ENDPOINT, completion_window="24h", metadata=metadata,
+        ))
+
+    def consultar(self, lote_id: str) -> EstadoLote:
+        return self._estado(self._openai.batches.retrieve(lote_id))
+
+    def descargar(self, archivo_id: str, destino: Path) -> None:
+        with self._openai.files.with_streaming_response.content(archivo_id) as respuesta:
+            respuesta.stream_to_file(destino)
+
+
+def respuesta_local(cuerpo: dict) -> dict:
+    """Respuesta simulada con la forma de una chat completion (sin llamar a la API)."""
+    ultimo = cuerpo["messages"][-1]["content"]
+    if cuerpo.get("response_format", {}).get("type") == "json_object":
+        contenido = json.dumps({
+            "etapa_proceso": "Etapa postulatoria",
+            "soluciones": [
+                "1. Contestar la demanda dentro del plazo de ley",
+                "2. Deducir excepciones procesales",
+                "3. Ofrecer medios probatorios adicionales",
+            ],
+        }, ensure_ascii=False)
+    else:
+        elegida = re.search(r"Solución elegida: (.*)", ultimo)
+        contenido = (
+            "ENCABEZADO\n[SIMULACIÓN LOCAL]\nEXPOSICIÓN FÁCTICA\nBorrador generado sin llamar a la API.\n"
+            f"PETITORIO\n1. {elegida.group(1).strip() if elegida else ''}\nFIRMA Y CIERRE\n"
+        )
+    prompt = sum(len(m["content"]) for m in cuerpo["messages"]) // 4
+    return {
+        "id": "chatcmpl-local",
+        "object": "chat.completion",
+        "model": cuerpo.get("model", MODELO),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": len(contenido) // 4,
+                  "total_tokens": prompt + len(contenido) // 4},
+    }
+
+
+class BackendLocal:
+    """Sustituto local de la Batch API para pruebas.
+
+    Guarda archivos y lotes en ``directorio``; cada consulta avanza el lote un
+    estado (``validating`` → ``in_progress`` → ``completed``) y al completarlo
+    responde cada solicitud con ``responder``. Si ``responder`` lanza una
+    excepción, la solicitud va al archivo de errores, como en la API.
+    """
+
+    def __init__(self, directorio: Path, responder: Callable[[dict], dict] = respuesta_local):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.responder = responder
+        self._ruta_estado = self.directorio / "lotes.json"
+
+    def _lotes(self) -> dict:
+        return lote.leer_registro(self._ruta_estado) or {}
+
+    def _guardar(self, lotes: dict) -> None:
+        lote.guardar_registro(self._ruta_estado, lotes)
+
+    def subir(self, ruta: Path) -> str:
+        archivo_id = "file-local-" + lote.sha256_archivo(ruta)[:16]
+        shutil.copyfile(ruta, self.directorio / archivo_id)
+        return archivo_id
+
+    def crear(self, archivo_id: str, metadata: dict[str, str]) -> EstadoLote:
+        lotes = self._lotes()
+        lote_id = f"batch-local-{len(lotes) + 1}"
+        with open(self.directorio / archivo_id, encoding="utf-8") as f:
+            total = sum(1 for linea in f if linea.strip())
+        estado = EstadoLote(lote_id, "validating", total=total, creado=time.time())
+        lotes[lote_id] = {**asdict(estado), "entrada": archivo_id, "metadata": metadata}
+        self._guardar(lotes)
+        return estado
+
+    def _procesar(self, lote_id: str, datos: dict) -> None:
+        salida, errores = self.directorio / f"{lote_id}-salida", self.directorio / f"{lote_id}-errores"
+        completadas = fallidas = 0
+        with open(self.directorio / datos["entrada"], encoding="utf-8") as entrada, \
+                open(salida, "w", encoding="utf-8") as f_salida, open(errores, "w", encoding="utf-8") as f_errores:
+            for numero, linea in enumerate(entrada):
+                if not linea.strip():
+                    continue
+                pedido = json.loads(linea)
+                try:
+                    cuerpo = self.responder(pedido["body"])
+                except Exception as exc:
+                    fallidas += 1
+                    f_errores.write(json.dumps({
+                        "id": f"req-{numero}", "custom_id": pedido["custom_id"], "response": None,
+                        "error": {"code": "local_error", "message": str(exc)},
+                    }, ensure_ascii=False) + "\n")
+                    continue
+                completadas += 1
+                f_salida.write(json.dumps({
+                    "id": f"req-{numero}", "custom_id": pedido["custom_id"],
+                    "response": {"status_code": 200, "request_id": f"local-{numero}", "body": cuerpo},
+                    "error": None,
+                }, ensure_ascii=False) + "\n")
+        datos.update(
+            estado="completed", completadas=completadas, fallidas=fallidas, terminado=time.time(),
+            archivo_salida=salida.name if completadas else None, archivo_errores=errores.name if fallidas else None,
+        )
+
+    def consultar(self, lote_id: str) -> EstadoLote:
+        lotes = self._lotes()
+        datos = lotes[lote_id]
+        if datos["estado"] == "validating":
+            datos["estado"] = "in_progress"
+        elif datos["estado"] == "in_progress":
+            self._procesar(lote_id, datos)
+        self._guardar(lotes)
+        return EstadoLote(**{k: v for k, v in datos.items() if k not in ("entrada", "metadata")})
+
+    def descargar(self, archivo_id: str, destino: Path) -> None:
+        shutil.copyfile(self.directorio / archivo_id, destino)
+
+
+###############################################################################
+# Envío y recogida
+###############################################################################
+
+def _manifiesto_vacio(opciones: lote.Opciones) -> dict:
+    return {"area": opciones.area, "rol": opciones.rol, "casos": {}, "lotes": {}, "pendientes": {}, "errores": {}}
+
+
+def cargar_manifiesto(opciones: lote.Opciones) -> dict:
+    manifiesto = lote.leer_registro(opciones.salida / ARCHIVO_MANIFIESTO) or _manifiesto_vacio(opciones)
+    if (manifiesto["area"], manifiesto["rol"]) != (opciones.area, opciones.rol):
+        sys.exit(f"{opciones.salida} tiene lotes de {manifiesto['area']} / {manifiesto['rol']}; use otra --salida.")
+    return manifiesto
+
+
+def guardar_manifiesto(opciones: lote.Opciones, manifiesto: dict) -> None:
+    lote.guardar_registro(opciones.salida / ARCHIVO_MANIFIESTO, manifiesto)
+
+
+def _fase(custom_id: str) -> str:
+    return "analisis" if custom_id.endswith("-analisis") else "redaccion"
+
+
+def _solicitudes_pendientes(carpeta: Path, opciones: lote.Opciones, manifiesto: dict) -> Iterator[dict]:
+    """Solicitudes que faltan: análisis de casos nuevos y redacción de los ya analizados.
+
+    Las que ya están en un lote en curso o agotaron sus reintentos no se repiten.
+    """
+    for caso in lote.casos(carpeta, opciones.salida):
+        huella = lote.huella_caso(caso, opciones.area, opciones.rol)
+        clave = huella[:16]
+        manifiesto["casos"][clave] = {"caso": caso.nombre, "huella": huella, "archivos": [str(r) for r in caso.archivos]}
+        registro = lote.leer_registro(opciones.salida / f"{caso.nombre}.analisis.json")
+        if registro is not None and registro.get("huella") == huella:
+            hechos = {
+                numero for numero, borrador in registro["borradores"].items()
+                if (opciones.salida / borrador["archivo"]).exists()
+            }
+            disponibles = len(registro["analisis"].get("soluciones") or [])
+            ids = [
+                f"{clave}-borrador-{n}" for n in opciones.soluciones
+                if str(n) not in hechos and n <= disponibles
+            ]
+        else:
+            registro, ids = None, [f"{clave}-analisis"]
+        ids = [
+            i for i in ids
+            if i not in manifiesto["pendientes"]
+            and manifiesto["errores"].get(i, {}).get("intentos", 0) <= opciones.reintentos
+        ]
+        if not ids:
+            continue
+        try:
+            texto = lote.extraer_caso(caso)
+        except lote.ErrorCaso as exc:
+            logger.warning("%s: %s", caso.nombre, exc)
+            continue
+        for custom_id in ids:
+            if registro is None:
+                yield solicitud(custom_id, mensajes_analisis(texto, opciones.area, opciones.rol), True)
+            else:
+                numero = int(custom_id.rsplit("-", 1)[1])
+                solucion = registro["analisis"]["soluciones"][numero - 1]
+                mensajes = mensajes_redaccion(texto, registro["analisis"], solucion, opciones.area, opciones.rol)
+                yield solicitud(custom_id, mensajes, False)
+
+
+def _crear_lote(ruta: Path, ids: list[str], opciones: lote.Opciones, backend: Backend, manifiesto: dict) -> None:
+    estado = backend.crear(backend.subir(ruta), {"area": opciones.area, "rol": opciones.rol})
+    manifiesto["lotes"][estado.id] = {**asdict(estado), "entrada": ruta.name, "recogido": False}
+    for custom_id in ids:
+        manifiesto["pendientes"][custom_id] = estado.id
+        SOLICITUDES_BATCH.inc(fase=_fase(custom_id), resultado="enviada")
+    guardar_manifiesto(opciones, manifiesto)
+
+
+def enviar(carpeta: Path, opciones: lote.Opciones, backend: Backend, manifiesto: dict) -> int:
+    """Escribe y envía los lotes con las solicitudes pendientes; devuelve cuántas envió."""
+    directorio = opciones.salida / DIRECTORIO_LOTES
+    directorio.mkdir(parents=True, exist_ok=True)
+    enviadas = 0
+    archivo, ruta, ids, tamano = None, None, [], 0
+    try:
+        for pedido in _solicitudes_pendientes(carpeta, opciones, manifiesto):
+            linea = (json.dumps(pedido, ensure_ascii=False) + "\n").encode("utf-8")
+            if archivo is not None and (len(ids) >= MAX_SOLICITUDES_LOTE or tamano + len(linea) > MAX_BYTES_LOTE):
+                archivo.close()
+                _crear_lote(ruta, ids, opciones, backend, manifiesto)
+                enviadas += len(ids)
+                archivo = None
+            if archivo is None:
+                ruta = directorio / f"entrada-{len(manifiesto['lotes']) + 1:04d}.jsonl"
+                archivo, ids, tamano = open(ruta, "wb"), [], 0
+            archivo.write(linea)
+            ids.append(pedido["custom_id"])
+            tamano += len(linea)
+        if archivo is not None:
+            archivo.close()
+            _crear_lote(ruta, ids, opciones, backend, manifiesto)
+            enviadas += len(ids)
+    finally:
+        if archivo is not None and not archivo.closed:
+            archivo.close()
+    guardar_manifiesto(opciones, manifiesto)
+    return enviadas
+
+
+def _aplicar(resultado: dict, lote_id: str, opciones: lote.Opciones, manifiesto: dict) -> None:
+    """Escribe la salida de una respuesta del lote en el caso al que corresponde."""
+    custom_id = resultado["custom_id"]
+    clave, _, tipo = custom_id.partition("-")
+    caso = manifiesto["casos"].get(clave)
+    respuesta = resultado.get("response") or {}
+    if caso is None:
+        raise ValueError("solicitud de un caso desconocido")
+    if resultado.get("error") or respuesta.get("status_code") != 200:
+        error = resultado.get("error") or respuesta.get("body", {}).get("error") or {}
+        raise ValueError(error.get("message") or f"estado HTTP {respuesta.get('status_code')}")
+    cuerpo = respuesta["body"]
+    metricas.registrar_uso(SimpleNamespace(**cuerpo.get("usage") or {}))
+    contenido = cuerpo["choices"][0]["message"]["content"].strip()
+
+    ruta_registro = opciones.salida / f"{caso['caso']}.analisis.json"
+    if tipo == "analisis":
+        analisis = json.loads(contenido)
+        if not isinstance(analisis.get("soluciones"), list):
+            raise ValueError("la respuesta no tiene la lista de soluciones")
+        for anterior in opciones.salida.glob(f"{caso['caso']}.borrador-*.docx"):
+            anterior.unlink()
+        lote.guardar_registro(ruta_registro, {
+            "caso": caso["caso"],
+            "archivos": caso["archivos"],
+            "huella": caso["huella"],
+            "area": opciones.area,
+            "rol": opciones.rol,
+            "thread_id": None,
+            "via": "batch",
+            "batch_id": lote_id,
+            "modelo": cuerpo.get("model", MODELO),
+            "fecha": datetime.now().isoformat(),
+            "analisis": analisis,
+            "borradores": {},
+        })
+        return
+
+    registro = lote.leer_registro(ruta_registro)
+    if registro is None or registro.get("huella") != caso["huella"]:
+        raise ValueError("el análisis del caso cambió desde que se pidió el borrador")
+    numero = int(tipo.rsplit("-", 1)[1])
+    solucion = registro["analisis"]["soluciones"][numero - 1]
+    archivo = f"{caso['caso']}.borrador-{numero}.docx"
+    lote.escribir_atomico(opciones.salida / archivo, exportacion.construir_docx(contenido))
+    registro["borradores"][str(numero)] = {
+        "solucion": solucion,
+        "formato": formatos.determinar_formato(solucion),
+        "archivo": archivo,
+        "caracteres": len(contenido),
+        "batch_id": lote_id,
+    }
+    lote.guardar_registro(ruta_registro, registro)
+
+
+def recoger(opciones: lote.Opciones, backend: Backend, manifiesto: dict) -> int:
+    """Consulta los lotes en curso y aplica los terminados; devuelve las respuestas aplicadas."""
+    directorio = opciones.salida / DIRECTORIO_LOTES
+    aplicadas = 0
+    for lote_id, datos in manifiesto["lotes"].items():
+        if datos["recogido"]:
+            continue
+        estado = backend.consultar(lote_id)
+        datos.update(asdict(estado))
+        if estado.estado not in ESTADOS_FINALES:
+            continue
+        respondidas = set()
+        for archivo_id, sufijo in ((estado.archivo_salida, "salida"), (estado.archivo_errores, "errores")):
+            if not archivo_id:
+                continue
+            ruta = directorio / f"{lote_id}-{sufijo}.jsonl"
+            backend.descargar(archivo_id, ruta)
+            with open(ruta, encoding="utf-8") as f:
+                for linea in f:
+                    if not linea.strip():
+                        continue
+                    resultado = json.loads(linea)
+                    custom_id = resultado["custom_id"]
+                    respondidas.add(custom_id)
+                    try:
+                        _aplicar(resultado, lote_id, opciones, manifiesto)
+                    except Exception as exc:
+                        _registrar_error(manifiesto, custom_id, str(exc) or type(exc).__name__)
+                        continue
+                    manifiesto["errores"].pop(custom_id, None)
+                    SOLICITUDES_BATCH.inc(fase=_fase(custom_id), resultado="completada")
+                    aplicadas += 1
+        # Las solicitudes sin respuesta (lote fallido, expirado o cancelado) se reenvían
+        for custom_id in [c for c, l in manifiesto["pendientes"].items() if l == lote_id]:
+            del manifiesto["pendientes"][custom_id]
+            if custom_id not in respondidas:
+                _registrar_error(manifiesto, custom_id, f"sin respuesta (lote {estado.estado})")
+        datos["recogido"] = True
+        guardar_manifiesto(opciones, manifiesto)
+    guardar_manifiesto(opciones, manifiesto)
+    return aplicadas
+
+
+def _registrar_error(manifiesto: dict, custom_id: str, motivo: str) -> None:
+    anterior = manifiesto["errores"].get(custom_id, {})
+    manifiesto["errores"][custom_id] = {"intentos": anterior.get("intentos", 0) + 1, "error": motivo}
+    SOLICITUDES_BATCH.inc(fase=_fase(custom_id), resultado="error")
+    logger.warning("%s: %s", custom_id, motivo)
+
+
+def resumen(opciones: lote.Opciones, manifiesto: dict) -> dict:
+    """Estado de los casos y rendimiento de los lotes terminados."""
+    casos = manifiesto["casos"].values()
+    registros = [lote.leer_registro(opciones.salida / f"{c['caso']}.analisis.json") for c in casos]
+    analizados = [r for r, c in zip(registros, casos) if r and r.get("huella") == c["huella"]]
+    terminados = [d for d in manifiesto["lotes"].values() if d["terminado"]]
+    solicitudes = sum(d["completadas"] for d in terminados)
+    segundos = sum(d["terminado"] - d["creado"] for d in terminados)
+    return {
+        "casos": len(manifiesto["casos"]),
+        "analizados": len(analizados),
+        "borradores": sum(len(r["borradores"]) for r in analizados),
+        "lotes_en_curso": sum(not d["recogido"] for d in manifiesto["lotes"].values()),
+        "solicitudes_pendientes": len(manifiesto["pendientes"]),
+        "errores": {c: e["error"] for c, e in manifiesto["errores"].items()},
+        "lotes_terminados": len(terminados),
+        "solicitudes_completadas": solicitudes,
+        "solicitudes_por_hora": round(solicitudes / segundos * 3600, 1) if segundos else 0.0,
+        "tokens": {tipo: metricas.TOKENS.valor(tipo=tipo) for tipo in ("prompt", "completion", "cacheado")},
+    }
+
+
+def ejecutar(carpeta: Path, opciones: lote.Opciones, backend: Backend, esperar: bool = False,
+             intervalo: float = INTERVALO, al_avanzar: Callable[[dict], None] | None = None) -> dict:
+    """Recoge y envía una vez o, con ``esperar``, hasta que no quede nada en curso."""
+    opciones.salida.mkdir(parents=True, exist_ok=True)
+    manifiesto = cargar_manifiesto(opciones)
+    while True:
+        aplicadas = recoger(opciones, backend, manifiesto)
+        enviadas = enviar(carpeta, opciones, backend, manifiesto)
+        datos = resumen(opciones, manifiesto)
+        if al_avanzar:
+            al_avanzar({**datos, "aplicadas": aplicadas, "enviadas": enviadas})
+        if not esperar or (not manifiesto["pendientes"] and not enviadas):
+            return datos
+        time.sleep(intervalo)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("carpeta", type=Path, help="carpeta con los expedientes (archivos o subcarpetas)")
+    parser.add_argument("--area", required=True, choices=list(asistente.ASSISTANT_IDS))
+    parser.add_argument("--rol", required=True, choices=asistente.ROLES_PROCESALES)
+    parser.add_argument("--salida", type=Path, help="carpeta de resultados (por defecto <carpeta>/resultados)")
+    parser.add_argument("--soluciones", type=lote.lista_soluciones, default=(1,),
+                        help="soluciones que se redactan, p. ej. 1,2,3 (por defecto 1)")
+    parser.add_argument("--reintentos", type=int, default=lote.REINTENTOS,
+                        help="veces que se reenvía una solicitud fallida")
+    parser.add_argument("--esperar", action="store_true", help="repetir hasta que no quede nada en curso")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO, help="segundos entre consultas con --esperar")
+    parser.add_argument("--local", action="store_true", help="sustituto local de la Batch API (sin red)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.local and not os.getenv("OPENAI_API_KEY"):
+        sys.exit("Defina la variable de entorno OPENAI_API_KEY (o use --local).")
+    if not args.carpeta.is_dir():
+        sys.exit(f"No existe la carpeta {args.carpeta}")
+    opciones = lote.Opciones(
+        area=args.area,
+        rol=args.rol,
+        salida=args.salida or args.carpeta / "resultados",
+        soluciones=args.soluciones,
+        reintentos=args.reintentos,
+    )
+    backend = BackendLocal(opciones.salida / "batch_local") if args.local else BackendOpenAI()
+
+    def al_avanzar(datos: dict) -> None:
+        print(
+            f"[{datetime.now():%H:%M:%S}] aplicadas {datos['aplicadas']} · enviadas {datos['enviadas']} "
+            f"· en curso {datos['solicitudes_pendientes']} en {datos['lotes_en_curso']} lote(s)",
+            flush=True,
+        )
+
+    datos = ejecutar(args.carpeta, opciones, backend, args.esperar, args.intervalo, al_avanzar)
+    print(
+        f"\nCasos: {datos['casos']} · analizados {datos['analizados']} · borradores {datos['borradores']} "
+        f"· errores {len(datos['errores'])}"
+    )
+    if datos["lotes_terminados"]:
+        print(
+            f"Lotes terminados: {datos['lotes_terminados']} · {datos['solicitudes_completadas']} solicitudes "
+            f"· {datos['solicitudes_por_hora']:.0f} solicitudes/hora por lote"
+        )
+    if datos["solicitudes_pendientes"]:
+        print("Quedan lotes en curso: vuelva a lanzar el comando más tarde para recoger los resultados.")
+    print(f"Manifiesto en {opciones.salida / ARCHIVO_MANIFIESTO}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""Estado del asistente fuera del proceso de Streamlit, con backends intercambiables.
+
+``st.session_state`` vive en la memoria de un único proceso: si el navegador se
+recarga, el proceso se reinicia o el balanceador envía al usuario a otra
+réplica, el caso en curso se pierde. Aquí se guarda una copia de las claves
+del asistente (paso, área, rol, análisis, textos, thread de OpenAI...) indexada
+por el id de sesión, que el navegador guarda en una cookie firmada (nunca en la
+URL, donde acabaría en enlaces compartidos, el historial del navegador y los
+registros de los proxies).
+
+Dentro de un proceso, cada sesión pertenece a una sola pestaña
+(``TitularesSesion``): una pestaña nueva solo retoma la sesión de la cookie si
+ninguna pestaña viva la tiene abierta, y si no empieza la suya. Cada guardado
+incrementa además la versión del estado (``_version``). Si otra pestaña (p. ej.
+en otra réplica) guardó entretanto, ``SincronizadorEstado`` no sobrescribe sus
+cambios: lanza ``ConflictoEstado`` para que la aplicación pregunte qué versión
+conservar.
+
+Backends (``EJ_ESTADO``):
+
+- ``memoria`` (por defecto): diccionario del proceso; sobrevive a recargas del
+  navegador pero no a reinicios ni a otras réplicas.
+- ``sqlite``: archivo ``EJ_ESTADO_DB`` (por defecto ``sesiones.db``); sustituto
+  local de un almacén clave-valor compartido.
+- ``paquete.modulo:Clase``: cualquier clase que implemente ``AlmacenEstado``
+  (p. ej. un adaptador de Redis).
+
+Los textos grandes se guardan por referencia: el registro de la sesión solo
+contiene el SHA-256 y el contenido se almacena comprimido una vez por hash.
+Dentro del proceso esos textos no están en ``st.session_state`` sino en el
+``GestorMemoria`` (``CLAVES_TEXTO``), de donde se leen al sincronizar.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Protocol
+
+if TYPE_CHECKING:
+    from experto_juridico.memoria import GestorMemoria
+
+# Claves de st.session_state que forman el estado del caso
+CLAVES_PERSISTENTES = (
+    "page",
+    "paso_actual",
+    "area",
+    "rol",
+    "analysis",
+    "document_text",
+    "draft_text",
+    "openai_thread_id",
+    "documento_thread",
+    "caso_id",
+    "contexto_feedback",
+    "usuario",
+)
+# Claves cuyo valor vive en el gestor de memoria en lugar de en session_state
+CLAVES_TEXTO = ("document_text", "draft_text")
+# Textos a partir de este tamaño (caracteres) se guardan por referencia
+UMBRAL_BLOB = 4096
+NIVEL_COMPRESION = 6
+_REFERENCIA = "$blob"
+CLAVE_VERSION = "_version"
+
+
+class AlmacenEstado(Protocol):
+    """Interfaz de un backend de estado de sesión."""
+
+    def cargar(self, sesion: str) -> dict | None:
+        """Estado guardado de la sesión, o None si no existe."""
+
+    def guardar(self, sesion: str, estado: dict) -> None:
+        """Reemplaza el estado guardado de la sesión."""
+
+    def eliminar(self, sesion: str) -> None:
+        """Elimina el estado de la sesión (si existe)."""
+
+    # Opcionales (los backends incluidos los implementan de forma atómica; si
+    # faltan, se emulan con cargar y guardar):
+    #   version(sesion) -> int
+    #   guardar_si_version(sesion, estado, version) -> bool
+
+
+class ConflictoEstado(Exception):
+    """Otra pestaña guardó el estado de la sesión después de que esta lo leyera."""
+
+
+def version_guardada(almacen: AlmacenEstado, sesion: str) -> int:
+    """Versión del estado guardado de la sesión (0 si no existe)."""
+    if hasattr(almacen, "version"):
+        return almacen.version(sesion)
+    estado = almacen.cargar(sesion)
+    return estado.get(CLAVE_VERSION, 0) if estado else 0
+
+
+def guardar_si_version(almacen: AlmacenEstado, sesion: str, estado: dict, version: int) -> bool:
+    """Guarda ``estado`` si la versión guardada sigue siendo ``version`` o no hay estado.
+
+    Sin estado guardado (sesión nueva, o desalojada por inactividad) no hay
+    cambios ajenos que perder.
+    """
+    if hasattr(almacen, "guardar_si_version"):
+        return almacen.guardar_si_version(sesion, estado, version)
+    if version_guardada(almacen, sesion) not in (0, version):
+        return False
+    almacen.guardar(sesion, estado)
+    return True
+
+
+def extraer(session_state) -> dict:
+    """Claves persistentes presentes en ``session_state``."""
+    return {clave: session_state[clave] for clave in CLAVES_PERSISTENTES if clave in session_state}
+
+
+class SincronizadorEstado:
+    """Guarda el estado de una sesión solo cuando cambió desde el último guardado.
+
+    Lleva la versión del estado que esta pestaña leyó o guardó por última vez
+    y solo guarda si el backend sigue en esa versión.
+    """
+
+    def __init__(self, almacen: AlmacenEstado, sesion: str, gestor: GestorMemoria | None = None):
+        self.almacen = almacen
+        self.sesion = sesion
+        self.gestor = gestor
+        self._ultimo: dict | None = None
+        self._version_textos: int | None = None
+        self.version = 0
+
+    def restaurado(self, estado: dict) -> None:
+        """Marca ``estado`` (recién cargado del backend) como ya guardado."""
+        self._ultimo = {
+            k: v for k, v in copy.deepcopy(estado).items() if k not in CLAVES_TEXTO and k != CLAVE_VERSION
+        }
+        self._version_textos = self._version()
+        self.version = estado.get(CLAVE_VERSION, 0)
+
+    def adoptar_version_guardada(self) -> None:
+        """Resuelve un conflicto a favor de esta pestaña: el próximo guardado sobrescribe."""
+        self.version = version_guardada(self.almacen, self.sesion)
+
+    def _version(self) -> int | None:
+        return self.gestor.version(self.sesion) if self.gestor is not None else None
+
+    def sincronizar(self, session_state) -> bool:
+        """Guarda las claves persistentes si cambiaron; devuelve True si guardó.
+
+        Lanza ``ConflictoEstado`` (sin guardar) si otra pestaña guardó antes.
+        """
+        actual = {k: v for k, v in extraer(session_state).items() if k not in CLAVES_TEXTO}
+        version = self._version()
+        if actual == self._ultimo and version == self._version_textos:
+            return False
+        completo = dict(actual)
+        if self.gestor is not None:
+            for clave in CLAVES_TEXTO:
+                texto = self.gestor.obtener(self.sesion, clave)
+                if texto is not None:
+                    completo[clave] = texto
+        else:
+            completo.update(extraer(session_state))
+        completo[CLAVE_VERSION] = self.version + 1
+        if not guardar_si_version(self.almacen, self.sesion, completo, self.version):
+            raise ConflictoEstado(self.sesion)
+        self.version += 1
+        # deepcopy no duplica los str (inmutables), solo los dict/list pequeños
+        # que pueden modificarse en el sitio (p. ej. contexto_feedback)
+        self._ultimo = copy.deepcopy(actual)
+        self._version_textos = version
+        return True
+
+
+class TitularesSesion:
+    """Pestaña que tiene abierta cada sesión en este proceso.
+
+    Los textos del caso (``GestorMemoria``), el thread de OpenAI y el historial
+    se indexan por el id de sesión: dos pestañas con la misma sesión se
+    pisarían el documento y el borrador. ``viva(pestana)`` indica si una
+    pestaña sigue conectada.
+    """
+
+    def __init__(self, viva: Callable[[str], bool]):
+        self._viva = viva
+        self._titulares: dict[str, str] = {}
+        self._limite_poda = 1024
+        self._lock = threading.Lock()
+
+    def reclamar(self, sesion: str, pestana: str) -> bool:
+        """Asigna ``sesion`` a ``pestana``, salvo que la tenga otra pestaña viva."""
+        with self._lock:
+            titular = self._titulares.get(sesion)
+            if titular is not None and titular != pestana and self._viva(titular):
+                return False
+            self._titulares[sesion] = pestana
+            if len(self._titulares) > self._limite_poda:
+                # Las pestañas cerradas no avisan: se olvidan al crecer el registro
+                self._titulares = {s: p for s, p in self._titulares.items() if s == sesion or self._viva(p)}
+                self._limite_poda = max(2 * len(self._titulares), 1024)
+            return True
+
+
+###############################################################################
+# Backends
+###############################################################################
+
+class _Comprimido(bytes):
+    """Texto grande guardado comprimido en ``EstadoMemoria``."""
+
+
+class EstadoMemoria:
+    """Estado en un diccionario del proceso (una sola réplica).
+
+    Los textos grandes se guardan comprimidos: una referencia al str original
+    impediría que el gestor de memoria lo liberase al volcarlo a disco.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sesiones: dict[str, dict] = {}
+
+    def cargar(self, sesion: str) -> dict | None:
+        with self._lock:
+            estado = self._sesiones.get(sesion)
+        if estado is None:
+            return None
+        return {
+            clave: zlib.decompress(valor).decode("utf-8") if isinstance(valor, _Comprimido) else copy.deepcopy(valor)
+            for clave, valor in estado.items()
+        }
+
+    def guardar(self, sesion: str, estado: dict) -> None:
+        registro = self._registro(estado)
+        with self._lock:
+            self._sesiones[sesion] = registro
+
+    def version(self, sesion: str) -> int:
+        with self._lock:
+            return self._sesiones.get(sesion, {}).get(CLAVE_VERSION, 0)
+
+    def guardar_si_version(self, sesion: str, estado: dict, version: int) -> bool:
+        registro = self._registro(estado)
+        with self._lock:
+            if self._sesiones.get(sesion, {}).get(CLAVE_VERSION, 0) not in (0, version):
+                return False
+            self._sesiones[sesion] = registro
+        return True
+
+    @staticmethod
+    def _registro(estado: dict) -> dict:
+        return {
+            clave: _Comprimido(zlib.compress(valor.encode("utf-8"), NIVEL_COMPRESION))
+            if isinstance(valor, str) and len(valor) >= UMBRAL_BLOB
+            else copy.deepcopy(valor)
+            for clave, valor in estado.items()
+        }
+
+    def eliminar(self, sesion: str) -> None:
+        with self._lock:
+            self._sesiones.pop(sesion, None)
+
+
+_ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    sesion TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    datos BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS referencias (
+    sesion TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (sesion, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS referencias_hash ON referencias (hash);
+"""
+
+
+class EstadoSQLite:
+    """Estado en SQLite (WAL) con textos grandes por referencia, compartible entre procesos."""
+
+    def __init__(self, ruta: str | Path = "sesiones.db"):
+        self.ruta = str(ruta)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA_SQLITE)
+
+    @contextmanager
+    def _conexion(self):
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            con.execute("PRAGMA synchronous=NORMAL")
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def cargar(self, sesion: str) -> dict | None:
+        with self._conexion() as con:
+            fila = con.execute("SELECT estado FROM sesiones WHERE sesion = ?", (sesion,)).fetchone()
+            if fila is None:
+                return None
+            estado = json.loads(fila[0])
+            for clave, valor in estado.items():
+                if isinstance(valor, dict) and set(valor) == {_REFERENCIA}:
+                    datos = con.execute("SELECT datos FROM blobs WHERE hash = ?", (valor[_REFERENCIA],)).fetchone()
+                    estado[clave] = zlib.decompress(datos[0]).decode("utf-8") if datos else None
+        return estado
+
+    def guardar(self, sesion: str, estado: dict) -> None:
+        self.guardar_si_version(sesion, estado, None)
+
+    def version(self, sesion: str) -> int:
+        with self._conexion() as con:
+            return self._version_en(con, sesion)
+
+    @staticmethod
+    def _version_en(con: sqlite3.Connection, sesion: str) -> int:
+        fila = con.execute(
+            f"SELECT json_extract(estado, '$.{CLAVE_VERSION}') FROM sesiones WHERE sesion = ?", (sesion,)
+        ).fetchone()
+        return (fila[0] or 0) if fila else 0
+
+    def guardar_si_version(self, sesion: str, estado: dict, version: int | None) -> bool:
+        """Guarda si la versión guardada es ``version`` o no hay estado (con ``None``, siempre)."""
+        registro, blobs = {}, {}
+        for clave, valor in estado.items():
+            if isinstance(valor, str) and len(valor) >= UMBRAL_BLOB:
+                hash_ = hashlib.sha256(valor.encode("utf-8")).hexdigest()
+                blobs[hash_] = valor
+                registro[clave] = {_REFERENCIA: hash_}
+            else:
+                registro[clave] = valor
+        with self._transaccion() as con:
+            # BEGIN IMMEDIATE: nadie más escribe entre la comprobación y el guardado
+            if version is not None and self._version_en(con, sesion) not in (0, version):
+                return False
+            for hash_, valor in blobs.items():
+                if not con.execute("SELECT 1 FROM blobs WHERE hash = ?", (hash_,)).fetchone():
+                    con.execute(
+                        "INSERT INTO blobs (hash, datos) VALUES (?, ?)",
+                        (hash_, zlib.compress(valor.encode("utf-8"), NIVEL_COMPRESION)),
+                    )
+            con.execute(
+                "INSERT INTO sesiones (sesion, estado, actualizado) VALUES (?, ?, ?) "
+                "ON CONFLICT (sesion) DO UPDATE SET estado = excluded.estado, actualizado = excluded.actualizado",
+                (sesion, json.dumps(registro, ensure_ascii=False), time.time()),
+            )
+            self._actualizar_referencias(con, sesion, set(blobs))
+        return True
+
+    def eliminar(self, sesion: str) -> None:
+        with self._transaccion() as con:
+            con.execute("DELETE FROM sesiones WHERE sesion = ?", (sesion,))
+            self._actualizar_referencias(con, sesion, set())
+
+    @staticmethod
+    def _actualizar_referencias(con: sqlite3.Connection, sesion: str, hashes: set[str]) -> None:
+        """Sustituye las referencias de la sesión y borra los blobs que quedan huérfanos."""
+        anteriores = {fila[0] for fila in con.execute("SELECT hash FROM referencias WHERE sesion = ?", (sesion,))}
+        for hash_ in anteriores - hashes:
+            con.execute("DELETE FROM referencias WHERE sesion = ? AND hash = ?", (sesion, hash_))
+            if not con.execute("SELECT 1 FROM referencias WHERE hash = ?", (hash_,)).fetchone():
+                con.execute("DELETE FROM blobs WHERE hash = ?", (hash_,))
+        con.executemany(
+            "INSERT INTO referencias (sesion, hash) VALUES (?, ?)",
+            ((sesion, hash_) for hash_ in hashes - anteriores),
+        )
+
+
+def almacen_desde_entorno() -> AlmacenEstado:
+    """Backend elegido con ``EJ_ESTADO`` (``memoria``, ``sqlite`` o ``modulo:Clase``)."""
+    nombre = os.getenv("EJ_ESTADO", "memoria").strip()
+    if nombre in ("", "memoria"):
+        return EstadoMemoria()
+    if nombre == "sqlite":
+        return EstadoSQLite(os.getenv("EJ_ESTADO_DB", "sesiones.db"))
+    modulo, _, clase = nombre.partition(":")
+    if not clase:
+        raise ValueError(f"EJ_ESTADO no válido: {nombre!r} (use memoria, sqlite o modulo:Clase)")
+    return getattr(importlib.import_module(modulo), clase)()
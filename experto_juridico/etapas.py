@@ -0,0 +1,267 @@
+"""Clasificador local de la etapa procesal, sin llamadas a la API.
+
+Determinar ``etapa_proceso`` es buena parte de lo que hace el análisis
+completo con el asistente. Este módulo lo predice en milisegundos a partir del
+texto extraído, en el mismo espíritu que las listas de palabras de
+``determinar_formato``:
+
+- rasgos de palabras clave por etapa (expresiones compiladas sobre el texto
+  sin tildes, contadas en todo el documento y en su parte final, donde suelen
+  estar las actuaciones más recientes);
+- TF-IDF de unigramas y bigramas (las ``RASGOS_POR_DOCUMENTO`` de más peso);
+- una regresión logística multinomial entrenada con SGD sobre esos rasgos.
+
+El modelo se entrena con los análisis ya registrados en el historial (el
+documento enviado y la etapa que devolvió el asistente, normalizada a una de
+``ETAPAS``) con ``scripts/evaluar_etapa.py``, que también mide precisión,
+cobertura por umbral y latencia. Sin modelo entrenado (``EJ_MODELO_ETAPA``) no
+se predice nada y el análisis sigue como siempre.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import random
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable
+
+from experto_juridico import metricas
+
+RUTA_MODELO = os.getenv("EJ_MODELO_ETAPA", "modelo_etapa.json")
+# Confianza mínima para aceptar la predicción local
+UMBRAL_CONFIANZA = float(os.getenv("EJ_ETAPA_UMBRAL", 0.85))
+VERSION_MODELO = 1
+MAX_VOCABULARIO = 20_000
+MIN_DOCUMENTOS_TERMINO = 2
+RASGOS_POR_DOCUMENTO = 400
+# Fracción final del documento donde se buscan por separado las palabras clave
+FRACCION_FINAL = 0.2
+
+# Etapas del proceso civil: (clave, etiqueta, palabras clave sin tildes)
+ETAPAS = (
+    ("postulatoria", "Etapa postulatoria", (
+        r"interpongo demanda", r"admite a tramite", r"admitase", r"inadmisible", r"improcedente la demanda",
+        r"calificacion de la demanda", r"contestacion de (?:la )?demanda", r"reconvencion", r"excepciones?",
+        r"saneamiento", r"puntos controvertidos", r"traslado de la demanda", r"emplazamiento",
+    )),
+    ("probatoria", "Etapa probatoria", (
+        r"audiencia de pruebas", r"medios probatorios", r"actuacion de pruebas", r"pericia", r"perito",
+        r"declaracion testimonial", r"testigos?", r"inspeccion judicial", r"exhibicion", r"prueba de oficio",
+    )),
+    ("decisoria", "Etapa decisoria", (
+        r"alegatos", r"autos para sentenciar", r"sentencia de primera instancia", r"fallo", r"declarando fundada",
+        r"declarando infundada", r"se resuelve", r"vistos", r"parte resolutiva",
+    )),
+    ("impugnatoria", "Etapa impugnatoria", (
+        r"apelacion", r"apela", r"recurso de casacion", r"casacion", r"sala superior", r"segunda instancia",
+        r"recurso de queja", r"concede(?:se)? (?:el recurso|la apelacion)", r"agravios?", r"vista de la causa",
+    )),
+    ("ejecutoria", "Etapa ejecutoria", (
+        r"ejecucion de sentencia", r"consentida", r"ejecutoriada", r"cosa juzgada", r"requierase",
+        r"bajo apercibimiento", r"liquidacion", r"embargo", r"remate", r"cumplimiento de lo ordenado",
+    )),
+)
+CLAVES_ETAPA = tuple(clave for clave, _, _ in ETAPAS)
+# Raíces con que el asistente también nombra la etapa ("Etapa de ejecución",
+# "Etapa de prueba"), en orden de prioridad: "ejecución de sentencia" es
+# ejecutoria e "impugnación de la sentencia", impugnatoria
+RAICES_ETAPA = (
+    ("ejecutoria", ("ejecuci", "ejecut")),
+    ("impugnatoria", ("impugna", "apelaci", "casaci")),
+    ("probatoria", ("prueba", "probat")),
+    ("decisoria", ("sentencia", "decisi")),
+    ("postulatoria", ("postula", "demanda")),
+)
+ETIQUETAS = {clave: etiqueta for clave, etiqueta, _ in ETAPAS}
+
+_PALABRAS_CLAVE = {
+    clave: re.compile(r"\b(?:" + "|".join(patrones) + r")\b") for clave, _, patrones in ETAPAS
+}
+_TOKEN = re.compile(r"[a-z]{3,}")
+_STOPWORDS = frozenset(
+    "que los las del por con para una sus como mas pero sus este esta ese esa son ser fue han "
+    "hay sin sobre entre cuando donde quien cual dicho dicha asi tal todo toda todos todas".split()
+)
+
+PREDICCIONES = metricas.REGISTRO.contador(
+    "experto_juridico_etapa_local_total",
+    "Predicciones del clasificador local de etapa según se aceptaron o no (confianza bajo el umbral).",
+    ("resultado",),
+)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes (la ñ queda como n)."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def normalizar_etapa(texto: str) -> str | None:
+    """Clave de ``ETAPAS`` para la etapa en texto libre que devuelve el asistente."""
+    normalizado = normalizar(texto)
+    for clave in CLAVES_ETAPA:
+        if clave[:-2] in normalizado:  # "postulatori", "ejecutori"...
+            return clave
+    for clave, raices in RAICES_ETAPA:
+        if any(raiz in normalizado for raiz in raices):
+            return clave
+    # Sin el nombre de la etapa: la que más palabras clave menciona
+    conteos = {clave: len(patron.findall(normalizado)) for clave, patron in _PALABRAS_CLAVE.items()}
+    mejor = max(conteos, key=conteos.get)
+    return mejor if conteos[mejor] else None
+
+
+def terminos(texto_normalizado: str) -> list[str]:
+    """Unigramas y bigramas del texto normalizado, sin palabras vacías."""
+    palabras = [p for p in _TOKEN.findall(texto_normalizado) if p not in _STOPWORDS]
+    return palabras + [f"{a} {b}" for a, b in zip(palabras, palabras[1:])]
+
+
+@dataclass(frozen=True)
+class Prediccion:
+    etapa: str
+    confianza: float
+    probabilidades: dict[str, float]
+
+    @property
+    def etiqueta(self) -> str:
+        return ETIQUETAS[self.etapa]
+
+
+class ClasificadorEtapa:
+    """Regresión logística multinomial sobre TF-IDF y rasgos de palabras clave."""
+
+    def __init__(self, idf: dict[str, float], pesos: dict[str, list[float]], sesgos: list[float],
+                 ejemplos: int = 0, entrenado: str | None = None):
+        self.idf = idf
+        self.pesos = pesos
+        self.sesgos = sesgos
+        self.ejemplos = ejemplos
+        self.entrenado = entrenado
+
+    @staticmethod
+    def _palabras_clave(normalizado: str) -> dict[str, float]:
+        corte = int(len(normalizado) * (1 - FRACCION_FINAL))
+        rasgos = {}
+        for clave, patron in _PALABRAS_CLAVE.items():
+            total = len(patron.findall(normalizado))
+            if total:
+                rasgos[f"kw:{clave}"] = math.log1p(total)
+                final = len(patron.findall(normalizado, corte))
+                if final:
+                    rasgos[f"kw_final:{clave}"] = math.log1p(final)
+        return rasgos
+
+    @staticmethod
+    def _tfidf(normalizado: str, idf: dict[str, float]) -> dict[str, float]:
+        conteos = Counter(t for t in terminos(normalizado) if t in idf)
+        pesos = {t: (1 + math.log(n)) * idf[t] for t, n in conteos.items()}
+        if len(pesos) > RASGOS_POR_DOCUMENTO:
+            pesos = dict(sorted(pesos.items(), key=lambda item: item[1], reverse=True)[:RASGOS_POR_DOCUMENTO])
+        norma = math.sqrt(sum(v * v for v in pesos.values())) or 1.0
+        return {t: v / norma for t, v in pesos.items()}
+
+    @classmethod
+    def _rasgos(cls, texto: str, idf: dict[str, float]) -> dict[str, float]:
+        normalizado = normalizar(texto)
+        return {**cls._tfidf(normalizado, idf), **cls._palabras_clave(normalizado)}
+
+    def _probabilidades(self, rasgos: dict[str, float]) -> list[float]:
+        puntuaciones = list(self.sesgos)
+        for rasgo, valor in rasgos.items():
+            pesos = self.pesos.get(rasgo)
+            if pesos is not None:
+                for i, peso in enumerate(pesos):
+                    puntuaciones[i] += peso * valor
+        maximo = max(puntuaciones)
+        exponenciales = [math.exp(p - maximo) for p in puntuaciones]
+        total = sum(exponenciales)
+        return [e / total for e in exponenciales]
+
+    def predecir(self, texto: str) -> Prediccion:
+        probabilidades = self._probabilidades(self._rasgos(texto, self.idf))
+        indice = max(range(len(CLAVES_ETAPA)), key=probabilidades.__getitem__)
+        return Prediccion(
+            CLAVES_ETAPA[indice],
+            probabilidades[indice],
+            dict(zip(CLAVES_ETAPA, probabilidades)),
+        )
+
+    @classmethod
+    def entrenar(cls, ejemplos: Iterable[tuple[str, str]], epocas: int = 30, tasa: float = 0.5,
+                 regularizacion: float = 1e-4, semilla: int = 0) -> ClasificadorEtapa:
+        """Entrena con pares (texto, clave de etapa) mediante SGD con regularización L2."""
+        ejemplos = [(normalizar(texto), CLAVES_ETAPA.index(etapa)) for texto, etapa in ejemplos]
+        if not ejemplos:
+            raise ValueError("No hay ejemplos para entrenar")
+        documentos = Counter()
+        for normalizado, _ in ejemplos:
+            documentos.update(set(terminos(normalizado)))
+        vocabulario = [t for t, n in documentos.most_common(MAX_VOCABULARIO) if n >= MIN_DOCUMENTOS_TERMINO]
+        idf = {t: math.log((1 + len(ejemplos)) / (1 + documentos[t])) + 1 for t in vocabulario}
+        datos = [
+            ({**cls._tfidf(normalizado, idf), **cls._palabras_clave(normalizado)}, etiqueta)
+            for normalizado, etiqueta in ejemplos
+        ]
+
+        modelo = cls(idf, {}, [0.0] * len(CLAVES_ETAPA), ejemplos=len(datos))
+        azar = random.Random(semilla)
+        for epoca in range(epocas):
+            azar.shuffle(datos)
+            paso = tasa / (1 + epoca)
+            for rasgos, etiqueta in datos:
+                probabilidades = modelo._probabilidades(rasgos)
+                errores = [p - (i == etiqueta) for i, p in enumerate(probabilidades)]
+                for i, error in enumerate(errores):
+                    modelo.sesgos[i] -= paso * error
+                for rasgo, valor in rasgos.items():
+                    pesos = modelo.pesos.setdefault(rasgo, [0.0] * len(CLAVES_ETAPA))
+                    for i, error in enumerate(errores):
+                        pesos[i] -= paso * (error * valor + regularizacion * pesos[i])
+        modelo.entrenado = datetime.now().isoformat(timespec="seconds")
+        return modelo
+
+    def guardar(self, ruta: str | Path) -> None:
+        Path(ruta).write_text(json.dumps({
+            "version": VERSION_MODELO,
+            "etapas": list(CLAVES_ETAPA),
+            "ejemplos": self.ejemplos,
+            "entrenado": self.entrenado,
+            "sesgos": self.sesgos,
+            "idf": self.idf,
+            "pesos": {r: [round(p, 6) for p in pesos] for r, pesos in self.pesos.items() if any(pesos)},
+        }, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def cargar(cls, ruta: str | Path) -> ClasificadorEtapa:
+        datos = json.loads(Path(ruta).read_text(encoding="utf-8"))
+        if datos.get("version") != VERSION_MODELO or datos.get("etapas") != list(CLAVES_ETAPA):
+            raise ValueError(f"Modelo de etapa incompatible: {ruta}")
+        return cls(datos["idf"], datos["pesos"], datos["sesgos"], datos.get("ejemplos", 0), datos.get("entrenado"))
+
+
+@lru_cache(maxsize=1)
+def clasificador() -> ClasificadorEtapa | None:
+    """Modelo de ``EJ_MODELO_ETAPA`` cargado una vez por proceso (None si no hay)."""
+    if not Path(RUTA_MODELO).exists():
+        return None
+    return ClasificadorEtapa.cargar(RUTA_MODELO)
+
+
+def predecir_confiable(texto: str, umbral: float = UMBRAL_CONFIANZA) -> Prediccion | None:
+    """Predicción local si hay modelo y su confianza alcanza el umbral."""
+    modelo = clasificador()
+    if modelo is None:
+        return None
+    with metricas.medir("clasificacion_etapa"):
+        prediccion = modelo.predecir(texto)
+    aceptada = prediccion.confianza >= umbral
+    PREDICCIONES.inc(resultado="aceptada" if aceptada else "descartada")
+    return prediccion if aceptada else None
@@ -0,0 +1,281 @@
+"""Expedientes de varios documentos: extracción en paralelo y corpus combinado.
+
+Un caso real llega como varios archivos (demanda, contestación, resoluciones,
+escritos). Se vuelcan todos a disco, se consultan en la caché de extracción y
+los que faltan se extraen a la vez en un pool de procesos (el parseo de PDF es
+CPU puro y no se paraleliza con hilos por el GIL). Después se ordenan por la
+fecha detectada en cada documento (y, a igualdad o sin fecha, por su tipo) y
+se combinan en un único texto con un encabezado de procedencia por documento,
+repartiendo entre ellos el límite de caracteres que llega al asistente.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import date
+from typing import BinaryIO, Iterable
+
+from experto_juridico import extraccion, metricas
+
+logger = logging.getLogger(__name__)
+
+PROCESOS = int(os.getenv("EJ_EXTRACCION_PROCESOS", min(4, os.cpu_count() or 1)))
+# Caracteres del inicio de cada documento donde se busca su tipo
+CARACTERES_CABECERA = 2000
+
+# Tipos de documento: (nombre, palabras clave sin tildes, orden procesal).
+# Se prueban en este orden (de más a menos específico); el orden procesal
+# solo desempata documentos con la misma fecha o sin fecha.
+TIPOS_DOCUMENTO = (
+    ("Contestación", ("contestacion", "contesta la demanda", "contesto la demanda"), 1),
+    ("Resolución", ("resolucion", "sentencia", "auto admisorio", "auto final", "decreto"), 3),
+    ("Demanda", ("demanda", "interpongo", "interpone"), 0),
+    ("Escrito", ("escrito", "sumilla", "senor juez"), 2),
+)
+TIPO_DESCONOCIDO = ("Documento", 4)
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+_FECHA_TEXTO = re.compile(
+    r"\b(\d{1,2})\s+de\s+(" + "|".join(MESES) + r")\s+(?:de|del)\s+(?:ano\s+)?(\d{4})\b"
+)
+_FECHA_NUMERICA = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b")
+
+ARCHIVOS_EXPEDIENTE = metricas.REGISTRO.histograma(
+    "experto_juridico_expediente_archivos",
+    "Número de archivos por expediente analizado.",
+    buckets=(1, 2, 3, 5, 8, 13, 20),
+)
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes, para comparar con las palabras clave."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+@dataclass(frozen=True)
+class DocumentoExpediente:
+    nombre: str
+    texto: str
+    tipo: str
+    fecha: date | None
+    desde_cache: bool
+    duracion: float
+
+    @property
+    def orden(self) -> tuple:
+        rango = next((r for t, _, r in TIPOS_DOCUMENTO if t == self.tipo), TIPO_DESCONOCIDO[1])
+        return (self.fecha is None, self.fecha or date.min, rango)
+
+
+@dataclass(frozen=True)
+class Expediente:
+    documentos: list[DocumentoExpediente]  # en orden cronológico
+    errores: dict[str, str]  # nombre de archivo -> motivo
+
+    @property
+    def segundos_ahorrados(self) -> float:
+        return sum(d.duracion for d in self.documentos if d.desde_cache)
+
+    def corpus(self, max_caracteres: int) -> str:
+        return combinar(self.documentos, max_caracteres)
+
+
+def detectar_tipo(nombre: str, texto: str) -> str:
+    """Tipo de documento según el nombre del archivo y el inicio del texto."""
+    for fuente in (_normalizar(nombre), _normalizar(texto[:CARACTERES_CABECERA])):
+        for tipo, palabras, _ in TIPOS_DOCUMENTO:
+            if any(palabra in fuente for palabra in palabras):
+                return tipo
+    return TIPO_DESCONOCIDO[0]
+
+
+def detectar_fecha(texto: str, hoy: date | None = None) -> date | None:
+    """Fecha del documento: la más reciente que aparece en él y no es futura.
+
+    Los hechos y resoluciones citados son anteriores al propio documento, así
+    que su fecha de emisión suele ser la última mencionada.
+    """
+    hoy = hoy or date.today()
+    normalizado = _normalizar(texto)
+    candidatas = [
+        (int(anio), MESES[mes], int(dia)) for dia, mes, anio in _FECHA_TEXTO.findall(normalizado)
+    ] + [(int(anio), int(mes), int(dia)) for dia, mes, anio in _FECHA_NUMERICA.findall(normalizado)]
+    mejor = None
+    for anio, mes, dia in candidatas:
+        try:
+            fecha = date(anio, mes, dia)
+        except ValueError:
+            continue
+        if fecha <= hoy and (mejor is None or fecha > mejor):
+            mejor = fecha
+    return mejor
+
+
+def _repartir(longitudes: list[int], total: int) -> list[int]:
+    """Reparte ``total`` caracteres: los documentos cortos entran enteros y el
+    resto se divide a partes iguales entre los largos."""
+    cuotas = [0] * len(longitudes)
+    presupuesto = max(total, 0)
+    pendientes = sorted(range(len(longitudes)), key=longitudes.__getitem__)
+    for posicion, indice in enumerate(pendientes):
+        cuotas[indice] = min(longitudes[indice], presupuesto // (len(pendientes) - posicion))
+        presupuesto -= cuotas[indice]
+    return cuotas
+
+
+def _encabezado(posicion: int, total: int, documento: DocumentoExpediente, recortado: bool) -> str:
+    detalles = [documento.tipo]
+    if documento.fecha:
+        detalles.append(documento.fecha.strftime("%d/%m/%Y"))
+    if recortado:
+        detalles.append("extracto")
+    return f"=== Documento {posicion} de {total}: {documento.nombre} ({', '.join(detalles)}) ==="
+
+
+def combinar(documentos: list[DocumentoExpediente], max_caracteres: int) -> str:
+    """Texto único del expediente con la procedencia de cada documento.
+
+    Con un solo documento se devuelve su texto tal cual (mismo texto, mismas
+    claves de caché que antes de admitir varios archivos).
+    """
+    if len(documentos) == 1:
+        return documentos[0].texto
+    preambulo = f"Expediente compuesto por {len(documentos)} documentos, en orden cronológico.\n"
+    # Reserva para los encabezados (con la marca de extracto) y los saltos de línea
+    encabezados = [_encabezado(i, len(documentos), d, True) for i, d in enumerate(documentos, 1)]
+    fijo = len(preambulo) + sum(len(e) + 3 for e in encabezados)
+    cuotas = _repartir([len(d.texto) for d in documentos], max_caracteres - fijo)
+    partes = [preambulo]
+    for posicion, (documento, cuota) in enumerate(zip(documentos, cuotas), 1):
+        recortado = cuota < len(documento.texto)
+        partes.append(_encabezado(posicion, len(documentos), documento, recortado))
+        partes.append(documento.texto[:cuota] + "\n")
+    return "\n".join(partes)
+
+
+###############################################################################
+# Extracción en paralelo
+###############################################################################
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _pool_procesos() -> ProcessPoolExecutor:
+    """Pool único del proceso (``EJ_EXTRACCION_PROCESOS`` workers).
+
+    Usa ``spawn``: el servidor de Streamlit tiene hilos en marcha y hacer
+    ``fork`` de un proceso con hilos puede dejar locks tomados en el hijo.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _descartar_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extraer_pendientes(archivos: list[extraccion.ArchivoSubido]) -> dict[str, extraccion.Extraccion | Exception]:
+    """Extrae los archivos (fuera de caché) en paralelo; un error no detiene a los demás."""
+    if len(archivos) <= 1 or PROCESOS <= 1:
+        resultados = {}
+        for archivo in archivos:
+            try:
+                resultados[archivo.nombre] = extraccion.extraer_cronometrado(archivo)
+            except Exception as exc:
+                resultados[archivo.nombre] = exc
+        return resultados
+
+    pool = _pool_procesos()
+    futuros: dict[str, Future] = {a.nombre: pool.submit(extraccion.extraer_cronometrado, a) for a in archivos}
+    resultados = {}
+    for archivo in archivos:
+        try:
+            entrada = futuros[archivo.nombre].result()
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. por memoria): se recrea el pool en la
+            # próxima llamada y este archivo se extrae en el proceso actual
+            logger.warning("Pool de extracción roto; se extrae %s en el proceso principal", archivo.nombre)
+            _descartar_pool(pool)
+            try:
+                entrada = extraccion.extraer_cronometrado(archivo)
+            except Exception as exc:
+                entrada = exc
+        except Exception as exc:
+            entrada = exc
+        if isinstance(entrada, extraccion.Extraccion):
+            # Las métricas del worker se quedan en su proceso: se registran aquí
+            metricas.DURACION_ETAPA.observar(entrada.duracion, etapa="extraccion_texto")
+        resultados[archivo.nombre] = entrada
+    return resultados
+
+
+def _nombres_unicos(nombres: Iterable[str]) -> list[str]:
+    vistos: dict[str, int] = {}
+    unicos = []
+    for nombre in nombres:
+        vistos[nombre] = vistos.get(nombre, 0) + 1
+        unicos.append(nombre if vistos[nombre] == 1 else f"{nombre} ({vistos[nombre]})")
+    return unicos
+
+
+def extraer_expediente(subidas: list[tuple[str, BinaryIO]]) -> Expediente:
+    """Extrae y ordena los documentos de un caso a partir de pares (nombre, archivo)."""
+    ARCHIVOS_EXPEDIENTE.observar(len(subidas))
+    nombres = _nombres_unicos(nombre for nombre, _ in subidas)
+    documentos, errores = [], {}
+    with metricas.medir("extraccion_expediente"), ExitStack() as pila:
+        archivos = []
+        for nombre, (_, origen) in zip(nombres, subidas):
+            archivo = pila.enter_context(extraccion.subida_en_disco(nombre, origen))
+            archivos.append(archivo)
+        extracciones: dict[str, extraccion.Extraccion | Exception] = {}
+        pendientes = []
+        for archivo in archivos:
+            entrada = extraccion.consultar_cache(archivo)
+            if entrada is None:
+                pendientes.append(archivo)
+            else:
+                extracciones[archivo.nombre] = entrada
+        nuevas = _extraer_pendientes(pendientes)
+        for archivo in pendientes:
+            entrada = nuevas[archivo.nombre]
+            if isinstance(entrada, extraccion.Extraccion):
+                extraccion.guardar_en_cache(archivo, entrada)
+            extracciones[archivo.nombre] = entrada
+
+    for nombre in nombres:
+        entrada = extracciones[nombre]
+        if isinstance(entrada, Exception):
+            logger.warning("No se pudo extraer %s: %s", nombre, entrada)
+            errores[nombre] = str(entrada) or type(entrada).__name__
+            continue
+        documentos.append(DocumentoExpediente(
+            nombre=nombre,
+            texto=entrada.texto,
+            tipo=detectar_tipo(nombre, entrada.texto),
+            fecha=detectar_fecha(entrada.texto),
+            desde_cache=entrada.desde_cache,
+            duracion=entrada.duracion,
+        ))
+    documentos.sort(key=lambda d: d.orden)
+    return Expediente(documentos, errores)
@@ -0,0 +1,291 @@
+"""Exportación de borradores a DOCX en memoria, una sola vez por contenido.
+
+Cada borrador se serializa a un ``BytesIO`` (sin archivos temporales) y el
+resultado se guarda en una caché LRU de proceso indexada por el SHA-256 del
+texto, de modo que los reruns y las sesiones que exportan el mismo borrador
+reutilizan los bytes ya generados.
+
+El texto no se vuelca en un único párrafo: ``renderizar_escrito`` reconoce las
+secciones que exige ``generar_prompt_redaccion`` (ENCABEZADO, PETITORIO,
+MEDIOS PROBATORIOS...) y las convierte en títulos, listas numeradas y párrafos
+sobre una plantilla del estudio que se carga una vez por proceso y se clona en
+cada exportación.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from experto_juridico import metricas
+
+logger = logging.getLogger(__name__)
+
+MIME_DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MAX_EXPORTACIONES_EN_CACHE = 64
+
+# Plantilla del estudio (membrete, márgenes, estilos). Si no existe, se usa la
+# plantilla por defecto de python-docx.
+RUTA_PLANTILLA = Path(os.getenv(
+    "EJ_PLANTILLA_DOCX",
+    Path(__file__).resolve().parent.parent / "plantillas" / "escrito.docx",
+))
+
+# Secciones de las estructuras ESCRITO y REGULAR de generar_prompt_redaccion
+SECCIONES_ESCRITO = (
+    "ENCABEZADO", "IDENTIFICACIÓN", "EXPOSICIÓN FÁCTICA", "FUNDAMENTOS DE DERECHO",
+    "PETITORIO", "MEDIOS PROBATORIOS", "FIRMA Y CIERRE", "PARTES Y APODERADOS",
+    "COMPETENCIA", "FUNDAMENTOS DE HECHO", "REQUISITOS DE ADMISIBILIDAD", "ANEXOS",
+    "PLAZO/AGRAVIO", "PLAZO", "AGRAVIO", "PETICIÓN Y COSTAS",
+)
+# Secciones cuyo contenido va centrado (órgano, expediente y materia)
+SECCIONES_CENTRADAS = {"ENCABEZADO"}
+
+BYTES_DOCX = metricas.REGISTRO.histograma(
+    "experto_juridico_docx_bytes",
+    "Tamaño de los DOCX serializados.",
+    buckets=(8_000, 16_000, 32_000, 64_000, 128_000, 256_000, 512_000, 1_000_000),
+)
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class CacheExportaciones:
+    """LRU acotada de bytes exportados, segura entre hilos."""
+
+    def __init__(self, max_entradas: int = MAX_EXPORTACIONES_EN_CACHE):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: OrderedDict[str, bytes] = OrderedDict()
+
+    def obtener(self, clave: str) -> bytes | None:
+        with self._lock:
+            datos = self._entradas.get(clave)
+            if datos is not None:
+                self._entradas.move_to_end(clave)
+            return datos
+
+    def guardar(self, clave: str, datos: bytes) -> None:
+        with self._lock:
+            self._entradas[clave] = datos
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+
+_cache_docx = CacheExportaciones()
+
+
+def construir_docx(texto: str) -> bytes:
+    """Construye y serializa el DOCX del borrador en memoria."""
+    with metricas.medir("construccion_docx"):
+        doc = documento_desde_plantilla()
+        renderizar_escrito(doc, texto)
+    buffer = BytesIO()
+    with metricas.medir("serializacion_docx"):
+        doc.save(buffer)
+    datos = buffer.getvalue()
+    BYTES_DOCX.observar(len(datos))
+    return datos
+
+
+def docx_en_cache(texto: str) -> bytes | None:
+    """Bytes ya exportados para este texto, o None si aún no se han generado."""
+    return _cache_docx.obtener(hash_texto(texto))
+
+
+def exportar_docx(texto: str) -> bytes:
+    """Devuelve el DOCX del texto, serializándolo solo si no está en caché."""
+    clave = hash_texto(texto)
+    datos = _cache_docx.obtener(clave)
+    if datos is not None:
+        metricas.CACHE.inc(cache="docx", resultado="hit")
+        return datos
+    metricas.CACHE.inc(cache="docx", resultado="miss")
+    datos = construir_docx(texto)
+    _cache_docx.guardar(clave, datos)
+    return datos
+
+
+###############################################################################
+# Plantilla
+###############################################################################
+
+@dataclass(frozen=True)
+class _Plantilla:
+    documento: object
+    datos: bytes
+
+
+@lru_cache(maxsize=1)
+def _plantilla() -> _Plantilla:
+    """Lee y analiza la plantilla una única vez por proceso."""
+    from docx import Document
+
+    with metricas.medir("carga_plantilla_docx"):
+        if RUTA_PLANTILLA.exists():
+            datos = RUTA_PLANTILLA.read_bytes()
+            documento = Document(BytesIO(datos))
+        else:
+            documento = Document()
+            buffer = BytesIO()
+            documento.save(buffer)
+            datos = buffer.getvalue()
+    return _Plantilla(documento, datos)
+
+
+def documento_desde_plantilla():
+    """Devuelve un documento nuevo clonado de la plantilla ya analizada."""
+    plantilla = _plantilla()
+    try:
+        return copy.deepcopy(plantilla.documento)
+    except Exception:
+        # Si el clon en memoria fallara, se vuelve a abrir desde los bytes cacheados
+        logger.warning("No se pudo clonar la plantilla DOCX; se reabre desde memoria", exc_info=True)
+        from docx import Document
+
+        return Document(BytesIO(plantilla.datos))
+
+
+###############################################################################
+# Renderizado estructurado
+###############################################################################
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(
+        c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn"
+    )
+
+
+_SECCIONES_NORMALIZADAS = {_sin_acentos(s): s for s in SECCIONES_ESCRITO}
+# "1. ENCABEZADO:", "## PETITORIO", "**III. MEDIOS PROBATORIOS**", "PETITORIO"
+_TITULO = re.compile(
+    r"^\s*(?:#{1,6}\s*)?(?:\*\*)?\s*(?:(?:\d{1,2}|[IVXL]{1,5})[.)-]\s*)?"
+    r"(?P<nombre>[A-ZÁÉÍÓÚÑ/ ]+?)\s*:?\s*(?:\*\*)?\s*:?\s*$"
+)
+# "5. PETITORIO: Se declare fundada..." (título y contenido en la misma línea)
+_TITULO_EN_LINEA = re.compile(
+    r"^\s*(?:#{1,6}\s*)?(?:\*\*)?\s*(?:(?:\d{1,2}|[IVXL]{1,5})[.)-]\s*)?"
+    r"(?P<nombre>[A-ZÁÉÍÓÚÑ/ ]+?)\s*:\s*(?:\*\*)?\s*(?P<resto>.+)$"
+)
+_TITULO_MARKDOWN = re.compile(r"^\s*#{1,6}\s+(?P<nombre>.+?)\s*#*\s*$")
+_ITEM_NUMERADO = re.compile(r"^\s*(?P<numero>\d{1,3})[.)-]\s+(?P<texto>.+)$")
+_ITEM_VINETA = re.compile(r"^\s*[-•*]\s+(?P<texto>.+)$")
+_NEGRITA = re.compile(r"\*\*(.+?)\*\*")
+
+
+def _seccion(linea: str) -> tuple[str | None, str]:
+    """(Nombre canónico de la sección, contenido en la misma línea) si la línea es un título."""
+    for patron in (_TITULO, _TITULO_EN_LINEA):
+        coincidencia = patron.match(linea)
+        if coincidencia:
+            nombre = _SECCIONES_NORMALIZADAS.get(_sin_acentos(coincidencia.group("nombre").strip()))
+            if nombre is not None:
+                return nombre, coincidencia.groupdict().get("resto") or ""
+    return None, ""
+
+
+def _estilo(doc, nombre: str):
+    try:
+        return doc.styles[nombre]
+    except KeyError:
+        return None
+
+
+def _agregar_texto(parrafo, texto: str) -> None:
+    """Añade el texto al párrafo convirtiendo **negritas** de markdown en runs."""
+    partes = _NEGRITA.split(texto)
+    for i, parte in enumerate(partes):
+        if parte:
+            parrafo.add_run(parte).bold = bool(i % 2)
+
+
+def _agregar_titulo(doc, texto: str, nivel: int = 1) -> None:
+    if _estilo(doc, f"Heading {nivel}") is not None:
+        doc.add_heading(texto, level=nivel)
+    else:
+        doc.add_paragraph().add_run(texto).bold = True
+
+
+def _reiniciar_numeracion(doc, parrafo) -> int | None:
+    """Hace que la lista numerada que empieza en ``parrafo`` arranque en 1."""
+    try:
+        num_id_estilo = parrafo.style.element.pPr.numPr.numId.val
+        numeracion = doc.part.numbering_part.numbering_definitions._numbering
+        abstracto = numeracion.num_having_numId(num_id_estilo).abstractNumId.val
+        num = numeracion.add_num(abstracto)
+        num.add_lvlOverride(ilvl=0).add_startOverride(1)
+        num_pr = parrafo._p.get_or_add_pPr().get_or_add_numPr()
+        num_pr.get_or_add_ilvl().val = 0
+        num_pr.get_or_add_numId().val = num.numId
+        return num.numId
+    except (AttributeError, KeyError, NotImplementedError):
+        # Plantilla sin definición de numeración: la lista continúa la anterior
+        return None
+
+
+def _continuar_numeracion(parrafo, num_id) -> None:
+    if num_id is None:
+        return
+    num_pr = parrafo._p.get_or_add_pPr().get_or_add_numPr()
+    num_pr.get_or_add_ilvl().val = 0
+    num_pr.get_or_add_numId().val = num_id
+
+
+def renderizar_escrito(doc, texto: str) -> None:
+    """Vuelca el borrador en ``doc`` con títulos por sección y listas numeradas."""
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    estilo_numerado = _estilo(doc, "List Number")
+    estilo_vineta = _estilo(doc, "List Bullet")
+    seccion = None
+    lista_abierta = False  # hay una lista numerada en curso dentro de la sección
+    num_id = None
+
+    for linea in texto.splitlines():
+        if not linea.strip():
+            continue
+
+        nombre, resto = _seccion(linea)
+        if nombre is not None:
+            _agregar_titulo(doc, nombre, 1)
+            seccion, lista_abierta = nombre, False
+            if not resto:
+                continue
+            linea = resto
+
+        markdown = _TITULO_MARKDOWN.match(linea)
+        if markdown:
+            _agregar_titulo(doc, markdown.group("nombre").strip("* "), 2)
+            lista_abierta = False
+            continue
+
+        numerado = _ITEM_NUMERADO.match(linea)
+        vineta = _ITEM_VINETA.match(linea)
+        if numerado and estilo_numerado is not None:
+            parrafo = doc.add_paragraph(style=estilo_numerado)
+            # Cada sección (o cada lista que vuelve a empezar en 1) reinicia la numeración
+            if lista_abierta and int(numerado.group("numero")) != 1:
+                _continuar_numeracion(parrafo, num_id)
+            else:
+                num_id = _reiniciar_numeracion(doc, parrafo)
+                lista_abierta = True
+            _agregar_texto(parrafo, numerado.group("texto"))
+        elif vineta and estilo_vineta is not None:
+            _agregar_texto(doc.add_paragraph(style=estilo_vineta), vineta.group("texto"))
+        else:
+            parrafo = doc.add_paragraph()
+            _agregar_texto(parrafo, linea.strip())
+            if seccion in SECCIONES_CENTRADAS:
+                parrafo.alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -0,0 +1,299 @@
+"""Extracción de texto de PDF y Word con caché direccionada por contenido.
+
+La clave de la caché es el SHA-256 de los bytes subidos: el mismo archivo
+analizado otra vez (reintento tras un error de la API, reanálisis, el mismo
+expediente subido por otro usuario) no vuelve a pasar por el parser. La caché
+es de proceso, acotada en memoria (LRU por tamaño) y, si se configura
+``EJ_EXTRACCION_CACHE_DIR``, persistente en disco entre reinicios.
+
+Las subidas no se copian a otro buffer en memoria: se vuelcan por bloques a un
+archivo temporal (calculando el SHA-256 al vuelo) y el parser lee ese archivo
+mapeado en memoria, página a página. El texto se produce con un generador de
+páginas y se acota a ``MAX_CARACTERES`` (solo los primeros ``MAX_DOC_CHARS``
+llegan al asistente).
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from experto_juridico import metricas
+
+logger = logging.getLogger(__name__)
+
+# Cambiar si cambia la forma de extraer: invalida las entradas persistidas
+VERSION_EXTRACTOR = 2
+MAX_BYTES_CACHE = int(float(os.getenv("EJ_EXTRACCION_CACHE_MB", 64)) * 1024 * 1024)
+NIVEL_COMPRESION = 6
+# Límite del texto extraído por documento (caracteres)
+MAX_CARACTERES = int(os.getenv("EJ_EXTRACCION_MAX_CARACTERES", 2_000_000))
+TAMANO_BLOQUE = 1024 * 1024
+PAGINAS_POR_LIMPIEZA = 32
+DIRECTORIO_SUBIDAS = os.getenv("EJ_SUBIDAS_DIR") or None
+# Mide el pico de memoria de cada extracción con tracemalloc (tiene coste)
+MEDIR_MEMORIA = os.getenv("EJ_EXTRACCION_MEDIR_MEMORIA", "") not in ("", "0")
+
+SEGUNDOS_AHORRADOS = metricas.REGISTRO.contador(
+    "experto_juridico_extraccion_segundos_ahorrados_total",
+    "Tiempo de extracción evitado por aciertos de la caché de extracción.",
+)
+BYTES_CACHE = metricas.REGISTRO.medidor(
+    "experto_juridico_extraccion_cache_bytes",
+    "Memoria ocupada por los textos de la caché de extracción.",
+)
+PICO_MEMORIA = metricas.REGISTRO.histograma(
+    "experto_juridico_extraccion_pico_bytes",
+    "Pico de memoria Python durante la extracción de un documento (EJ_EXTRACCION_MEDIR_MEMORIA).",
+    buckets=(1e6, 4e6, 16e6, 64e6, 128e6, 256e6, 512e6, 1e9),
+)
+BYTES_SUBIDOS = metricas.REGISTRO.histograma(
+    "experto_juridico_subida_bytes",
+    "Tamaño de los archivos subidos.",
+    buckets=(1e5, 1e6, 5e6, 20e6, 50e6, 100e6, 200e6),
+)
+
+
+###############################################################################
+# Subidas volcadas a disco
+###############################################################################
+
+@dataclass(frozen=True)
+class ArchivoSubido:
+    nombre: str
+    ruta: Path
+    sha256: str
+    tamano: int
+
+    @property
+    def formato(self) -> str:
+        return Path(self.nombre).suffix.lower()
+
+
+@contextmanager
+def subida_en_disco(nombre: str, origen: BinaryIO, directorio: str | Path | None = DIRECTORIO_SUBIDAS):
+    """Vuelca ``origen`` a un archivo temporal por bloques, calculando su SHA-256.
+
+    El archivo se borra al salir del bloque ``with``.
+    """
+    digest = hashlib.sha256()
+    tamano = 0
+    origen.seek(0)
+    descriptor, ruta = tempfile.mkstemp(prefix="subida_", suffix=Path(nombre).suffix.lower(), dir=directorio)
+    try:
+        with os.fdopen(descriptor, "wb") as destino:
+            while bloque := origen.read(TAMANO_BLOQUE):
+                digest.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+        BYTES_SUBIDOS.observar(tamano)
+        yield ArchivoSubido(nombre, Path(ruta), digest.hexdigest(), tamano)
+    finally:
+        Path(ruta).unlink(missing_ok=True)
+
+
+def paginas(archivo: ArchivoSubido) -> Iterator[str]:
+    """Texto del archivo página a página (PDF) o párrafo a párrafo (Word)."""
+    if archivo.formato == ".pdf":
+        from PyPDF2 import PdfReader
+
+        with open(archivo.ruta, "rb") as f:
+            if archivo.tamano == 0:
+                return
+            # PdfReader copia a memoria los archivos que recibe por ruta; con el
+            # mapeo lee del archivo bajo demanda a través de la caché de páginas
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapeo:
+                reader = PdfReader(mapeo)
+                for numero, pagina in enumerate(reader.pages, 1):
+                    yield pagina.extract_text() or ""
+                    # PdfReader conserva todos los objetos ya resueltos; vaciarlo
+                    # cada pocas páginas acota el pico en documentos largos
+                    if numero % PAGINAS_POR_LIMPIEZA == 0:
+                        getattr(reader, "resolved_objects", {}).clear()
+    elif archivo.formato == ".docx":
+        from docx import Document
+
+        for parrafo in Document(str(archivo.ruta)).paragraphs:
+            yield parrafo.text
+    else:
+        raise ValueError("Formato no soportado: debe ser PDF o DOCX")
+
+
+def _unir_acotado(partes: Iterator[str], limite: int) -> str:
+    """Une las partes con saltos de línea hasta ``limite`` caracteres."""
+    unidas, total = [], 0
+    for parte in partes:
+        if total + len(parte) > limite:
+            unidas.append(parte[: max(limite - total, 0)])
+            logger.info("Texto extraído truncado a %d caracteres", limite)
+            break
+        unidas.append(parte)
+        total += len(parte) + 1
+    return "\n".join(unidas)[:limite]
+
+
+def extraer_sin_cache(archivo: ArchivoSubido) -> str:
+    """Extrae el texto de un PDF o Word volcado a disco sin consultar la caché."""
+    with metricas.medir("extraccion_texto"), _medir_pico_memoria():
+        partes = paginas(archivo)
+        try:
+            return _unir_acotado(partes, MAX_CARACTERES)
+        finally:
+            partes.close()
+
+
+@contextmanager
+def _medir_pico_memoria():
+    # tracemalloc es global al proceso: si ya lo usa otra extracción (u otra
+    # herramienta), esta no se mide para no mezclar picos
+    if not MEDIR_MEMORIA or not _medicion_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        if tracemalloc.is_tracing():
+            yield
+            return
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            PICO_MEMORIA.observar(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    finally:
+        _medicion_lock.release()
+
+
+_medicion_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Extraccion:
+    texto: str
+    duracion: float  # segundos que costó extraerlo la primera vez
+    desde_cache: bool = False
+
+
+class CacheExtraccion:
+    """LRU de textos extraídos acotada por memoria, con copia opcional en disco."""
+
+    def __init__(self, max_bytes: int = MAX_BYTES_CACHE, directorio: str | Path | None = None):
+        self.max_bytes = max_bytes
+        self.directorio = Path(directorio) if directorio else None
+        if self.directorio is not None:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entradas: OrderedDict[str, Extraccion] = OrderedDict()
+        self._bytes = 0
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / f"{clave}.txt.zz"
+
+    def obtener(self, clave: str) -> Extraccion | None:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                return entrada
+        if self.directorio is None:
+            return None
+        try:
+            datos = self._ruta(clave).read_bytes()
+        except FileNotFoundError:
+            return None
+        # Formato: duración (double) + texto UTF-8 comprimido
+        (duracion,) = struct.unpack("<d", datos[:8])
+        entrada = Extraccion(zlib.decompress(datos[8:]).decode("utf-8"), duracion)
+        self._guardar_en_memoria(clave, entrada)
+        return entrada
+
+    def guardar(self, clave: str, entrada: Extraccion) -> None:
+        self._guardar_en_memoria(clave, entrada)
+        if self.directorio is None:
+            return
+        ruta = self._ruta(clave)
+        temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            temporal.write_bytes(
+                struct.pack("<d", entrada.duracion)
+                + zlib.compress(entrada.texto.encode("utf-8"), NIVEL_COMPRESION)
+            )
+            os.replace(temporal, ruta)
+        except OSError:
+            logger.warning("No se pudo persistir la extracción %s", clave, exc_info=True)
+
+    def _guardar_en_memoria(self, clave: str, entrada: Extraccion) -> None:
+        tamano = sys.getsizeof(entrada.texto)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= sys.getsizeof(anterior.texto)
+            self._entradas[clave] = entrada
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, expulsada = self._entradas.popitem(last=False)
+                self._bytes -= sys.getsizeof(expulsada.texto)
+            BYTES_CACHE.set(self._bytes)
+
+
+_cache = CacheExtraccion(directorio=os.getenv("EJ_EXTRACCION_CACHE_DIR") or None)
+
+
+def clave_contenido(archivo: ArchivoSubido) -> str:
+    """SHA-256 de los bytes, más el formato y la versión del extractor."""
+    return f"{archivo.sha256}-{archivo.formato.lstrip('.')}-v{VERSION_EXTRACTOR}"
+
+
+def consultar_cache(archivo: ArchivoSubido) -> Extraccion | None:
+    """Extracción previa de los mismos bytes, o None; registra el acierto o fallo.
+
+    Si hay acierto, ``desde_cache`` es True y ``duracion`` es el tiempo de
+    extracción que se ha ahorrado.
+    """
+    entrada = _cache.obtener(clave_contenido(archivo))
+    if entrada is None:
+        metricas.CACHE.inc(cache="extraccion", resultado="miss")
+        return None
+    metricas.CACHE.inc(cache="extraccion", resultado="hit")
+    SEGUNDOS_AHORRADOS.inc(entrada.duracion)
+    return replace(entrada, desde_cache=True)
+
+
+def guardar_en_cache(archivo: ArchivoSubido, entrada: Extraccion) -> None:
+    _cache.guardar(clave_contenido(archivo), entrada)
+
+
+def extraer_cronometrado(archivo: ArchivoSubido) -> Extraccion:
+    """Extrae sin caché midiendo la duración (se puede ejecutar en otro proceso)."""
+    t0 = time.perf_counter()
+    texto = extraer_sin_cache(archivo)
+    return Extraccion(texto, time.perf_counter() - t0)
+
+
+def extraer_archivo(archivo: ArchivoSubido) -> Extraccion:
+    """Texto del archivo, reutilizando la extracción previa de los mismos bytes."""
+    entrada = consultar_cache(archivo)
+    if entrada is None:
+        entrada = extraer_cronometrado(archivo)
+        guardar_en_cache(archivo, entrada)
+    return entrada
+
+
+def extraer(nombre: str, origen: BinaryIO) -> Extraccion:
+    """Vuelca la subida a disco y extrae su texto (con caché por contenido)."""
+    with subida_en_disco(nombre, origen) as archivo:
+        return extraer_archivo(archivo)
@@ -0,0 +1,221 @@
+"""Formato del escrito (ESCRITO o REGULAR) a partir de la solución elegida.
+
+El texto se normaliza una vez (minúsculas y sin tildes) y cada regla se busca
+por su raíz literal con una búsqueda de subcadena; la expresión de la variante
+solo se prueba donde aparece la raíz. La comparación ignora así mayúsculas y
+tildes (escritas o no), y cada regla cubre las formas flexionadas habituales
+("apelacion", "apélese", "subsánese"), siempre desde el inicio de una palabra:
+"representante" ya no cuenta como "presente" ni "demandante" como "demanda".
+
+Cada regla tiene un peso; gana el formato con la regla de mayor prioridad
+encontrada y, a igualdad, con más peso acumulado. Las reglas de ESCRITO tienen
+más prioridad que las de REGULAR, como en la versión original (se comprobaban
+primero), salvo "presente": es la pista más débil ("el presente recurso") y
+compite por peso con las de REGULAR. Sin coincidencias el formato es ESCRITO.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Sequence
+
+FORMATO_POR_DEFECTO = "ESCRITO"
+
+
+@dataclass(frozen=True)
+class Regla:
+    palabra: str  # forma de referencia, como aparecía en las listas originales
+    variantes: tuple[str, ...]  # expresiones en minúsculas y sin tildes; empiezan por una raíz literal (o ``(?<=...)`` y la raíz)
+    formato: str
+    peso: float = 1.0
+    prioridad: int = 0
+
+
+REGLAS = (
+    Regla("subsanar", (r"subsan\w*",), "ESCRITO", prioridad=1),
+    Regla("ampliar", (r"ampli(?:ar|a|an|e|ese|ense|acion|aciones|atorio|atoria)\b",), "ESCRITO", prioridad=1),
+    Regla("aclarar", (r"aclar(?:ar|a|an|e|ese|ense|acion|aciones|atorio|atoria)\b",), "ESCRITO", prioridad=1),
+    Regla("mero trámite", (r"mero\s+tramite",), "ESCRITO", prioridad=1),
+    Regla("téngase", (r"tenga(?:n)?se\b", r"tener\s+presente", r"(?<=\bse\s)tenga\b"), "ESCRITO", prioridad=1),
+    Regla("sírvase", (r"sirva(?:n)?se\b",), "ESCRITO", prioridad=1),
+    Regla("adjuntar", (r"adjunt\w*",), "ESCRITO", prioridad=1),
+    Regla("presente", (r"present(?:e|ar|a|ado|ada|acion)\b",), "ESCRITO", 0.5),
+    Regla("demanda", (r"demanda(?:s|r)?\b",), "REGULAR"),
+    Regla("denuncia", (r"denunci(?:a|as|ar|e)\b",), "REGULAR"),
+    Regla("apelación", (r"apel(?:acion|aciones|ar|a|e|ese|ada|ado|able)\b",), "REGULAR", 1.5),
+    Regla("recurso", (r"recur(?:so|sos|rir|ra|re)\b",), "REGULAR", 1.5),
+    Regla("impugnación", (r"impugn\w*",), "REGULAR", 1.5),
+    Regla("nulidad", (r"nulidad(?:es)?\b",), "REGULAR", 1.5),
+    Regla("casación", (r"casa(?:cion|torio|toria)\b",), "REGULAR", 1.5),
+    Regla("queja", (r"queja(?:s)?\b",), "REGULAR"),
+)
+
+# Palabras clave para determinar el formato
+PALABRAS_FORMATO_ESCRITO = [regla.palabra for regla in REGLAS if regla.formato == "ESCRITO"]
+PALABRAS_FORMATO_REGULAR = [regla.palabra for regla in REGLAS if regla.formato == "REGULAR"]
+
+_SIN_TILDES = {"á": "a", "é": "e", "í": "i", "ó": "o", "ú": "u", "ü": "u", "ñ": "n"}
+# Raíz literal de una variante, tras una anticipación hacia atrás opcional
+_RAIZ = re.compile(r"(?:\(\?<=[^)]*\))?([a-z]+)")
+
+
+def _tabla_normalizacion() -> bytes:
+    """Tabla de ``bytes.translate`` que pasa cada carácter Latin-1 a minúscula y sin tilde."""
+    tabla = bytearray(range(256))
+    for codigo in range(256):
+        minuscula = chr(codigo).lower()
+        tabla[codigo] = ord(_SIN_TILDES.get(minuscula, minuscula))
+    return bytes(tabla)
+
+
+_TABLA_NORMALIZACION = _tabla_normalizacion()
+
+
+def normalizar(texto: str) -> str:
+    """El texto en minúsculas y sin tildes, como están escritas las variantes.
+
+    Una sola tabla de bytes resuelve mayúsculas y tildes: es varias veces más
+    rápida que ``lower()`` seguido de ``str.translate`` o de varios ``replace``.
+    Los caracteres fuera de Latin-1 (comillas tipográficas, rayas...) no forman
+    parte de ninguna regla y quedan como ``?``.
+    """
+    if texto.isascii():
+        return texto.lower()
+    return texto.encode("latin-1", "replace").translate(_TABLA_NORMALIZACION).decode("latin-1")
+
+
+def _aparece(raiz: str, patrones: list[re.Pattern], normalizado: str) -> bool:
+    """Alguna variante coincide en una de las posiciones de ``raiz`` en el texto."""
+    inicio = normalizado.find(raiz)
+    while inicio >= 0:
+        for patron in patrones:
+            if patron.match(normalizado, inicio):
+                return True
+        inicio = normalizado.find(raiz, inicio + 1)
+    return False
+
+
+class ClasificadorFormato:
+    """Reglas recorridas de mayor a menor prioridad y peso con búsquedas de subcadenas.
+
+    Cada variante se agrupa por su raíz ("subsan", "apel", "tenga"...): ``in``
+    descarta las raíces ausentes del texto normalizado y la expresión de la
+    variante solo se prueba donde aparece la raíz. Como las comprobaciones en
+    orden de la versión original, el recorrido termina en cuanto ninguna regla
+    pendiente puede cambiar el formato ganador, y sin ninguna coincidencia deja
+    de buscar cuando las reglas que quedan solo pueden dar el formato por defecto.
+    """
+
+    def __init__(self, reglas: Sequence[Regla] = REGLAS, por_defecto: str = FORMATO_POR_DEFECTO):
+        self.reglas = tuple(reglas)
+        self.por_defecto = por_defecto
+        self._orden = sorted(range(len(self.reglas)), key=lambda i: (-self.reglas[i].prioridad, -self.reglas[i].peso))
+        # (raíz, variantes con esa raíz, posición de la regla en el orden), de todas las reglas seguidas
+        raices: list[tuple[str, list[re.Pattern], int]] = [
+            (raiz, patrones, posicion)
+            for posicion, indice in enumerate(self._orden)
+            for raiz, patrones in self._compilar(self.reglas[indice]).items()
+        ]
+        # Las reglas finales que solo pueden dar el formato por defecto (como "presente")
+        corte = len(self._orden)
+        while corte and self.reglas[self._orden[corte - 1]].formato == por_defecto:
+            corte -= 1
+        self._tramos = (
+            [raiz for raiz in raices if raiz[2] < corte],
+            [raiz for raiz in raices if raiz[2] >= corte],
+        )
+        # Lo más que puede alcanzar cada formato con las reglas posteriores a cada posición
+        self._techos: list[dict[str, tuple[int, float]]] = []
+        for posicion in range(len(self._orden)):
+            techo: dict[str, tuple[int, float]] = {}
+            self._acumular(techo, (self.reglas[i] for i in self._orden[posicion + 1:]))
+            self._techos.append(techo)
+        self._formatos = [self.reglas[indice].formato for indice in self._orden]
+        # Si la primera regla encontrada ya decide el formato por sí sola (el caso habitual)
+        self._decide_sola = [
+            self._decidido(self._acumular({}, (self.reglas[indice],)), posicion) is not None
+            for posicion, indice in enumerate(self._orden)
+        ]
+
+    @staticmethod
+    def _compilar(regla: Regla) -> dict[str, list[re.Pattern]]:
+        raices: dict[str, list[re.Pattern]] = {}
+        for variante in regla.variantes:
+            raiz = _RAIZ.match(variante)
+            if raiz is None:
+                raise ValueError(f"La variante {variante!r} de {regla.palabra!r} no empieza por una raíz literal")
+            raices.setdefault(raiz.group(1), []).append(re.compile(r"\b" + variante))
+        return raices
+
+    @staticmethod
+    def _acumular(mejor: dict[str, tuple[int, float]], reglas: Iterable[Regla]) -> dict[str, tuple[int, float]]:
+        """Suma las reglas a la prioridad máxima y el peso acumulado de su formato."""
+        for regla in reglas:
+            prioridad, peso = mejor.get(regla.formato, (regla.prioridad, 0.0))
+            mejor[regla.formato] = (max(prioridad, regla.prioridad), peso + regla.peso)
+        return mejor
+
+    def _decidido(self, mejor: dict[str, tuple[int, float]], posicion: int) -> str | None:
+        """El formato que ya no puede perder tras la regla de ``posicion``, o None."""
+        lider = max(mejor, key=mejor.get)
+        for formato, (prioridad, peso) in self._techos[posicion].items():
+            if formato == lider:
+                continue
+            actual = mejor.get(formato)
+            posible = (prioridad, peso) if actual is None else (max(actual[0], prioridad), actual[1] + peso)
+            if posible >= mejor[lider]:
+                return None
+        return lider
+
+    def coincidencias(self, texto: str) -> list[str]:
+        """Palabras de referencia de las reglas que se encuentran en ``texto``."""
+        normalizado = normalizar(texto)
+        posiciones = {
+            posicion
+            for tramo in self._tramos
+            for raiz, patrones, posicion in tramo
+            if _aparece(raiz, patrones, normalizado)
+        }
+        return [self.reglas[indice].palabra for indice in sorted(self._orden[p] for p in posiciones)]
+
+    def clasificar(self, texto: str) -> str:
+        normalizado = normalizar(texto)
+        mejor: dict[str, tuple[int, float]] = {}
+        for tramo in self._tramos:
+            ultima = -1
+            for raiz, patrones, posicion in tramo:
+                # ``in`` descarta casi todas las raíces sin llamar a ninguna función
+                if raiz not in normalizado or posicion == ultima or not _aparece(raiz, patrones, normalizado):
+                    continue
+                ultima = posicion
+                if not mejor and self._decide_sola[posicion]:
+                    return self._formatos[posicion]
+                self._acumular(mejor, (self.reglas[self._orden[posicion]],))
+                formato = self._decidido(mejor, posicion)
+                if formato is not None:
+                    return formato
+            if not mejor:
+                return self.por_defecto
+        return max(mejor, key=mejor.get)
+
+    def clasificar_lote(self, textos: Sequence[str]) -> list[str]:
+        return [self.clasificar(texto) for texto in textos]
+
+
+CLASIFICADOR = ClasificadorFormato()
+
+
+@lru_cache(maxsize=1024)
+def determinar_formato(solucion: str) -> str:
+    """Determina el formato necesario basado en el contenido de la solución.
+
+    Cada render del paso 4 vuelve a preguntar por las mismas tres soluciones:
+    el resultado se memoriza por texto.
+    """
+    return CLASIFICADOR.clasificar(solucion)
+
+
+def determinar_formatos(soluciones: Sequence[str]) -> list[str]:
+    """``determinar_formato`` para varias soluciones en una sola llamada, sin memorizar."""
+    return CLASIFICADOR.clasificar_lote(soluciones)
@@ -0,0 +1,414 @@
+"""Historial de conversación persistente, paginado y deduplicado por contenido.
+
+Cada mensaje se añade a una tabla de solo inserción indexada por sesión y caso;
+el contenido se guarda aparte, comprimido, una sola vez por SHA-256. El mismo
+fragmento de 100k caracteres enviado varias veces (reanálisis, varias sesiones
+con el mismo documento) o las plantillas de prompt repetidas ocupan una única
+fila. La sesión de Streamlit solo conserva sus identificadores, de modo que la
+memoria por sesión no crece con el número de documentos procesados.
+
+Las respuestas del asistente (análisis y escritos) se indexan además en una
+tabla FTS5 sin contenido propio (``content=''``): el texto ya está en
+``contenidos`` y el índice solo guarda los términos. Las búsquedas combinan el
+índice con filtros por área, rol, formato y fechas sobre ``mensajes``.
+
+La exportación escribe NDJSON (un mensaje por línea, opcionalmente en gzip)
+directamente en el destino mientras lee el historial por lotes, sin construir
+nunca la conversación completa en memoria.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import unicodedata
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+RUTA_POR_DEFECTO = os.getenv("EJ_HISTORIAL_DB", "historial.db")
+TAMANO_PAGINA = 20
+NIVEL_COMPRESION = 6
+# Caracteres de contexto a cada lado del término en los fragmentos de resultados
+CONTEXTO_FRAGMENTO = 120
+# Mensajes leídos por lote al exportar: acota la memoria a unos pocos documentos
+LOTE_EXPORTACION = 8
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS contenidos (
+    hash TEXT PRIMARY KEY,
+    datos BLOB NOT NULL,
+    bytes INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mensajes (
+    id INTEGER PRIMARY KEY,
+    sesion TEXT NOT NULL,
+    caso TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    role TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES contenidos (hash),
+    area TEXT,
+    rol TEXT,
+    formato TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS mensajes_sesion ON mensajes (sesion, id);
+CREATE INDEX IF NOT EXISTS mensajes_caso ON mensajes (caso, id);
+CREATE INDEX IF NOT EXISTS mensajes_respuestas ON mensajes (fecha) WHERE role = 'assistant';
+CREATE VIRTUAL TABLE IF NOT EXISTS busqueda USING fts5(
+    texto, content='', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS sesiones (
+    sesion TEXT PRIMARY KEY,
+    inicio TEXT NOT NULL,
+    modelo TEXT NOT NULL,
+    usuario TEXT
+);
+"""
+
+
+def hash_contenido(contenido: str) -> str:
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class Mensaje:
+    id: int
+    sesion: str
+    caso: str
+    fecha: str
+    role: str
+    contenido: str
+    metadata: dict = field(default_factory=dict)
+
+    def como_dict(self) -> dict:
+        """Misma forma que los mensajes del antiguo ``conversation_history``."""
+        mensaje = {"role": self.role, "content": self.contenido, "timestamp": self.fecha}
+        if self.metadata:
+            mensaje["metadata"] = self.metadata
+        return mensaje
+
+
+@dataclass(frozen=True)
+class Resultado:
+    mensaje: Mensaje
+    fragmento: str
+
+    @property
+    def tipo(self) -> str:
+        return "escrito" if self.mensaje.metadata.get("formato") else "análisis"
+
+
+@dataclass(frozen=True)
+class Pagina:
+    mensajes: list[Mensaje]
+    siguiente: int | None  # cursor para la página siguiente (None si es la última)
+
+
+class AlmacenHistorial:
+    """Historial de solo inserción en SQLite (WAL), seguro entre sesiones y procesos."""
+
+    def __init__(self, ruta: str | Path = RUTA_POR_DEFECTO):
+        self.ruta = str(ruta)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+            # Bases anteriores a la búsqueda por usuario
+            if "usuario" not in {fila[1] for fila in con.execute("PRAGMA table_info(sesiones)")}:
+                con.execute("ALTER TABLE sesiones ADD COLUMN usuario TEXT")
+            con.execute("CREATE INDEX IF NOT EXISTS sesiones_usuario ON sesiones (usuario)")
+        self._indexar_pendientes()
+
+    @contextmanager
+    def _conexion(self):
+        # Conexiones cortas, igual que AlmacenFeedback: una por llamada y por hilo
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            con.execute("PRAGMA synchronous=NORMAL")
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def iniciar_sesion(
+        self, sesion: str, modelo: str, inicio: str | None = None, usuario: str | None = None
+    ) -> None:
+        """Registra la información de la sesión (solo la primera vez) y a qué usuario pertenece."""
+        with self._conexion() as con:
+            con.execute(
+                "INSERT OR IGNORE INTO sesiones (sesion, inicio, modelo, usuario) VALUES (?, ?, ?, ?)",
+                (sesion, inicio or datetime.now().isoformat(), modelo, usuario),
+            )
+
+    def agregar(
+        self,
+        sesion: str,
+        caso: str,
+        role: str,
+        contenido: str,
+        metadata: dict | None = None,
+        fecha: str | None = None,
+    ) -> int:
+        """Añade un mensaje; el contenido se comprime y se guarda una vez por hash."""
+        clave = hash_contenido(contenido)
+        metadata = metadata or {}
+        with self._transaccion() as con:
+            existe = con.execute("SELECT 1 FROM contenidos WHERE hash = ?", (clave,)).fetchone()
+            if not existe:
+                datos = contenido.encode("utf-8")
+                con.execute(
+                    "INSERT INTO contenidos (hash, datos, bytes) VALUES (?, ?, ?)",
+                    (clave, zlib.compress(datos, NIVEL_COMPRESION), len(datos)),
+                )
+            cursor = con.execute(
+                "INSERT INTO mensajes (sesion, caso, fecha, role, hash, area, rol, formato, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    sesion,
+                    caso,
+                    fecha or datetime.now().isoformat(),
+                    role,
+                    clave,
+                    metadata.get("area"),
+                    metadata.get("rol"),
+                    metadata.get("formato"),
+                    json.dumps(metadata, ensure_ascii=False) if metadata else None,
+                ),
+            )
+            if role == "assistant":
+                con.execute("INSERT INTO busqueda (rowid, texto) VALUES (?, ?)", (cursor.lastrowid, contenido))
+            return cursor.lastrowid
+
+    def _indexar_pendientes(self) -> None:
+        """Indexa las respuestas guardadas antes de existir el índice de búsqueda."""
+        with self._transaccion() as con:
+            ultimo = con.execute("SELECT COALESCE(MAX(rowid), 0) FROM busqueda").fetchone()[0]
+            filas = con.execute(
+                "SELECT m.id, c.datos FROM mensajes m JOIN contenidos c ON c.hash = m.hash "
+                "WHERE m.role = 'assistant' AND m.id > ?",
+                (ultimo,),
+            ).fetchall()
+            con.executemany(
+                "INSERT INTO busqueda (rowid, texto) VALUES (?, ?)",
+                ((id_, zlib.decompress(datos).decode("utf-8")) for id_, datos in filas),
+            )
+
+    @staticmethod
+    def _mensaje(fila) -> Mensaje:
+        id_, sesion, caso, fecha, role, datos, metadata = fila
+        return Mensaje(
+            id_, sesion, caso, fecha, role,
+            zlib.decompress(datos).decode("utf-8"),
+            json.loads(metadata) if metadata else {},
+        )
+
+    def _consultar(self, condiciones: list[str], parametros: list, orden: str, limite: int | None):
+        where = " AND ".join(condiciones) or "1"
+        sql = (
+            "SELECT m.id, m.sesion, m.caso, m.fecha, m.role, c.datos, m.metadata "
+            "FROM mensajes m JOIN contenidos c ON c.hash = m.hash "
+            f"WHERE {where} ORDER BY m.id {orden}"
+        )
+        if limite is not None:
+            sql += " LIMIT ?"
+            parametros = [*parametros, limite]
+        with self._conexion() as con:
+            return [self._mensaje(fila) for fila in con.execute(sql, parametros).fetchall()]
+
+    def pagina(
+        self,
+        sesion: str,
+        antes_de: int | None = None,
+        limite: int = TAMANO_PAGINA,
+        solo_borradores: bool = False,
+    ) -> Pagina:
+        """Mensajes de la sesión del más reciente al más antiguo, paginados por cursor.
+
+        ``antes_de`` es el cursor devuelto por la página anterior. Con
+        ``solo_borradores`` solo se devuelven las respuestas con formato, es
+        decir, los escritos generados.
+        """
+        condiciones, parametros = ["m.sesion = ?"], [sesion]
+        if antes_de is not None:
+            condiciones.append("m.id < ?")
+            parametros.append(antes_de)
+        if solo_borradores:
+            condiciones.append("m.role = 'assistant' AND m.formato IS NOT NULL")
+        mensajes = self._consultar(condiciones, parametros, "DESC", limite + 1)
+        siguiente = mensajes[limite - 1].id if len(mensajes) > limite else None
+        return Pagina(mensajes[:limite], siguiente)
+
+    def iterar(self, sesion: str, lote: int = 100) -> Iterator[Mensaje]:
+        """Todos los mensajes de la sesión en orden, leídos por lotes."""
+        ultimo = 0
+        while True:
+            mensajes = self._consultar(["m.sesion = ?", "m.id > ?"], [sesion, ultimo], "ASC", lote)
+            yield from mensajes
+            if len(mensajes) < lote:
+                return
+            ultimo = mensajes[-1].id
+
+    def analisis_registrados(self, lote: int = LOTE_EXPORTACION) -> Iterator[tuple[Mensaje, Mensaje]]:
+        """Pares (documento enviado, respuesta) de los análisis completos de todas las sesiones.
+
+        Son los ejemplos etiquetados con los que se entrenan modelos locales,
+        como el clasificador de etapa. Se excluyen las redacciones, los
+        análisis incrementales y los que ya usaron la etapa local.
+        """
+        condiciones = [
+            "m.role = 'user'",
+            "m.formato IS NULL",
+            "json_extract(m.metadata, '$.assistant_id') IS NOT NULL",
+            "json_extract(m.metadata, '$.incremental') IS NULL",
+            "json_extract(m.metadata, '$.etapa_local') IS NULL",
+        ]
+        ultimo = 0
+        while True:
+            documentos = self._consultar([*condiciones, "m.id > ?"], [ultimo], "ASC", lote)
+            for documento in documentos:
+                respuesta = self._consultar(
+                    ["m.caso = ?", "m.id > ?", "m.role = 'assistant'"], [documento.caso, documento.id], "ASC", 1
+                )
+                if respuesta and respuesta[0].metadata.get("status") != "failed":
+                    yield documento, respuesta[0]
+            if len(documentos) < lote:
+                return
+            ultimo = documentos[-1].id
+
+    def buscar(
+        self,
+        texto: str = "",
+        sesion: str | None = None,
+        usuario: str | None = None,
+        area: str | None = None,
+        rol: str | None = None,
+        formato: str | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        limite: int = TAMANO_PAGINA,
+    ) -> list[Resultado]:
+        """Busca en los análisis y escritos guardados.
+
+        Los términos se buscan como prefijos, sin distinguir mayúsculas ni
+        tildes, y los resultados se ordenan por relevancia (BM25). Sin texto,
+        devuelve las respuestas más recientes que cumplan los filtros. ``desde``
+        y ``hasta`` son fechas ``YYYY-MM-DD`` inclusivas; ``sesion`` limita la
+        búsqueda a una sesión y ``usuario``, a todas las sesiones del usuario.
+        """
+        terminos = re.findall(r"\w+", texto)
+        condiciones, parametros = ["m.role = 'assistant'"], []
+        for columna, valor in (("m.sesion", sesion), ("m.area", area), ("m.rol", rol), ("m.formato", formato)):
+            if valor:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+        if usuario:
+            condiciones.append("m.sesion IN (SELECT sesion FROM sesiones WHERE usuario = ?)")
+            parametros.append(usuario)
+        if desde:
+            condiciones.append("m.fecha >= ?")
+            parametros.append(desde)
+        if hasta:
+            # Fechas ISO: todo lo del día "hasta" es menor que "hasta~"
+            condiciones.append("m.fecha < ?")
+            parametros.append(f"{hasta}~")
+        where = " AND ".join(condiciones)
+        columnas = "m.id, m.sesion, m.caso, m.fecha, m.role, c.datos, m.metadata"
+        if terminos:
+            sql = (
+                f"SELECT {columnas} FROM busqueda b "
+                "JOIN mensajes m ON m.id = b.rowid JOIN contenidos c ON c.hash = m.hash "
+                f"WHERE busqueda MATCH ? AND {where} ORDER BY b.rank LIMIT ?"
+            )
+            consulta = " ".join(f'"{t}"*' for t in terminos)
+            parametros = [consulta, *parametros, limite]
+        else:
+            sql = (
+                f"SELECT {columnas} FROM mensajes m JOIN contenidos c ON c.hash = m.hash "
+                f"WHERE {where} ORDER BY m.id DESC LIMIT ?"
+            )
+            parametros = [*parametros, limite]
+        with self._conexion() as con:
+            filas = con.execute(sql, parametros).fetchall()
+        mensajes = [self._mensaje(fila) for fila in filas]
+        return [Resultado(m, _fragmento(m.contenido, terminos)) for m in mensajes]
+
+    def ultimo_id(self, sesion: str) -> int:
+        """Id del último mensaje de la sesión (0 si no hay): identifica una versión del historial."""
+        with self._conexion() as con:
+            return con.execute("SELECT COALESCE(MAX(id), 0) FROM mensajes WHERE sesion = ?", (sesion,)).fetchone()[0]
+
+    def exportar_ndjson(self, sesion: str, destino: BinaryIO, comprimir: bool = False) -> int:
+        """Escribe el historial de la sesión como NDJSON en ``destino``; devuelve los mensajes escritos.
+
+        La primera línea describe la sesión (``system_info``); cada una de las
+        siguientes es un mensaje con la forma de ``Mensaje.como_dict``.
+        """
+        # mtime=0: la misma sesión produce siempre los mismos bytes
+        salida = gzip.GzipFile(fileobj=destino, mode="wb", mtime=0) if comprimir else destino
+        try:
+            salida.write(_linea_ndjson({"system_info": self.info_sesion(sesion)}))
+            escritos = 0
+            for mensaje in self.iterar(sesion, lote=LOTE_EXPORTACION):
+                salida.write(_linea_ndjson(mensaje.como_dict()))
+                escritos += 1
+        finally:
+            if comprimir:
+                salida.close()
+        return escritos
+
+    def contar(self, sesion: str, solo_borradores: bool = False) -> int:
+        sql = "SELECT COUNT(*) FROM mensajes WHERE sesion = ?"
+        if solo_borradores:
+            sql += " AND role = 'assistant' AND formato IS NOT NULL"
+        with self._conexion() as con:
+            return con.execute(sql, (sesion,)).fetchone()[0]
+
+    def info_sesion(self, sesion: str) -> dict:
+        with self._conexion() as con:
+            fila = con.execute(
+                "SELECT inicio, modelo FROM sesiones WHERE sesion = ?", (sesion,)
+            ).fetchone()
+        return {"start_time": fila[0], "openai_model": fila[1]} if fila else {}
+
+
+def _linea_ndjson(objeto: dict) -> bytes:
+    return (json.dumps(objeto, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def _fragmento(contenido: str, terminos: list[str]) -> str:
+    """Extracto del contenido alrededor del primer término encontrado."""
+    # La normalización NFD + eliminación de marcas conserva la longitud en el
+    # texto jurídico habitual (letras latinas precompuestas), así que las
+    # posiciones coinciden con las del original.
+    normalizado = _sin_acentos(contenido).lower()
+    posicion = -1
+    for termino in terminos:
+        posicion = normalizado.find(_sin_acentos(termino).lower())
+        if posicion >= 0:
+            break
+    if posicion < 0 or len(normalizado) != len(contenido):
+        posicion = 0
+    inicio = max(posicion - CONTEXTO_FRAGMENTO, 0)
+    fin = posicion + CONTEXTO_FRAGMENTO
+    fragmento = " ".join(contenido[inicio:fin].split())
+    return f"{'…' if inicio else ''}{fragmento}{'…' if fin < len(contenido) else ''}"
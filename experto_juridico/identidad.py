@@ -0,0 +1,89 @@
+"""Identificadores firmados que el navegador guarda en cookies.
+
+La aplicación no tiene cuentas propias: sin autenticación de Streamlit, el
+usuario es un id aleatorio que su navegador conserva en una cookie, y la
+sesión en curso se retoma con otra. Ambas se firman con HMAC-SHA256 para que
+no se puedan fabricar ni alterar; el secreto se toma de ``EJ_SECRETO`` o, si
+no está definido, de ``EJ_SECRETO_ARCHIVO`` (por defecto ``secreto.key``),
+que se crea la primera vez. Con varias réplicas, todas deben usar el mismo.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+
+RUTA_SECRETO = os.getenv("EJ_SECRETO_ARCHIVO", "secreto.key")
+# Espera máxima (segundos) a que el archivo del secreto tenga contenido
+ESPERA_SECRETO = 5.0
+
+_secreto: bytes | None = None
+_lock = threading.Lock()
+
+
+def _crear_archivo_secreto(ruta: Path) -> None:
+    """Crea el archivo con una clave nueva, ya completo y con permisos 0600.
+
+    La clave se escribe en un temporal propio y se enlaza con ``os.link``, que
+    falla si el archivo ya existe: si otro proceso lo crea a la vez, gana el
+    primero y nadie ve nunca un archivo a medio escribir.
+    """
+    temporal = ruta.with_name(f".{ruta.name}.{os.getpid()}.{secrets.token_hex(4)}")
+    fd = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+            f.flush()
+            os.fsync(f.fileno())
+        os.link(temporal, ruta)
+    except FileExistsError:
+        pass
+    finally:
+        temporal.unlink(missing_ok=True)
+
+
+def secreto() -> bytes:
+    """Clave de firma del proceso (se lee o se genera una sola vez)."""
+    global _secreto
+    with _lock:
+        if _secreto is None:
+            if os.getenv("EJ_SECRETO"):
+                _secreto = os.environ["EJ_SECRETO"].encode("utf-8")
+            else:
+                ruta = Path(RUTA_SECRETO)
+                if not ruta.exists():
+                    _crear_archivo_secreto(ruta)
+                # Un archivo vacío aún no está listo (p. ej. lo copia otra réplica):
+                # firmar con una clave vacía haría las cookies falsificables
+                limite = time.monotonic() + ESPERA_SECRETO
+                while not (leido := ruta.read_text(encoding="utf-8").strip()):
+                    if time.monotonic() > limite:
+                        raise RuntimeError(f"El archivo del secreto {ruta} está vacío")
+                    time.sleep(0.05)
+                _secreto = leido.encode("utf-8")
+    return _secreto
+
+
+def nuevo_id() -> str:
+    return secrets.token_hex(16)
+
+
+def firmar(valor: str) -> str:
+    """``valor.firma``; ``valor`` no debe contener puntos."""
+    firma = hmac.new(secreto(), valor.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{valor}.{firma}"
+
+
+def verificar(firmado: str | None) -> str | None:
+    """Valor original de un ``firmar(...)`` válido, o None."""
+    if not isinstance(firmado, str):
+        return None
+    valor, _, firma = firmado.partition(".")
+    if not valor or not firma:
+        return None
+    esperada = hmac.new(secreto(), valor.encode("utf-8"), hashlib.sha256).hexdigest()
+    return valor if hmac.compare_digest(firma, esperada) else None
@@ -0,0 +1,175 @@
+"""Variantes redimensionadas de las imágenes de la interfaz, generadas una vez por proceso.
+
+La imagen corporativa original es un PNG de 1024x1024 (~1,6 MB). Incrustarla en
+base64 en cada rerun enviaba ~2,2 MB por el websocket a cada usuario; aquí se
+reduce una sola vez a WebP del ancho necesario y los bytes quedan en memoria.
+
+Si la imagen corporativa no existe, se genera con DALL-E en un hilo de fondo
+(una vez por proceso, con un archivo de bloqueo compartido entre procesos)
+mientras la interfaz muestra la imagen de respaldo.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from experto_juridico import metricas
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_IMAGENES = Path(__file__).resolve().parent.parent
+RUTA_IMAGEN_CORPORATIVA = DIRECTORIO_IMAGENES / "corporate_image.png"
+RUTA_IMAGEN_RESPALDO = DIRECTORIO_IMAGENES / "abogada experta japon.png"
+
+PROMPT_IMAGEN_CORPORATIVA = (
+    "Ejecutivo de negocios con traje oscuro interactuando con una interfaz holográfica azul; "
+    "en el centro, un icono luminoso de balanza de la justicia rodeado de símbolos legales "
+    "—mazo, edificio judicial, apretón de manos, lupa, grupo de personas, libro abierto y "
+    "globo de diálogo— sobre un fondo oscuro difuminado que realza el efecto futurista y profesional."
+)
+
+# Límites de tiempo para la generación (segundos)
+TIMEOUT_GENERACION = 120
+TIMEOUT_DESCARGA = (5, 60)  # (conexión, lectura)
+# Un bloqueo más antiguo que esto se considera abandonado por un proceso caído
+ANTIGUEDAD_MAXIMA_BLOQUEO = 10 * 60
+
+# Ancho de la columna de la imagen en Inicio (~400 px) al doble para pantallas HiDPI
+ANCHO_POR_DEFECTO = 800
+CALIDAD_WEBP = 82
+
+BYTES_IMAGEN = metricas.REGISTRO.medidor(
+    "experto_juridico_imagen_bytes",
+    "Tamaño en bytes de la imagen corporativa por variante (original, base64 incrustado, redimensionadas).",
+    ("variante",),
+)
+
+
+@lru_cache(maxsize=16)
+def _generar_variante(ruta: str, mtime: float, ancho: int, formato: str) -> bytes:
+    from PIL import Image
+
+    t0 = time.perf_counter()
+    with Image.open(ruta) as img:
+        img = img.convert("RGB")
+        if img.width > ancho:
+            alto = round(img.height * ancho / img.width)
+            img = img.resize((ancho, alto), Image.LANCZOS)
+        buffer = BytesIO()
+        if formato == "WEBP":
+            img.save(buffer, format="WEBP", quality=CALIDAD_WEBP, method=6)
+        else:
+            img.save(buffer, format=formato, optimize=True)
+    datos = buffer.getvalue()
+
+    original = os.path.getsize(ruta)
+    BYTES_IMAGEN.set(original, variante="original")
+    BYTES_IMAGEN.set(4 * math.ceil(original / 3), variante="base64_incrustado")
+    BYTES_IMAGEN.set(len(datos), variante=f"{formato.lower()}_{ancho}")
+    metricas.DURACION_ETAPA.observar(time.perf_counter() - t0, etapa="imagen_generar_variante")
+    return datos
+
+
+def variante(ruta: str, ancho: int = ANCHO_POR_DEFECTO, formato: str = "WEBP") -> bytes:
+    """Devuelve los bytes de la imagen redimensionada (cacheados por ruta y fecha de modificación)."""
+    mtime = os.path.getmtime(ruta)
+    hits_previos = _generar_variante.cache_info().hits
+    datos = _generar_variante(ruta, mtime, ancho, formato.upper())
+    acierto = _generar_variante.cache_info().hits > hits_previos
+    metricas.CACHE.inc(cache="imagen_variante", resultado="hit" if acierto else "miss")
+    return datos
+
+
+###############################################################################
+# Generación en segundo plano
+###############################################################################
+
+_generacion_lock = threading.Lock()
+_generacion_iniciada = False
+
+
+def imagen_corporativa() -> str | None:
+    """Devuelve la ruta de la imagen a mostrar sin bloquear nunca la interfaz.
+
+    Si la imagen corporativa aún no existe, lanza su generación en segundo
+    plano y devuelve la imagen de respaldo (o None si tampoco existe).
+    """
+    if RUTA_IMAGEN_CORPORATIVA.exists():
+        return str(RUTA_IMAGEN_CORPORATIVA)
+    iniciar_generacion()
+    return str(RUTA_IMAGEN_RESPALDO) if RUTA_IMAGEN_RESPALDO.exists() else None
+
+
+def iniciar_generacion() -> bool:
+    """Lanza la generación una única vez por proceso; devuelve True si la lanzó."""
+    global _generacion_iniciada
+    with _generacion_lock:
+        if _generacion_iniciada:
+            return False
+        _generacion_iniciada = True
+    threading.Thread(target=_generar_con_bloqueo, name="imagen-corporativa", daemon=True).start()
+    return True
+
+
+def _adquirir_bloqueo(ruta: Path) -> bool:
+    """Crea el archivo de bloqueo de forma atómica; False si otro proceso lo tiene."""
+    for _ in range(2):
+        try:
+            fd = os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                abandonado = time.time() - ruta.stat().st_mtime > ANTIGUEDAD_MAXIMA_BLOQUEO
+            except FileNotFoundError:
+                continue
+            if not abandonado:
+                return False
+            ruta.unlink(missing_ok=True)
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    return False
+
+
+def _generar_con_bloqueo() -> None:
+    bloqueo = RUTA_IMAGEN_CORPORATIVA.with_suffix(".lock")
+    if not _adquirir_bloqueo(bloqueo):
+        return
+    try:
+        # Otro proceso pudo terminarla mientras esperábamos el bloqueo
+        if not RUTA_IMAGEN_CORPORATIVA.exists():
+            with metricas.medir("imagen_generacion_dalle"):
+                _generar_imagen_corporativa(RUTA_IMAGEN_CORPORATIVA)
+    except Exception:
+        logger.exception("Error generando la imagen corporativa")
+    finally:
+        bloqueo.unlink(missing_ok=True)
+
+
+def _generar_imagen_corporativa(destino: Path) -> None:
+    """Genera la imagen con DALL-E y la escribe de forma atómica en ``destino``."""
+    import openai
+    import requests
+
+    response = openai.images.generate(
+        model="dall-e-3",
+        prompt=PROMPT_IMAGEN_CORPORATIVA,
+        n=1,
+        size="1024x1024",
+        quality="hd",
+        style="vivid",
+        timeout=TIMEOUT_GENERACION,
+    )
+    respuesta = requests.get(response.data[0].url, timeout=TIMEOUT_DESCARGA)
+    respuesta.raise_for_status()
+
+    # Escribir a un temporal y renombrar: nadie ve nunca un PNG a medio escribir
+    temporal = destino.with_suffix(f".{os.getpid()}.tmp")
+    temporal.write_bytes(respuesta.content)
+    os.replace(temporal, destino)
@@ -0,0 +1,423 @@
+"""Procesamiento por lotes de una carpeta de expedientes, sin Streamlit.
+
+Cada archivo PDF/DOCX de la carpeta es un caso, y cada subcarpeta, un caso de
+varios documentos (como la subida múltiple del paso 3). Por caso se extrae el
+texto, se analiza en un thread propio del asistente y se redactan los
+escritos de las soluciones pedidas; los casos se reparten entre un pool de
+hilos acotado (el trabajo es sobre todo espera a la API).
+
+Las salidas hacen de puntos de control: ``<caso>.analisis.json`` se escribe
+en cuanto hay análisis y se actualiza tras cada borrador
+(``<caso>.borrador-<n>.docx``), siempre de forma atómica. Al relanzar el lote
+se omite lo ya hecho y un caso que falló a medias retoma el análisis guardado
+y su thread (la redacción se apoya en el documento ya enviado; si el análisis
+solo envió un extracto, el documento completo se envía antes del primer
+borrador). Si cambia el contenido del caso, el área o el rol, la huella no
+coincide y se rehace.
+
+Uso:
+    python -m experto_juridico.lote expedientes/ --area "Derecho Civil" --rol Demandante
+    python -m experto_juridico.lote expedientes/ --salida resultados/ --trabajadores 8 --soluciones 1,2,3
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from experto_juridico import analisis, asistente, expediente, exportacion, extraccion, formatos, metricas
+from experto_juridico.historial import AlmacenHistorial
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = {".pdf", ".docx"}
+ARCHIVO_PROGRESO = "progreso.jsonl"
+ARCHIVO_RESUMEN = "resumen.json"
+TRABAJADORES = 4
+REINTENTOS = 2
+ESPERA_REINTENTO = 5.0  # segundos; se duplica en cada reintento
+
+CASOS_LOTE = metricas.REGISTRO.contador(
+    "experto_juridico_lote_casos_total",
+    "Casos procesados en modo lote por resultado (completo, omitido, error).",
+    ("estado",),
+)
+
+T = TypeVar("T")
+
+
+class ErrorCaso(Exception):
+    """El caso no se pudo completar (se reintenta al relanzar el lote)."""
+
+
+@dataclass(frozen=True)
+class Caso:
+    nombre: str
+    archivos: tuple[Path, ...]
+
+
+@dataclass(frozen=True)
+class Opciones:
+    area: str
+    rol: str
+    salida: Path
+    soluciones: tuple[int, ...] = (1,)
+    reintentos: int = REINTENTOS
+    historial: AlmacenHistorial | None = None
+    sesion: str = ""
+
+
+@dataclass
+class ResultadoCaso:
+    caso: str
+    estado: str  # completo, omitido o error
+    duracion: float = 0.0
+    etapas: dict[str, float] = field(default_factory=dict)
+    borradores: int = 0
+    error: str = ""
+
+
+def casos(carpeta: Path, excluir: Path | None = None) -> list[Caso]:
+    """Casos de la carpeta: un archivo suelto o una subcarpeta con sus documentos.
+
+    ``excluir`` es la carpeta de resultados, que puede estar dentro de ``carpeta``.
+    """
+    excluir = excluir.resolve() if excluir else None
+    encontrados = []
+    for entrada in sorted(carpeta.iterdir()):
+        if entrada.name.startswith(".") or entrada.resolve() == excluir:
+            continue
+        if entrada.is_dir():
+            archivos = tuple(sorted(
+                p for p in entrada.rglob("*") if p.is_file() and p.suffix.lower() in EXTENSIONES
+            ))
+            if archivos:
+                encontrados.append(Caso(entrada.name, archivos))
+        elif entrada.suffix.lower() in EXTENSIONES:
+            encontrados.append(Caso(entrada.name, (entrada,)))
+    return encontrados
+
+
+def sha256_archivo(ruta: Path) -> str:
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        while bloque := f.read(extraccion.TAMANO_BLOQUE):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def huella_caso(caso: Caso, area: str, rol: str) -> str:
+    """Identifica el contenido del caso junto con el área, el rol y la versión de los prompts."""
+    digest = hashlib.sha256(f"{area}\x00{rol}\x00{asistente.PROMPT_VERSION}".encode("utf-8"))
+    for ruta in caso.archivos:
+        digest.update(f"\x00{ruta.name}\x00{sha256_archivo(ruta)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def escribir_atomico(ruta: Path, datos: bytes) -> None:
+    """Escribe en un temporal y lo renombra: un corte no deja archivos a medias."""
+    temporal = ruta.with_name(ruta.name + ".tmp")
+    temporal.write_bytes(datos)
+    os.replace(temporal, ruta)
+
+
+def guardar_registro(ruta: Path, registro: dict) -> None:
+    escribir_atomico(ruta, json.dumps(registro, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def leer_registro(ruta: Path) -> dict | None:
+    try:
+        return json.loads(ruta.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _con_reintentos(descripcion: str, funcion: Callable[[], T | None], reintentos: int) -> T:
+    """Llama a ``funcion`` hasta que devuelva algo, con espera exponencial entre intentos."""
+    for intento in range(reintentos + 1):
+        try:
+            resultado = funcion()
+            if resultado is not None:
+                return resultado
+            motivo = "el asistente no completó la respuesta"
+        except Exception as exc:
+            motivo = str(exc) or type(exc).__name__
+        if intento < reintentos:
+            espera = ESPERA_REINTENTO * 2 ** intento
+            logger.warning("%s falló (%s); reintento en %.0f s", descripcion, motivo, espera)
+            time.sleep(espera)
+    raise ErrorCaso(f"{descripcion}: {motivo}")
+
+
+def extraer_caso(caso: Caso) -> str:
+    with ExitStack() as pila:
+        subidas = [(ruta.name, pila.enter_context(open(ruta, "rb"))) for ruta in caso.archivos]
+        resultado = expediente.extraer_expediente(subidas)
+    for nombre, motivo in resultado.errores.items():
+        logger.warning("%s: no se pudo leer «%s»: %s", caso.nombre, nombre, motivo)
+    if not resultado.documentos:
+        raise ErrorCaso("No se pudo extraer el texto de ningún documento")
+    return resultado.corpus(asistente.MAX_DOC_CHARS)
+
+
+def procesar_caso(caso: Caso, opciones: Opciones) -> ResultadoCaso:
+    """Analiza el caso y redacta sus borradores, retomando lo ya guardado."""
+    inicio = time.perf_counter()
+    resultado = ResultadoCaso(caso.nombre, "omitido")
+    ruta_registro = opciones.salida / f"{caso.nombre}.analisis.json"
+    assistant_id = asistente.ASSISTANT_IDS[opciones.area]
+    huella = huella_caso(caso, opciones.area, opciones.rol)
+
+    def registrar(role: str, contenido: str, metadata: dict | None = None) -> None:
+        if opciones.historial is not None:
+            opciones.historial.agregar(opciones.sesion, huella[:32], role, contenido, metadata)
+
+    texto = None
+    registro = leer_registro(ruta_registro)
+    if registro is None or registro.get("huella") != huella:
+        resultado.estado = "completo"
+        t0 = time.perf_counter()
+        texto = extraer_caso(caso)
+        resultado.etapas["extraccion"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        # Cada caso es independiente: sin versiones anteriores, vía completa o etapa local
+        plan = analisis.planificar(texto, opciones.area, opciones.rol)
+
+        def analizar() -> tuple[str, dict] | None:
+            # Un thread por intento: reintentar en el mismo le añadiría el documento otra vez
+            thread_id = asistente.crear_thread()
+            hecho = analisis.ejecutar(plan, texto, assistant_id, opciones.area, opciones.rol, thread_id, registrar)
+            return (thread_id, hecho) if hecho is not None else None
+
+        thread_id, resultado_analisis = _con_reintentos("Análisis", analizar, opciones.reintentos)
+        resultado.etapas["analisis"] = time.perf_counter() - t0
+
+        for anterior in opciones.salida.glob(f"{caso.nombre}.borrador-*.docx"):
+            anterior.unlink()
+        registro = {
+            "caso": caso.nombre,
+            "archivos": [str(ruta) for ruta in caso.archivos],
+            "huella": huella,
+            "area": opciones.area,
+            "rol": opciones.rol,
+            "thread_id": thread_id,
+            "via": plan.via,
+            "documento_en_thread": plan.envia_documento,
+            "caracteres": len(texto),
+            "fecha": datetime.now().isoformat(),
+            "analisis": resultado_analisis,
+            "borradores": {},
+        }
+        guardar_registro(ruta_registro, registro)
+
+    soluciones = registro["analisis"].get("soluciones") or []
+    # Formato de todas las soluciones antes de redactar ninguna
+    formatos_soluciones = formatos.determinar_formatos(soluciones)
+    for numero in opciones.soluciones:
+        hecho = registro["borradores"].get(str(numero))
+        if hecho and (opciones.salida / hecho["archivo"]).exists():
+            continue
+        if numero > len(soluciones):
+            raise ErrorCaso(f"El análisis solo tiene {len(soluciones)} soluciones (se pidió la {numero})")
+        resultado.estado = "completo"
+        solucion = soluciones[numero - 1]
+        t0 = time.perf_counter()
+        if not registro.get("documento_en_thread", registro.get("via") == "completo"):
+            # El análisis usó un extracto: el escrito necesita el documento entero
+            texto = texto or extraer_caso(caso)
+            _con_reintentos("Envío del documento", lambda: asistente.agregar_documento(
+                texto, registro["thread_id"]
+            ), opciones.reintentos)
+            registro["documento_en_thread"] = True
+            guardar_registro(ruta_registro, registro)
+        borrador = _con_reintentos(f"Redacción {numero}", lambda: asistente.redactar(
+            solucion, registro["analisis"].get("etapa_proceso", ""), assistant_id,
+            opciones.area, opciones.rol, registro["thread_id"], registrar,
+        ), opciones.reintentos)
+        resultado.etapas["redaccion"] = resultado.etapas.get("redaccion", 0.0) + time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        archivo = f"{caso.nombre}.borrador-{numero}.docx"
+        escribir_atomico(opciones.salida / archivo, exportacion.construir_docx(borrador))
+        resultado.etapas["exportacion"] = resultado.etapas.get("exportacion", 0.0) + time.perf_counter() - t0
+        registro["borradores"][str(numero)] = {
+            "solucion": solucion,
+            "formato": formatos_soluciones[numero - 1],
+            "archivo": archivo,
+            "caracteres": len(borrador),
+        }
+        resultado.borradores += 1
+        guardar_registro(ruta_registro, registro)
+
+    resultado.duracion = time.perf_counter() - inicio
+    return resultado
+
+
+###############################################################################
+# Ejecución del lote
+###############################################################################
+
+def _percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+def resumen(resultados: list[ResultadoCaso], segundos: float, trabajadores: int) -> dict:
+    """Rendimiento del lote: casos por estado, ritmo y tiempo por etapa."""
+    completos = [r for r in resultados if r.estado == "completo"]
+    duraciones = [r.duracion for r in completos]
+    etapas_totales: dict[str, float] = {}
+    for r in completos:
+        for etapa, duracion in r.etapas.items():
+            etapas_totales[etapa] = etapas_totales.get(etapa, 0.0) + duracion
+    return {
+        "casos": len(resultados),
+        "completos": len(completos),
+        "omitidos": sum(r.estado == "omitido" for r in resultados),
+        "errores": {r.caso: r.error for r in resultados if r.estado == "error"},
+        "borradores": sum(r.borradores for r in resultados),
+        "trabajadores": trabajadores,
+        "segundos": round(segundos, 1),
+        "casos_por_hora": round(len(completos) / segundos * 3600, 1) if segundos else 0.0,
+        "segundos_por_caso": {
+            "p50": round(statistics.median(duraciones), 1),
+            "p95": round(_percentil(duraciones, 0.95), 1),
+            "max": round(max(duraciones), 1),
+        } if duraciones else {},
+        "segundos_por_etapa": {etapa: round(s, 1) for etapa, s in etapas_totales.items()},
+        "tokens": {tipo: metricas.TOKENS.valor(tipo=tipo) for tipo in ("prompt", "completion", "cacheado")},
+    }
+
+
+def procesar_carpeta(carpeta: Path, opciones: Opciones, trabajadores: int = TRABAJADORES,
+                     al_terminar: Callable[[int, int, ResultadoCaso], None] | None = None) -> dict:
+    """Procesa todos los casos de ``carpeta`` con ``trabajadores`` hilos y devuelve el resumen."""
+    opciones.salida.mkdir(parents=True, exist_ok=True)
+    pendientes = casos(carpeta, opciones.salida)
+    resultados: list[ResultadoCaso] = []
+    progreso_lock = threading.Lock()
+    inicio = time.perf_counter()
+
+    def ejecutar(caso: Caso) -> ResultadoCaso:
+        try:
+            return procesar_caso(caso, opciones)
+        except ErrorCaso as exc:
+            logger.warning("%s: %s", caso.nombre, exc)
+            return ResultadoCaso(caso.nombre, "error", error=str(exc))
+        except Exception as exc:
+            logger.exception("Error procesando %s", caso.nombre)
+            return ResultadoCaso(caso.nombre, "error", error=str(exc) or type(exc).__name__)
+
+    with ThreadPoolExecutor(trabajadores, thread_name_prefix="lote") as pool:
+        futuros = [pool.submit(ejecutar, caso) for caso in pendientes]
+        try:
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                resultados.append(resultado)
+                CASOS_LOTE.inc(estado=resultado.estado)
+                with progreso_lock, open(opciones.salida / ARCHIVO_PROGRESO, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({
+                        "fecha": datetime.now().isoformat(),
+                        "caso": resultado.caso,
+                        "estado": resultado.estado,
+                        "segundos": round(resultado.duracion, 2),
+                        "etapas": {k: round(v, 2) for k, v in resultado.etapas.items()},
+                        "error": resultado.error,
+                    }, ensure_ascii=False) + "\n")
+                if al_terminar:
+                    al_terminar(len(resultados), len(pendientes), resultado)
+        except KeyboardInterrupt:
+            # Los casos en curso terminan; lo guardado se retoma al relanzar
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    datos = resumen(resultados, time.perf_counter() - inicio, trabajadores)
+    guardar_registro(opciones.salida / ARCHIVO_RESUMEN, datos)
+    return datos
+
+
+def lista_soluciones(valor: str) -> tuple[int, ...]:
+    numeros = tuple(sorted({int(n) for n in valor.split(",") if n.strip()}))
+    if not numeros or any(n < 1 for n in numeros):
+        raise argparse.ArgumentTypeError("números de solución desde 1, separados por comas")
+    return numeros
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("carpeta", type=Path, help="carpeta con los expedientes (archivos o subcarpetas)")
+    parser.add_argument("--area", required=True, choices=list(asistente.ASSISTANT_IDS))
+    parser.add_argument("--rol", required=True, choices=asistente.ROLES_PROCESALES)
+    parser.add_argument("--salida", type=Path, help="carpeta de resultados (por defecto <carpeta>/resultados)")
+    parser.add_argument("--trabajadores", type=int, default=TRABAJADORES, help="casos procesados a la vez")
+    parser.add_argument("--soluciones", type=lista_soluciones, default=(1,),
+                        help="soluciones que se redactan, p. ej. 1,2,3 (por defecto 1)")
+    parser.add_argument("--reintentos", type=int, default=REINTENTOS, help="reintentos por llamada al asistente")
+    parser.add_argument("--sin-historial", action="store_true", help="no registrar los mensajes en el historial")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if not os.getenv("OPENAI_API_KEY"):
+        sys.exit("Defina la variable de entorno OPENAI_API_KEY.")
+    if not args.carpeta.is_dir():
+        sys.exit(f"No existe la carpeta {args.carpeta}")
+    metricas.iniciar_servidor_desde_entorno()
+
+    historial = None
+    sesion = f"lote-{datetime.now():%Y%m%d-%H%M%S}"
+    if not args.sin_historial:
+        historial = AlmacenHistorial()
+        historial.iniciar_sesion(sesion, "gpt-4")
+    opciones = Opciones(
+        area=args.area,
+        rol=args.rol,
+        salida=args.salida or args.carpeta / "resultados",
+        soluciones=args.soluciones,
+        reintentos=args.reintentos,
+        historial=historial,
+        sesion=sesion,
+    )
+
+    def al_terminar(hechos: int, total: int, resultado: ResultadoCaso) -> None:
+        detalle = f" ({resultado.error})" if resultado.error else f" {resultado.duracion:.1f} s"
+        print(f"[{hechos}/{total}] {resultado.caso}: {resultado.estado}{detalle}", flush=True)
+
+    try:
+        datos = procesar_carpeta(args.carpeta, opciones, max(args.trabajadores, 1), al_terminar)
+    except KeyboardInterrupt:
+        sys.exit("\nInterrumpido: vuelva a lanzar el mismo comando para continuar.")
+
+    print(
+        f"\nCasos: {datos['casos']} · completos {datos['completos']} · omitidos {datos['omitidos']} "
+        f"· errores {len(datos['errores'])} · borradores {datos['borradores']}"
+    )
+    print(
+        f"Tiempo total {datos['segundos']:.0f} s con {datos['trabajadores']} trabajadores "
+        f"· {datos['casos_por_hora']:.1f} casos/hora"
+    )
+    if datos["segundos_por_caso"]:
+        por_caso = datos["segundos_por_caso"]
+        print(f"Por caso: p50 {por_caso['p50']:.1f} s · p95 {por_caso['p95']:.1f} s · máx {por_caso['max']:.1f} s")
+        print("Por etapa (suma): " + " · ".join(f"{e} {s:.0f} s" for e, s in datos["segundos_por_etapa"].items()))
+    print(f"Tokens: {datos['tokens']['prompt']:.0f} de entrada ({datos['tokens']['cacheado']:.0f} desde la caché), "
+          f"{datos['tokens']['completion']:.0f} de salida")
+    print(f"Resultados en {opciones.salida}")
+    if datos["errores"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
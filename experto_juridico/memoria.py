@@ -0,0 +1,290 @@
+"""Gestión de memoria de los textos grandes de cada sesión.
+
+El texto extraído del documento y el borrador generado pueden ocupar cientos de
+KB por sesión y ``st.session_state`` no los libera hasta que el navegador se
+desconecta. ``GestorMemoria`` es su único propietario dentro del proceso:
+
+- mide el tamaño de cada texto y el total por sesión;
+- tras ``inactividad_volcado`` segundos sin actividad, los vuelca comprimidos a
+  disco y los libera de la memoria (se recargan al volver a pedirlos);
+- tras ``inactividad_desalojo`` segundos, considera la sesión abandonada y
+  elimina sus textos de memoria y de disco.
+
+Un hilo de fondo (uno por proceso) ejecuta ``mantenimiento`` periódicamente y
+publica los totales en métricas.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from experto_juridico import metricas
+
+logger = logging.getLogger(__name__)
+
+INACTIVIDAD_VOLCADO = 10 * 60
+INACTIVIDAD_DESALOJO = 4 * 60 * 60
+INTERVALO_MANTENIMIENTO = 60
+NIVEL_COMPRESION = 6
+
+BYTES_SESIONES = metricas.REGISTRO.medidor(
+    "experto_juridico_sesiones_bytes",
+    "Bytes de los textos de sesión según dónde residen (memoria o disco).",
+    ("ubicacion",),
+)
+SESIONES = metricas.REGISTRO.medidor(
+    "experto_juridico_sesiones",
+    "Sesiones con textos gestionados según su estado.",
+    ("estado",),
+)
+EVENTOS_MEMORIA = metricas.REGISTRO.contador(
+    "experto_juridico_memoria_eventos_total",
+    "Volcados a disco, recargas y desalojos de textos de sesión.",
+    ("evento",),
+)
+
+
+def _tamano(texto: str) -> int:
+    """Memoria aproximada de un str (incluye la cabecera del objeto)."""
+    return sys.getsizeof(texto)
+
+
+@dataclass
+class _Sesion:
+    ultimo_acceso: float = field(default_factory=time.monotonic)
+    en_memoria: dict[str, str] = field(default_factory=dict)
+    en_disco: dict[str, int] = field(default_factory=dict)  # clave -> bytes comprimidos
+    version: int = 0
+
+    def bytes_memoria(self) -> int:
+        return sum(_tamano(texto) for texto in self.en_memoria.values())
+
+
+@dataclass(frozen=True)
+class InformeMemoria:
+    sesiones: int
+    sesiones_volcadas: int
+    bytes_memoria: int
+    bytes_disco: int
+    mayores: list[tuple[str, int]]  # (sesión, bytes en memoria) de las sesiones más grandes
+
+
+class GestorMemoria:
+    """Propietario de los textos grandes de todas las sesiones del proceso."""
+
+    def __init__(
+        self,
+        directorio: str | Path,
+        inactividad_volcado: float = INACTIVIDAD_VOLCADO,
+        inactividad_desalojo: float = INACTIVIDAD_DESALOJO,
+    ):
+        # Un subdirectorio por proceso: su índice solo vive en la memoria de ese proceso
+        raiz = Path(directorio)
+        _limpiar_procesos_terminados(raiz)
+        self.directorio = raiz / str(os.getpid())
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.inactividad_volcado = inactividad_volcado
+        self.inactividad_desalojo = inactividad_desalojo
+        self._lock = threading.Lock()
+        self._sesiones: dict[str, _Sesion] = {}
+        self._al_desalojar: list[Callable[[str], None]] = []
+
+    def al_desalojar(self, callback: Callable[[str], None]) -> None:
+        """Registra una función que recibe el id de cada sesión desalojada."""
+        self._al_desalojar.append(callback)
+
+    def _ruta(self, sesion: str, clave: str) -> Path:
+        nombre = re.sub(r"[^\w-]+", "_", sesion)
+        return self.directorio / f"{nombre}.{clave}.zz"
+
+    def tocar(self, sesion: str) -> None:
+        """Registra actividad de la sesión."""
+        with self._lock:
+            self._sesiones.setdefault(sesion, _Sesion()).ultimo_acceso = time.monotonic()
+
+    def version(self, sesion: str) -> int:
+        """Cambia cada vez que se guarda o elimina un texto de la sesión."""
+        with self._lock:
+            datos = self._sesiones.get(sesion)
+            return datos.version if datos else 0
+
+    def guardar(self, sesion: str, clave: str, texto: str) -> None:
+        with self._lock:
+            datos = self._sesiones.setdefault(sesion, _Sesion())
+            datos.ultimo_acceso = time.monotonic()
+            datos.en_memoria[clave] = texto
+            datos.version += 1
+            volcado = datos.en_disco.pop(clave, None)
+        if volcado is not None:
+            self._ruta(sesion, clave).unlink(missing_ok=True)
+
+    def obtener(self, sesion: str, clave: str) -> str | None:
+        """Texto de la sesión; si estaba volcado a disco se recarga en memoria."""
+        with self._lock:
+            datos = self._sesiones.get(sesion)
+            if datos is None:
+                return None
+            datos.ultimo_acceso = time.monotonic()
+            texto = datos.en_memoria.get(clave)
+            if texto is not None or clave not in datos.en_disco:
+                return texto
+            ruta = self._ruta(sesion, clave)
+            try:
+                texto = zlib.decompress(ruta.read_bytes()).decode("utf-8")
+            except FileNotFoundError:
+                datos.en_disco.pop(clave, None)
+                return None
+            datos.en_memoria[clave] = texto
+            del datos.en_disco[clave]
+        ruta.unlink(missing_ok=True)
+        EVENTOS_MEMORIA.inc(evento="recarga")
+        return texto
+
+    def claves(self, sesion: str) -> list[str]:
+        with self._lock:
+            datos = self._sesiones.get(sesion)
+            return [*datos.en_memoria, *datos.en_disco] if datos else []
+
+    def eliminar(self, sesion: str, clave: str) -> None:
+        with self._lock:
+            datos = self._sesiones.get(sesion)
+            if datos is None:
+                return
+            presente = datos.en_memoria.pop(clave, None) is not None
+            volcado = datos.en_disco.pop(clave, None) is not None
+            if presente or volcado:
+                datos.version += 1
+        if volcado:
+            self._ruta(sesion, clave).unlink(missing_ok=True)
+
+    def desalojar(self, sesion: str) -> None:
+        """Elimina todos los textos de la sesión, en memoria y en disco."""
+        with self._lock:
+            datos = self._sesiones.pop(sesion, None)
+        if datos is None:
+            return
+        for clave in datos.en_disco:
+            self._ruta(sesion, clave).unlink(missing_ok=True)
+        for callback in self._al_desalojar:
+            callback(sesion)
+        EVENTOS_MEMORIA.inc(evento="desalojo")
+
+    def _volcar(self, sesion: str, datos: _Sesion) -> None:
+        """Vuelca a disco los textos en memoria de una sesión inactiva."""
+        acceso = datos.ultimo_acceso
+        for clave, texto in list(datos.en_memoria.items()):
+            comprimido = zlib.compress(texto.encode("utf-8"), NIVEL_COMPRESION)
+            ruta = self._ruta(sesion, clave)
+            temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+            temporal.write_bytes(comprimido)
+            os.replace(temporal, ruta)
+            with self._lock:
+                # Si la sesión volvió a usar o cambió el texto mientras tanto, se conserva
+                if (
+                    datos.ultimo_acceso == acceso
+                    and datos.en_memoria.get(clave) is texto
+                    and self._sesiones.get(sesion) is datos
+                ):
+                    del datos.en_memoria[clave]
+                    datos.en_disco[clave] = len(comprimido)
+                    EVENTOS_MEMORIA.inc(evento="volcado")
+                    continue
+            ruta.unlink(missing_ok=True)
+
+    def mantenimiento(self, ahora: float | None = None) -> InformeMemoria:
+        """Vuelca las sesiones inactivas, desaloja las abandonadas y publica el informe."""
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            candidatas = list(self._sesiones.items())
+        for sesion, datos in candidatas:
+            inactividad = ahora - datos.ultimo_acceso
+            if inactividad >= self.inactividad_desalojo:
+                self.desalojar(sesion)
+            elif inactividad >= self.inactividad_volcado and datos.en_memoria:
+                try:
+                    self._volcar(sesion, datos)
+                except OSError:
+                    logger.exception("No se pudieron volcar a disco los textos de la sesión %s", sesion)
+        return self.informe()
+
+    def informe(self, mayores: int = 5) -> InformeMemoria:
+        """Totales de memoria y disco; también actualiza las métricas."""
+        with self._lock:
+            tamanos = {sesion: datos.bytes_memoria() for sesion, datos in self._sesiones.items()}
+            bytes_disco = sum(sum(d.en_disco.values()) for d in self._sesiones.values())
+            volcadas = sum(1 for d in self._sesiones.values() if d.en_disco and not d.en_memoria)
+        informe = InformeMemoria(
+            sesiones=len(tamanos),
+            sesiones_volcadas=volcadas,
+            bytes_memoria=sum(tamanos.values()),
+            bytes_disco=bytes_disco,
+            mayores=sorted(tamanos.items(), key=lambda item: item[1], reverse=True)[:mayores],
+        )
+        BYTES_SESIONES.set(informe.bytes_memoria, ubicacion="memoria")
+        BYTES_SESIONES.set(informe.bytes_disco, ubicacion="disco")
+        SESIONES.set(informe.sesiones - informe.sesiones_volcadas, estado="en_memoria")
+        SESIONES.set(informe.sesiones_volcadas, estado="volcada")
+        return informe
+
+
+def _limpiar_procesos_terminados(raiz: Path) -> None:
+    """Borra los volcados de procesos que ya no existen (tras un reinicio)."""
+    if not raiz.is_dir():
+        return
+    for directorio in raiz.iterdir():
+        if not directorio.is_dir() or not directorio.name.isdigit():
+            continue
+        try:
+            os.kill(int(directorio.name), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except OSError:
+            continue  # existe pero pertenece a otro usuario
+        for archivo in directorio.iterdir():
+            archivo.unlink(missing_ok=True)
+        directorio.rmdir()
+
+
+###############################################################################
+# Gestor del proceso
+###############################################################################
+
+_gestor: GestorMemoria | None = None
+_gestor_lock = threading.Lock()
+
+
+def gestor() -> GestorMemoria:
+    """Gestor único del proceso, configurado por entorno; arranca su hilo de mantenimiento.
+
+    ``EJ_MEMORIA_DIR`` (directorio de volcado), ``EJ_MEMORIA_VOLCADO`` y
+    ``EJ_MEMORIA_DESALOJO`` (segundos de inactividad).
+    """
+    global _gestor
+    with _gestor_lock:
+        if _gestor is None:
+            _gestor = GestorMemoria(
+                os.getenv("EJ_MEMORIA_DIR", Path(tempfile.gettempdir()) / "experto_juridico_sesiones"),
+                float(os.getenv("EJ_MEMORIA_VOLCADO", INACTIVIDAD_VOLCADO)),
+                float(os.getenv("EJ_MEMORIA_DESALOJO", INACTIVIDAD_DESALOJO)),
+            )
+            threading.Thread(target=_mantener, args=(_gestor,), name="gestor-memoria", daemon=True).start()
+        return _gestor
+
+
+def _mantener(gestor_: GestorMemoria) -> None:
+    while True:
+        time.sleep(INTERVALO_MANTENIMIENTO)
+        try:
+            gestor_.mantenimiento()
+        except Exception:
+            logger.exception("Error en el mantenimiento de memoria de sesiones")
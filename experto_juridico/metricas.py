@@ -0,0 +1,302 @@
+"""Métricas de latencia y contadores expuestos en formato de texto Prometheus.
+
+El registro vive a nivel de proceso: Streamlit vuelve a ejecutar el script en
+cada interacción, pero los módulos importados se conservan, por lo que los
+histogramas acumulan todas las sesiones atendidas por el proceso.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Límites (en segundos) pensados para cubrir desde el render de una página
+# hasta un run completo del asistente.
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _formatear_etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_numero(valor: float) -> str:
+    if valor == int(valor):
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series: dict = {}
+
+    def _clave(self, etiquetas: dict) -> tuple:
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for clave, valor in series:
+            lineas.extend(self._lineas_serie(clave, valor))
+        return lineas
+
+    def _lineas_serie(self, clave: tuple, valor) -> list[str]:
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}"]
+
+
+class Contador(_Metrica):
+    """Contador monótono con etiquetas."""
+
+    tipo = "counter"
+
+    def inc(self, cantidad: float = 1, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + cantidad
+
+    def valor(self, **etiquetas) -> float:
+        with self._lock:
+            return self._series.get(self._clave(etiquetas), 0)
+
+
+class Medidor(_Metrica):
+    """Valor instantáneo (gauge) con etiquetas."""
+
+    tipo = "gauge"
+
+    def set(self, valor: float, **etiquetas) -> None:
+        with self._lock:
+            self._series[self._clave(etiquetas)] = valor
+
+    def valor(self, **etiquetas) -> float:
+        with self._lock:
+            return self._series.get(self._clave(etiquetas), 0)
+
+
+class Histograma(_Metrica):
+    """Histograma acumulativo con buckets fijos."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def resumen(self, **etiquetas) -> tuple[float, int]:
+        """Devuelve (suma, cantidad) de las observaciones de una serie."""
+        with self._lock:
+            serie = self._series.get(self._clave(etiquetas))
+            return (serie[1], serie[2]) if serie else (0.0, 0)
+
+    def _lineas_serie(self, clave: tuple, valor) -> list[str]:
+        conteos, suma, total = valor
+        lineas = []
+        for limite, conteo in zip(self.buckets, conteos):
+            le = _formatear_etiquetas(self.etiquetas, clave, f'le="{_formatear_numero(limite)}"')
+            lineas.append(f"{self.nombre}_bucket{le} {conteo}")
+        inf = _formatear_etiquetas(self.etiquetas, clave, 'le="+Inf"')
+        lineas.append(f"{self.nombre}_bucket{inf} {total}")
+        base = _formatear_etiquetas(self.etiquetas, clave)
+        lineas.append(f"{self.nombre}_sum{base} {_formatear_numero(suma)}")
+        lineas.append(f"{self.nombre}_count{base} {total}")
+        return lineas
+
+
+class Registro:
+    """Colección de métricas con nombre único."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas: dict[str, _Metrica] = {}
+
+    def _registrar(self, metrica: _Metrica) -> _Metrica:
+        with self._lock:
+            existente = self._metricas.get(metrica.nombre)
+            if existente is not None:
+                return existente
+            self._metricas[metrica.nombre] = metrica
+            return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Medidor:
+        return self._registrar(Medidor(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA) -> Histograma:
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def exponer(self) -> str:
+        """Serializa todas las métricas en formato de texto Prometheus 0.0.4."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+DURACION_ETAPA = REGISTRO.histograma(
+    "experto_juridico_etapa_duracion_segundos",
+    "Duración de cada etapa instrumentada (extracción, fases del asistente, DOCX...).",
+    ("etapa",),
+)
+DURACION_RERUN = REGISTRO.histograma(
+    "experto_juridico_rerun_duracion_segundos",
+    "Duración de cada ejecución completa del script de Streamlit.",
+    ("pagina",),
+)
+DURACION_FRAGMENTO = REGISTRO.histograma(
+    "experto_juridico_fragmento_duracion_segundos",
+    "Duración de cada ejecución de un fragmento (st.fragment), aislada o dentro de un rerun completo.",
+    ("fragmento",),
+)
+RUNS = REGISTRO.contador(
+    "experto_juridico_runs_total",
+    "Runs del asistente de OpenAI según su estado final.",
+    ("estado",),
+)
+CACHE = REGISTRO.contador(
+    "experto_juridico_cache_total",
+    "Consultas a cachés de la aplicación según resultado (hit/miss).",
+    ("cache", "resultado"),
+)
+TOKENS = REGISTRO.contador(
+    "experto_juridico_tokens_total",
+    "Tokens consumidos por los runs completados, por tipo (cacheado: entrada servida desde la caché de prompts).",
+    ("tipo",),
+)
+ERRORES = REGISTRO.contador(
+    "experto_juridico_errores_total",
+    "Excepciones ocurridas dentro de una etapa instrumentada.",
+    ("etapa",),
+)
+
+
+@contextmanager
+def medir(etapa: str, histograma: Histograma = DURACION_ETAPA, inicio: float | None = None, **etiquetas):
+    """Mide la duración del bloque y la registra en el histograma indicado.
+
+    Si se pasa ``inicio`` (valor de ``time.perf_counter()``), el intervalo se
+    cuenta desde ese instante en lugar de desde la entrada al bloque.
+    """
+    if histograma is DURACION_ETAPA:
+        etiquetas.setdefault("etapa", etapa)
+    t0 = time.perf_counter() if inicio is None else inicio
+    try:
+        yield
+    except Exception:
+        # st.rerun()/st.stop() lanzan excepciones derivadas de BaseException:
+        # no llegan aquí y no cuentan como errores
+        ERRORES.inc(etapa=etapa)
+        raise
+    finally:
+        histograma.observar(time.perf_counter() - t0, **etiquetas)
+
+
+def registrar_uso(usage) -> None:
+    """Suma los tokens de un objeto ``usage`` de OpenAI (si existe).
+
+    Los tokens de entrada servidos desde la caché de prompts del proveedor se
+    cuentan además como ``cacheado`` (están incluidos en ``prompt``).
+    """
+    if usage is None:
+        return
+    for tipo in ("prompt_tokens", "completion_tokens"):
+        cantidad = getattr(usage, tipo, None)
+        if cantidad:
+            TOKENS.inc(cantidad, tipo=tipo.split("_")[0])
+    detalles = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(detalles, dict):  # respuestas JSON de la Batch API
+        cacheados = detalles.get("cached_tokens")
+    else:
+        cacheados = getattr(detalles, "cached_tokens", None)
+    if cacheados:
+        TOKENS.inc(cacheados, tipo="cacheado")
+
+
+###############################################################################
+# Endpoint HTTP local
+###############################################################################
+
+_servidor: ThreadingHTTPServer | None = None
+_servidor_lock = threading.Lock()
+
+
+def _manejador_metricas():
+    """Clase del manejador HTTP; ``http.server`` solo se importa si se arranca el endpoint."""
+    from http.server import BaseHTTPRequestHandler
+
+    class ManejadorMetricas(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            cuerpo = REGISTRO.exponer().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, format, *args):  # noqa: A002 - firma de BaseHTTPRequestHandler
+            pass
+
+    return ManejadorMetricas
+
+
+def iniciar_servidor(puerto: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Arranca (una sola vez por proceso) el endpoint ``/metrics`` en un hilo."""
+    from http.server import ThreadingHTTPServer
+
+    global _servidor
+    with _servidor_lock:
+        if _servidor is None:
+            _servidor = ThreadingHTTPServer((host, puerto), _manejador_metricas())
+            hilo = threading.Thread(target=_servidor.serve_forever, name="metricas-http", daemon=True)
+            hilo.start()
+        return _servidor
+
+
+def iniciar_servidor_desde_entorno() -> ThreadingHTTPServer | None:
+    """Arranca el endpoint si ``EJ_METRICAS_PUERTO`` está definido."""
+    puerto = os.getenv("EJ_METRICAS_PUERTO")
+    if not puerto:
+        return None
+    try:
+        return iniciar_servidor(int(puerto), os.getenv("EJ_METRICAS_HOST", "127.0.0.1"))
+    except OSError:
+        # Otro proceso (o una recarga del script) ya ocupa el puerto.
+        return None
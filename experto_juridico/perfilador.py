@@ -0,0 +1,146 @@
+"""Perfilado opcional de cada rerun de Streamlit.
+
+Dos modos, elegidos con ``EJ_PERFIL``:
+
+- ``1`` / ``muestreo``: un hilo toma muestras de la pila del hilo del script
+  cada ``EJ_PERFIL_INTERVALO`` segundos y escribe un archivo ``.collapsed``
+  (formato "pila;colapsada N") listo para ``flamegraph.pl`` o speedscope.
+- ``cprofile``: envuelve el rerun en ``cProfile`` y escribe un ``.pstats``.
+
+Los archivos se guardan en ``EJ_PERFIL_DIR`` (por defecto ``perfiles/``), uno
+por rerun, nombrados según la página y el paso del asistente; un fragmento
+que se re-ejecuta solo (``st.fragment``) tiene su propio archivo.
+"""
+from __future__ import annotations
+
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+MODOS = {"1": "muestreo", "muestreo": "muestreo", "cprofile": "cprofile"}
+INTERVALO_POR_DEFECTO = 0.002
+
+# Perfil en curso en cada hilo: un fragmento dentro del rerun completo no abre otro
+_activo = threading.local()
+
+
+def _nombre_marco(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).stem}:{code.co_name}:{code.co_firstlineno}"
+
+
+class PerfiladorMuestreo:
+    """Muestreador de pilas de un hilo concreto (por defecto, el que lo inicia)."""
+
+    def __init__(self, intervalo: float = INTERVALO_POR_DEFECTO):
+        self.intervalo = intervalo
+        self.pilas: Counter[str] = Counter()
+        self._objetivo: int | None = None
+        self._detener = threading.Event()
+        self._hilo: threading.Thread | None = None
+
+    def iniciar(self) -> None:
+        self._objetivo = threading.get_ident()
+        self._hilo = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> Counter[str]:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+        return self.pilas
+
+    def _muestrear(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            frame = sys._current_frames().get(self._objetivo)
+            if frame is None:
+                continue
+            pila = []
+            while frame is not None:
+                pila.append(_nombre_marco(frame))
+                frame = frame.f_back
+            self.pilas[";".join(reversed(pila))] += 1
+
+
+def escribir_colapsado(pilas: Counter[str], ruta: Path) -> None:
+    """Escribe las pilas en formato colapsado (una pila por línea)."""
+    with open(ruta, "w", encoding="utf-8") as f:
+        for pila, cantidad in pilas.most_common():
+            f.write(f"{pila} {cantidad}\n")
+
+
+def etiqueta(pagina: str, paso: int | None = None) -> str:
+    """Nombre de archivo seguro para una página (y paso, si aplica)."""
+    nombre = pagina if paso is None else f"{pagina}_paso{paso}"
+    return re.sub(r"[^\w-]+", "_", nombre)
+
+
+class PerfilRerun:
+    """Perfil de un único rerun; se crea al inicio del script y se cierra al final."""
+
+    def __init__(self, modo: str, directorio: Path, intervalo: float = INTERVALO_POR_DEFECTO):
+        self.modo = modo
+        self.directorio = directorio
+        self.inicio = time.perf_counter()
+        self._cprofile: cProfile.Profile | None = None
+        self._muestreo: PerfiladorMuestreo | None = None
+        if modo == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._muestreo = PerfiladorMuestreo(intervalo)
+            self._muestreo.iniciar()
+
+    def finalizar(self, nombre: str) -> Path:
+        """Detiene el perfilado y escribe el archivo; devuelve su ruta."""
+        duracion_ms = (time.perf_counter() - self.inicio) * 1000
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        base = f"{nombre}_{datetime.now():%Y%m%d_%H%M%S_%f}_{os.getpid()}_{duracion_ms:.0f}ms"
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            ruta = self.directorio / f"{base}.pstats"
+            self._cprofile.dump_stats(ruta)
+        else:
+            ruta = self.directorio / f"{base}.collapsed"
+            escribir_colapsado(self._muestreo.detener(), ruta)
+        return ruta
+
+
+def iniciar_si_activo(solicitado: bool = False) -> PerfilRerun | None:
+    """Inicia el perfil del rerun si ``EJ_PERFIL`` lo pide o si ``solicitado``.
+
+    ``solicitado`` permite activarlo puntualmente (p. ej. ``?perfil=1`` para
+    administradores) aunque la variable de entorno no esté definida.
+    """
+    modo = MODOS.get(os.getenv("EJ_PERFIL", "").strip().lower())
+    if modo is None and not solicitado:
+        return None
+    directorio = Path(os.getenv("EJ_PERFIL_DIR", "perfiles"))
+    intervalo = float(os.getenv("EJ_PERFIL_INTERVALO", INTERVALO_POR_DEFECTO))
+    return PerfilRerun(modo or "muestreo", directorio, intervalo)
+
+
+@contextmanager
+def perfilar(nombre: str, solicitado: bool = False) -> Iterator[PerfilRerun | None]:
+    """Perfila el bloque si está activo y lo escribe como ``nombre`` al salir, aunque falle.
+
+    Dentro de otro perfil del mismo hilo no hace nada: el bloque ya se mide en él.
+    """
+    perfil = None if getattr(_activo, "perfil", None) is not None else iniciar_si_activo(solicitado)
+    if perfil is None:
+        yield None
+        return
+    _activo.perfil = perfil
+    try:
+        yield perfil
+    finally:
+        _activo.perfil = None
+        perfil.finalizar(nombre)
@@ -0,0 +1,833 @@
+"""Hoja de estilos de la aplicación compilada una vez por proceso.
+
+Las reglas que antes se reconstruían como f-strings y se reenviaban en cada
+rerun (más los bloques ``<style>`` sueltos de Feedback y los pasos 4/5) se
+definen aquí como fuentes. ``construir_tema`` las combina, fusiona las reglas
+repetidas cuando hacerlo no altera la cascada (la última definición de cada
+propiedad gana, respetando ``!important``) y las minifica en un único bundle.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from experto_juridico import metricas
+
+
+def _hojas_de_estilo(c: dict) -> list[str]:
+    """Fuentes CSS, en el mismo orden de cascada en que se emitían antes."""
+    globales = f"""
+        /* Tipografía y colores base */
+        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
+
+        :root {{
+            --primary-color: {c["primary"]};
+            --secondary-color: {c["secondary"]};
+            --neutral-color: {c["neutral"]};
+            --background-color: {c["background"]};
+            --text-color: {c["text"]};
+            --light-primary: {c["light_primary"]};
+        }}
+
+        .stApp {{
+            font-family: 'Inter', sans-serif;
+            background-color: var(--background-color);
+        }}
+
+        /* Ocultar elementos no deseados */
+        #MainMenu {{display: none;}}
+        footer {{display: none;}}
+
+        /* Contenedor principal más compacto */
+        .main .block-container {{
+            max-width: 75%;  /* Reducido al 75% del ancho */
+            padding: 2rem 3rem;
+            margin: 0 auto;
+            background-color: white;
+            border-radius: 12px;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.05);
+        }}
+
+        /* Franja descriptiva */
+        .descriptive-band {{
+            background-color: var(--light-primary);
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 1rem 0;
+            text-align: center;
+            color: var(--primary-color);
+        }}
+
+        /* Info box */
+        .info-box {{
+            background-color: rgba(45, 93, 160, 0.05);
+            border-left: 3px solid var(--primary-color);
+            padding: 1rem;
+            margin: 1rem 0;
+            border-radius: 0 8px 8px 0;
+        }}
+
+        /* Contacto */
+        .contact-info {{
+            background-color: white;
+            padding: 1.5rem;
+            border-radius: 8px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+            margin: 1rem 0;
+        }}
+
+        .contact-info h4 {{
+            color: var(--primary-color);
+            margin-bottom: 1rem;
+        }}
+
+        .contact-detail {{
+            display: flex;
+            align-items: center;
+            gap: 0.5rem;
+            margin: 0.5rem 0;
+            color: var(--text-color);
+        }}
+
+        /* Navegación superior */
+        .stNavigationContainer {{
+            background-color: white;
+            position: fixed;
+            top: 0;
+            left: 0;
+            right: 0;
+            z-index: 100;
+            padding: 1rem;
+            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+        }}
+
+        /* Botones */
+        .stButton > button {{
+            width: 100%;
+            border-radius: 8px;
+            font-weight: 500;
+            transition: all 0.2s;
+        }}
+
+        .stButton > button:first-child {{
+            background-color: var(--primary-color);
+            color: white;
+        }}
+
+        .stButton > button:not(:first-child) {{
+            background-color: var(--neutral-color);
+            color: white;
+        }}
+
+        /* Radio buttons en línea */
+        .stRadio > div {{
+            display: flex;
+            gap: 1rem;
+            flex-wrap: wrap;
+        }}
+
+        .stRadio label {{
+            display: flex;
+            align-items: center;
+            gap: 0.5rem;
+        }}
+
+        /* Paneles desplegables */
+        .streamlit-expanderHeader {{
+            background-color: white;
+            border-radius: 8px;
+            padding: 1rem;
+            margin-bottom: 1rem;
+        }}
+
+        /* Modo oscuro */
+        @media (prefers-color-scheme: dark) {{
+            :root {{
+                --background-color: #1A202C;
+                --text-color: #F8FAFC;
+            }}
+
+            .stApp {{
+                background-color: var(--background-color);
+                color: var(--text-color);
+            }}
+        }}
+
+        /* Accesibilidad */
+        *:focus {{
+            outline: 3px solid var(--primary-color);
+            outline-offset: 2px;
+        }}
+
+        /* Spinner personalizado */
+        .stSpinner {{
+            border-color: var(--primary-color);
+        }}
+
+        /* Navegación superior mejorada */
+        .nav-container {{
+            display: grid;
+            grid-template-columns: repeat(6, 1fr);
+            gap: 0.5rem;
+            padding: 1rem;
+            background-color: white;
+            position: fixed;
+            top: 0;
+            left: 0;
+            right: 0;
+            z-index: 100;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            max-width: 1200px;
+            margin: 0 auto;
+        }}
+
+        /* Botones de navegación */
+        .stButton {{
+            width: 100%;
+        }}
+
+        .stButton > button {{
+            width: 100% !important;
+            min-width: 0 !important;
+            padding: 0.75rem 0.5rem !important;
+            background-color: var(--primary-color) !important;
+            border: none !important;
+            color: {c["button_text"]} !important;
+            font-size: 0.875rem !important;
+            font-weight: 500 !important;
+            line-height: 1.2 !important;
+            border-radius: 8px !important;
+            transition: all 0.2s ease !important;
+            height: auto !important;
+            white-space: nowrap !important;
+            overflow: hidden !important;
+            text-overflow: ellipsis !important;
+            display: flex !important;
+            align-items: center !important;
+            justify-content: center !important;
+            gap: 0.25rem !important;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1) !important;
+        }}
+
+        .stButton > button:hover {{
+            background-color: {c["primary"]}DD !important;
+            color: {c["button_text_hover"]} !important;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.15) !important;
+            transform: translateY(-1px) !important;
+        }}
+
+        .stButton > button:active {{
+            transform: translateY(1px) !important;
+            box-shadow: inset 0 2px 4px rgba(0,0,0,0.1) !important;
+        }}
+
+        /* Contenedor principal ajustado para la navegación */
+        .main .block-container {{
+            padding-top: 5rem !important;  /* Espacio para la navegación fija */
+        }}
+
+        /* Media queries para responsividad */
+        @media (max-width: 768px) {{
+            .nav-container {{
+                grid-template-columns: repeat(3, 1fr);
+                padding: 0.75rem;
+            }}
+
+            .stButton > button {{
+                padding: 0.5rem 0.25rem !important;
+                font-size: 0.75rem !important;
+            }}
+        }}
+
+        /* Sistema de estrellas */
+        .rating {{
+            display: inline-flex;
+            gap: 0.25rem;
+            padding: 0.5rem;
+            border-radius: 8px;
+        }}
+
+        .star {{
+            font-size: 2rem;
+            cursor: pointer;
+            color: #ddd;
+            transition: color 0.2s ease;
+        }}
+
+        .star.filled {{
+            color: {c["secondary"]};
+        }}
+
+        .star:hover,
+        .star:focus {{
+            color: {c["secondary"]};
+            outline: none;
+        }}
+
+        /* Pie de página personalizado */
+        .custom-footer {{
+            position: fixed;
+            bottom: 0;
+            left: 0;
+            right: 0;
+            background-color: {c["footer"]};
+            color: white;
+            padding: 1rem;
+            text-align: center;
+            font-size: 0.9rem;
+            z-index: 100;
+        }}
+
+        .custom-footer a {{
+            color: white;
+            text-decoration: none;
+        }}
+
+        /* Ajuste para el contenido principal */
+        .main .block-container {{
+            margin-bottom: 4rem;  /* Espacio para el footer */
+        }}
+
+        /* Contador de estrellas */
+        .rating-count {{
+            margin-left: 1rem;
+            font-size: 1.1rem;
+            color: var(--text-color);
+            display: inline-flex;
+            align-items: center;
+            padding: 0.25rem 0.75rem;
+            background-color: var(--light-primary);
+            border-radius: 1rem;
+        }}
+
+        /* Navegación superior mejorada */
+        .nav-container {{
+            display: flex;
+            gap: 0.5rem;
+            padding: 1rem;
+            background-color: white;
+            position: fixed;
+            top: 0;
+            left: 0;
+            right: 0;
+            z-index: 100;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }}
+
+        .nav-button {{
+            flex: 1;
+            background-color: var(--primary-color);
+            color: {c["button_text"]} !important;
+            padding: 0.75rem 1rem;
+            border-radius: 8px;
+            border: none;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            transition: all 0.2s ease;
+            font-weight: 500;
+            text-align: center;
+            cursor: pointer;
+            text-decoration: none;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            min-width: 120px;
+            font-size: 0.95rem;
+            letter-spacing: 0.02em;
+        }}
+
+        .nav-button:hover,
+        .nav-button:focus,
+        .nav-button:active {{
+            background-color: {c["primary"]}DD;
+            color: {c["button_text_hover"]} !important;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.15);
+            transform: translateY(-1px);
+            text-decoration: none;
+        }}
+
+        /* Asegurar que los emojis en los botones tengan buen contraste */
+        .nav-button span {{
+            filter: brightness(1.1);
+            margin-right: 0.5rem;
+        }}
+
+        /* Estilo para botón activo */
+        .nav-button.active {{
+            background-color: {c["primary"]};
+            color: {c["button_text_hover"]} !important;
+            box-shadow: inset 0 2px 4px rgba(0,0,0,0.1);
+            transform: translateY(1px);
+        }}
+
+        /* Contenedor de imagen corporativa */
+        .corporate-image-container {{
+            width: 100%;
+            margin: 1rem 0;
+            border-radius: 12px;
+            overflow: hidden;
+            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
+        }}
+
+        .corporate-image-container img {{
+            width: 100%;
+            height: auto;
+            object-fit: cover;
+            display: block;
+        }}
+
+        [data-testid="stImage"] img {{
+            border-radius: 12px;
+            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
+        }}
+
+        /* Botón de historial */
+        .history-button {{
+            display: block;
+            width: fit-content;
+            margin: 2rem auto;
+            padding: 1rem 2rem;
+            background-color: white;
+            color: var(--primary-color);
+            border: 2px solid var(--primary-color);
+            border-radius: 8px;
+            font-weight: 500;
+            transition: all 0.2s ease;
+            cursor: pointer;
+            text-align: center;
+        }}
+
+        .history-button:hover {{
+            background-color: var(--primary-color);
+            color: white;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+        }}
+
+        /* Media queries para responsividad */
+        @media (max-width: 768px) {{
+            .nav-container {{
+                flex-wrap: wrap;
+            }}
+
+            .nav-button {{
+                min-width: calc(33.33% - 0.5rem);
+            }}
+        }}
+
+        /* Sistema de valoración por estrellas */
+        .rating-container {{
+            display: flex;
+            align-items: center;
+            gap: 2rem;
+            padding: 1.5rem;
+            background-color: white;
+            border-radius: 12px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+        }}
+
+        .stars-container {{
+            display: flex;
+            gap: 0.75rem;
+        }}
+
+        .star-rating {{
+            display: inline-flex;
+            gap: 0.75rem;
+        }}
+
+        .star-btn {{
+            background: none;
+            border: none;
+            cursor: pointer;
+            font-size: 2.5rem;
+            padding: 0.25rem;
+            transition: all 0.3s ease;
+            color: {c["star_inactive"]};
+            position: relative;
+            outline: none;
+        }}
+
+        .star-btn:hover ~ .star-btn {{
+            color: {c["star_inactive"]};
+        }}
+
+        .star-rating:hover .star-btn {{
+            color: {c["star_hover"]};
+        }}
+
+        .star-rating .star-btn:hover ~ .star-btn {{
+            color: {c["star_inactive"]};
+        }}
+
+        .star-btn.active {{
+            color: {c["star_active"]};
+            transform: scale(1.1);
+        }}
+
+        .star-btn.active ~ .star-btn {{
+            color: {c["star_inactive"]};
+        }}
+
+        .rating-value {{
+            font-size: 1.1rem;
+            font-weight: 500;
+            color: {c["text"]};
+            background-color: {c["light_primary"]};
+            padding: 0.75rem 1.25rem;
+            border-radius: 2rem;
+            min-width: 120px;
+            text-align: center;
+        }}
+        """
+
+    # Valoración y radio buttons
+    valoracion = """
+        /* Estilos para el contenedor de valoración */
+        .rating-container {
+            display: flex;
+            align-items: center;
+            gap: 2rem;
+            padding: 1.5rem;
+            background-color: white;
+            border-radius: 12px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
+        }
+
+        /* Estilos para los radio buttons */
+        .stRadio > div {
+            flex-direction: row !important;
+            gap: 1rem !important;
+        }
+
+        .stRadio label {
+            cursor: pointer !important;
+            font-size: 1.5rem !important;
+            padding: 0.5rem !important;
+            border-radius: 8px !important;
+            transition: all 0.2s ease !important;
+        }
+
+        .stRadio label:hover {
+            background-color: rgba(45, 93, 160, 0.1) !important;
+        }
+
+        /* Ocultar el radio button original */
+        .stRadio input[type="radio"] {
+            position: absolute !important;
+            opacity: 0 !important;
+        }
+
+        /* Estilo para la opción seleccionada */
+        .stRadio input[type="radio"]:checked + label {
+            color: #F59E0B !important;
+            transform: scale(1.1) !important;
+        }
+        """
+
+    # Formulario de feedback
+    feedback = """
+        .rating-container {
+            background-color: white;
+            padding: 1.5rem;
+            border-radius: 8px;
+            text-align: center;
+            margin: 1rem 0;
+        }
+
+        .stars {
+            display: inline-flex;
+            gap: 0.75rem;
+            margin: 1rem 0;
+        }
+
+        .star {
+            font-size: 3rem;
+            cursor: pointer;
+            color: #DDD;
+            transition: color 0.2s ease;
+        }
+
+        .star.active {
+            color: #FFD700;
+        }
+
+        .rating-value {
+            font-size: 1.2rem;
+            color: #666;
+            margin-top: 1rem;
+        }
+        """
+
+    # Contenedores de los pasos 4 y 5
+    pasos = """
+        .option-container {
+            background-color: white;
+            padding: 1rem;
+            border-radius: 8px;
+            margin: 1rem 0;
+            border: 1px solid #E2E8F0;
+        }
+
+        .document-container {
+            background-color: white;
+            padding: 2rem;
+            border-radius: 8px;
+            border: 1px solid #E2E8F0;
+            margin: 1rem 0;
+        }
+        """
+
+    return [globales, valoracion, feedback, pasos]
+
+
+###############################################################################
+# Compilación: análisis, fusión de reglas repetidas y minificación
+###############################################################################
+
+_COMENTARIO = re.compile(r"/\*.*?\*/", re.S)
+
+
+@dataclass
+class _Regla:
+    selector: str
+    declaraciones: dict  # propiedad -> (valor, importante)
+
+
+@dataclass
+class _Bloque:
+    preludio: str  # p. ej. "@media (max-width:768px)"
+    reglas: list
+
+
+def _normalizar_selector(selector: str) -> str:
+    partes = [re.sub(r"\s+", " ", p.strip()) for p in selector.split(",")]
+    partes = [re.sub(r"\s*([>~])\s*", r"\1", p) for p in partes]
+    return ",".join(partes)
+
+
+def _normalizar_valor(valor: str) -> str:
+    valor = re.sub(r"\s+", " ", valor.strip())
+    return re.sub(r"\s*,\s*", ",", valor)
+
+
+def _parsear_declaraciones(texto: str) -> dict:
+    declaraciones: dict = {}
+    for decl in texto.split(";"):
+        if ":" not in decl:
+            continue
+        prop, valor = decl.split(":", 1)
+        valor = valor.strip()
+        importante = valor.lower().endswith("!important")
+        if importante:
+            valor = valor[: -len("!important")]
+        _fusionar_declaracion(declaraciones, prop.strip().lower(), _normalizar_valor(valor), importante)
+    return declaraciones
+
+
+def _fusionar_declaracion(declaraciones: dict, prop: str, valor: str, importante: bool) -> None:
+    # Una declaración posterior gana salvo que la anterior sea !important y ella no
+    previa = declaraciones.pop(prop, None)
+    if previa is not None and previa[1] and not importante:
+        declaraciones[prop] = previa
+    else:
+        declaraciones[prop] = (valor, importante)
+
+
+def _fin_de_sentencia(texto: str, i: int) -> int:
+    """Posición del ';' que cierra una sentencia, ignorando los de cadenas y url()."""
+    comilla, parentesis = None, 0
+    for j in range(i, len(texto)):
+        ch = texto[j]
+        if comilla:
+            if ch == comilla:
+                comilla = None
+        elif ch in "'\"":
+            comilla = ch
+        elif ch == "(":
+            parentesis += 1
+        elif ch == ")":
+            parentesis -= 1
+        elif ch == ";" and parentesis == 0:
+            return j
+    raise ValueError("Sentencia CSS sin ';' final")
+
+
+def _parsear(texto: str) -> tuple[list[str], list]:
+    """Devuelve (sentencias @import, elementos) con elementos _Regla o _Bloque."""
+    texto = _COMENTARIO.sub("", texto)
+    sentencias: list[str] = []
+    elementos: list = []
+    i = 0
+    while i < len(texto):
+        if texto[i].isspace():
+            i += 1
+            continue
+        if texto.startswith("@import", i):
+            fin = _fin_de_sentencia(texto, i)
+            sentencias.append(re.sub(r"\s+", " ", texto[i:fin + 1].strip()))
+            i = fin + 1
+            continue
+        apertura = texto.index("{", i)
+        cabecera = texto[i:apertura].strip()
+        # Buscar la llave de cierre correspondiente
+        profundidad, j = 1, apertura + 1
+        while profundidad:
+            profundidad += {"{": 1, "}": -1}.get(texto[j], 0)
+            j += 1
+        cuerpo = texto[apertura + 1:j - 1]
+        if cabecera.startswith("@"):
+            _, internos = _parsear(cuerpo)
+            elementos.append(_Bloque(re.sub(r"\s+", " ", cabecera), internos))
+        else:
+            elementos.append(_Regla(_normalizar_selector(cabecera), _parsear_declaraciones(cuerpo)))
+        i = j
+    return sentencias, elementos
+
+
+# Abreviaturas que fijan propiedades largas con otro prefijo (border fija
+# border-top-color, etc. se detectan por el prefijo)
+_ABREVIATURAS = {
+    "font": {"line-height"},
+    "inset": {"top", "right", "bottom", "left"},
+    "gap": {"row-gap", "column-gap"},
+    "grid-gap": {"grid-row-gap", "grid-column-gap"},
+    "flex-flow": {"flex-direction", "flex-wrap"},
+    "place-content": {"align-content", "justify-content"},
+    "place-items": {"align-items", "justify-items"},
+    "place-self": {"align-self", "justify-self"},
+}
+
+
+def _propiedades(elemento) -> set[str]:
+    if isinstance(elemento, _Bloque):
+        return set().union(*(_propiedades(regla) for regla in elemento.reglas))
+    return set(elemento.declaraciones)
+
+
+def _se_pisan(a: str, b: str) -> bool:
+    """Indica si dos propiedades pueden fijar el mismo valor (iguales, o abreviatura y larga)."""
+    if a == b or a.startswith(b + "-") or b.startswith(a + "-"):
+        return True
+    return b in _ABREVIATURAS.get(a, ()) or a in _ABREVIATURAS.get(b, ())
+
+
+def _fusionar(elementos: list) -> tuple[list, int]:
+    """Fusiona reglas con el mismo selector (y bloques con el mismo preludio).
+
+    Cada regla repetida se fusiona en la aparición anterior, que conserva su
+    posición, solo si ninguna regla intermedia fija alguna de sus propiedades
+    (con cualquier selector: no se sabe a qué elementos se aplica cada uno).
+    Adelantarla no cambia entonces qué declaración gana en la cascada; si
+    alguna la fija, la regla se queda donde estaba. Devuelve también cuántas
+    reglas duplicadas se eliminaron.
+    """
+    resultado: list = []
+    destinos: dict = {}  # clave -> posición en resultado de su última aparición
+    duplicadas = 0
+    for elemento in elementos:
+        clave = ("@", elemento.preludio) if isinstance(elemento, _Bloque) else elemento.selector
+        destino = destinos.get(clave)
+        if destino is not None:
+            propias = _propiedades(elemento)
+            intermedias = set().union(*(_propiedades(e) for e in resultado[destino + 1:]))
+            if not any(_se_pisan(a, b) for a in propias for b in intermedias):
+                previo = resultado[destino]
+                if isinstance(previo, _Bloque):
+                    previo.reglas.extend(elemento.reglas)
+                else:
+                    for prop, (valor, importante) in elemento.declaraciones.items():
+                        _fusionar_declaracion(previo.declaraciones, prop, valor, importante)
+                duplicadas += 1
+                continue
+        if isinstance(elemento, _Bloque):
+            nuevo = _Bloque(elemento.preludio, list(elemento.reglas))
+        else:
+            nuevo = _Regla(elemento.selector, dict(elemento.declaraciones))
+        destinos[clave] = len(resultado)
+        resultado.append(nuevo)
+    for elemento in resultado:
+        if isinstance(elemento, _Bloque):
+            elemento.reglas, internas = _fusionar(elemento.reglas)
+            duplicadas += internas
+    return resultado, duplicadas
+
+
+def _serializar(elementos: list) -> str:
+    partes = []
+    for elemento in elementos:
+        if isinstance(elemento, _Bloque):
+            partes.append(f"{elemento.preludio}{{{_serializar(elemento.reglas)}}}")
+        elif elemento.declaraciones:
+            cuerpo = ";".join(
+                f"{prop}:{valor}{'!important' if importante else ''}"
+                for prop, (valor, importante) in elemento.declaraciones.items()
+            )
+            partes.append(f"{elemento.selector}{{{cuerpo}}}")
+    return "".join(partes)
+
+
+@dataclass(frozen=True)
+class Tema:
+    """Bundle CSS listo para enviar, con datos para las métricas."""
+
+    css: str
+    hash: str
+    bytes_fuente: int
+    reglas_duplicadas: int
+
+
+def compilar(fuentes: list[str]) -> Tema:
+    """Combina, fusiona y minifica las hojas de estilo indicadas."""
+    sentencias: list[str] = []
+    elementos: list = []
+    for fuente in fuentes:
+        s, e = _parsear(fuente)
+        sentencias.extend(x for x in s if x not in sentencias)
+        elementos.extend(e)
+    elementos, duplicadas = _fusionar(elementos)
+    css = "".join(sentencias) + _serializar(elementos)
+    return Tema(
+        css=css,
+        hash=hashlib.sha256(css.encode("utf-8")).hexdigest()[:12],
+        bytes_fuente=sum(len(f.encode("utf-8")) for f in fuentes),
+        reglas_duplicadas=duplicadas,
+    )
+
+
+@lru_cache(maxsize=4)
+def _construir(colores: tuple) -> Tema:
+    return compilar(_hojas_de_estilo(dict(colores)))
+
+
+def construir_tema(colores: dict) -> Tema:
+    """Bundle del tema para la paleta dada, calculado una vez por proceso."""
+    return _construir(tuple(sorted(colores.items())))
+
+
+###############################################################################
+# Métricas de envío
+###############################################################################
+
+BYTES_TEMA = metricas.REGISTRO.medidor(
+    "experto_juridico_tema_bytes",
+    "Tamaño del CSS: fuentes originales frente al bundle compilado.",
+    ("tipo",),
+)
+BYTES_TEMA_AHORRADOS = metricas.REGISTRO.contador(
+    "experto_juridico_tema_bytes_ahorrados_total",
+    "Bytes de CSS que ya no se envían respecto a reenviar todas las fuentes en cada rerun.",
+)
+BYTES_TEMA_ULTIMO_RERUN = metricas.REGISTRO.medidor(
+    "experto_juridico_tema_bytes_ahorrados_rerun",
+    "Bytes de CSS ahorrados en el último rerun.",
+)
+
+
+def registrar_envio(tema: Tema, enviados: int) -> None:
+    """Registra cuántos bytes de estilos se enviaron en este rerun."""
+    BYTES_TEMA.set(tema.bytes_fuente, tipo="fuente")
+    BYTES_TEMA.set(len(tema.css.encode("utf-8")), tipo="bundle")
+    ahorrados = max(tema.bytes_fuente - enviados, 0)
+    BYTES_TEMA_AHORRADOS.inc(ahorrados)
+    BYTES_TEMA_ULTIMO_RERUN.set(ahorrados)
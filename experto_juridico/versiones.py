@@ -0,0 +1,241 @@
+"""Versiones de un expediente para reanalizar solo lo que cambió.
+
+Los casos crecen: se añade una resolución al expediente y el abogado vuelve a
+subirlo. Cada texto analizado se registra como versión con la huella (hash de
+64 bits) de cada uno de sus párrafos —las líneas no vacías del texto extraído—
+y el análisis obtenido; el texto en sí no se guarda.
+
+Al subir un documento se busca, entre las versiones del mismo usuario (el
+análisis de un expediente ajeno no se reutiliza), la anterior que más
+contiene: una muestra de sus huellas (las menores, al estilo MinHash) localiza
+candidatas por índice y sobre ellas se calcula qué fracción de sus párrafos
+sigue presente. Si hay una versión casi contenida en el texto nuevo, la diferencia
+son los párrafos añadidos y basta con enviar esos párrafos junto con el
+análisis anterior.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from experto_juridico import metricas
+
+RUTA_POR_DEFECTO = os.getenv("EJ_VERSIONES_DB", "versiones.db")
+# Fracción mínima de los párrafos de la versión anterior que debe seguir en la nueva
+UMBRAL_CONTENCION = 0.9
+# Huellas del texto nuevo con las que se buscan candidatas
+MUESTRA = 256
+CANDIDATAS = 5
+SEPARADOR_BLOQUES = "\n[...]\n"
+# Por encima de esta fracción de texto nuevo se reanaliza el documento completo
+MAX_FRACCION_INCREMENTAL = 0.5
+
+ANALISIS_VERSIONES = metricas.REGISTRO.contador(
+    "experto_juridico_analisis_versiones_total",
+    "Análisis según la versión anterior encontrada y la vía usada (completo, etapa_local, incremental, sin_cambios).",
+    ("tipo",),
+)
+CARACTERES_EVITADOS = metricas.REGISTRO.contador(
+    "experto_juridico_analisis_caracteres_evitados_total",
+    "Caracteres de documento que no se reenviaron al asistente gracias al análisis incremental.",
+)
+
+# Líneas que no aportan contenido y cambian entre versiones: numeración de
+# páginas y encabezados de procedencia del corpus de varios documentos
+_RUIDO = re.compile(
+    r"^(?:(?:p[aá]g(?:ina)?\.?\s*)?\d+(?:\s*(?:de|/)\s*\d+)?"
+    r"|=== Documento \d+ de \d+: .* ===|Expediente compuesto por \d+ documentos.*)$",
+    re.IGNORECASE,
+)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS versiones (
+    id INTEGER PRIMARY KEY,
+    caso INTEGER NOT NULL,
+    numero INTEGER NOT NULL,
+    fecha TEXT NOT NULL,
+    area TEXT NOT NULL,
+    rol TEXT NOT NULL,
+    parrafos INTEGER NOT NULL,
+    analisis TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parrafos (
+    version INTEGER NOT NULL REFERENCES versiones (id),
+    hash INTEGER NOT NULL,
+    PRIMARY KEY (version, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parrafos_hash ON parrafos (hash);
+"""
+
+
+def parrafos(texto: str) -> list[str]:
+    """Párrafos con contenido del texto, con los espacios normalizados."""
+    resultado = []
+    for linea in texto.splitlines():
+        linea = " ".join(linea.split())
+        if linea and not _RUIDO.match(linea):
+            resultado.append(linea)
+    return resultado
+
+
+def huella(parrafo: str) -> int:
+    """Hash de 64 bits con signo (cabe en un INTEGER de SQLite)."""
+    return int.from_bytes(hashlib.blake2b(parrafo.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+@dataclass(frozen=True)
+class VersionCaso:
+    id: int
+    caso: int  # id de la primera versión del expediente
+    numero: int
+    fecha: str
+    analisis: dict
+    huellas: frozenset[int]
+
+
+@dataclass(frozen=True)
+class Diferencia:
+    anterior: VersionCaso
+    nuevo: str  # párrafos añadidos, en bloques contiguos
+    parrafos_nuevos: int
+    parrafos_eliminados: int
+    caracteres_totales: int
+
+    @property
+    def sin_cambios(self) -> bool:
+        return not self.parrafos_nuevos and not self.parrafos_eliminados
+
+    @property
+    def fraccion_nueva(self) -> float:
+        return len(self.nuevo) / self.caracteres_totales if self.caracteres_totales else 0.0
+
+    @property
+    def incremental(self) -> bool:
+        """Si conviene enviar solo el material nuevo en lugar del documento completo."""
+        return self.parrafos_nuevos > 0 and self.fraccion_nueva <= MAX_FRACCION_INCREMENTAL
+
+
+def diferencia(anterior: VersionCaso, texto: str) -> Diferencia:
+    """Párrafos de ``texto`` que no estaban en la versión anterior."""
+    bloques, actual, nuevos, totales, vistos = [], [], 0, 0, set()
+    for parrafo in parrafos(texto):
+        h = huella(parrafo)
+        vistos.add(h)
+        totales += len(parrafo) + 1
+        if h in anterior.huellas:
+            if actual:
+                bloques.append("\n".join(actual))
+                actual = []
+        else:
+            actual.append(parrafo)
+            nuevos += 1
+    if actual:
+        bloques.append("\n".join(actual))
+    return Diferencia(
+        anterior=anterior,
+        nuevo=SEPARADOR_BLOQUES.join(bloques),
+        parrafos_nuevos=nuevos,
+        parrafos_eliminados=len(anterior.huellas - vistos),
+        caracteres_totales=totales,
+    )
+
+
+class AlmacenVersiones:
+    """Versiones analizadas de los expedientes, en SQLite (WAL)."""
+
+    def __init__(self, ruta: str | Path = RUTA_POR_DEFECTO):
+        self.ruta = str(ruta)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_ESQUEMA)
+            # Bases anteriores a las versiones por usuario (sus filas quedan sin dueño)
+            if "usuario" not in {fila[1] for fila in con.execute("PRAGMA table_info(versiones)")}:
+                con.execute("ALTER TABLE versiones ADD COLUMN usuario TEXT")
+
+    @contextmanager
+    def _conexion(self):
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            con.execute("PRAGMA synchronous=NORMAL")
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    @staticmethod
+    def _cargar(con: sqlite3.Connection, fila: tuple) -> VersionCaso:
+        id_, caso, numero, fecha, analisis = fila
+        huellas = frozenset(h for (h,) in con.execute("SELECT hash FROM parrafos WHERE version = ?", (id_,)))
+        return VersionCaso(id_, caso, numero, fecha, json.loads(analisis), huellas)
+
+    def buscar_anterior(self, texto: str, area: str, rol: str, usuario: str | None = None) -> VersionCaso | None:
+        """Versión registrada (mismo usuario, área y rol) cuyos párrafos siguen casi todos en ``texto``.
+
+        Entre varias, la de mayor contención y, a igualdad, la más reciente.
+        """
+        huellas = {huella(p) for p in parrafos(texto)}
+        if not huellas:
+            return None
+        muestra = sorted(huellas)[:MUESTRA]
+        marcas = ", ".join("?" * len(muestra))
+        mejor, mejor_orden = None, None
+        with self._conexion() as con:
+            filas = con.execute(
+                f"""
+                SELECT v.id, v.caso, v.numero, v.fecha, v.analisis
+                FROM parrafos p JOIN versiones v ON v.id = p.version
+                WHERE p.hash IN ({marcas}) AND v.area = ? AND v.rol = ? AND v.usuario IS ?
+                GROUP BY v.id
+                ORDER BY COUNT(*) DESC, v.id DESC
+                LIMIT ?
+                """,
+                (*muestra, area, rol, usuario, CANDIDATAS),
+            ).fetchall()
+            for fila in filas:
+                version = self._cargar(con, fila)
+                if not version.huellas:
+                    continue
+                contencion = len(version.huellas & huellas) / len(version.huellas)
+                orden = (contencion, version.id)
+                if contencion >= UMBRAL_CONTENCION and (mejor_orden is None or orden > mejor_orden):
+                    mejor, mejor_orden = version, orden
+        return mejor
+
+    def registrar(self, texto: str, area: str, rol: str, analisis: dict,
+                  anterior: VersionCaso | None = None, usuario: str | None = None) -> VersionCaso:
+        """Registra ``texto`` como nueva versión (la siguiente de ``anterior``, si la hay)."""
+        huellas = frozenset(huella(p) for p in parrafos(texto))
+        fecha = datetime.now().isoformat()
+        numero = anterior.numero + 1 if anterior else 1
+        with self._transaccion() as con:
+            cursor = con.execute(
+                "INSERT INTO versiones (caso, numero, fecha, area, rol, parrafos, analisis, usuario) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (anterior.caso if anterior else 0, numero, fecha, area, rol, len(huellas),
+                 json.dumps(analisis, ensure_ascii=False), usuario),
+            )
+            id_ = cursor.lastrowid
+            caso = anterior.caso if anterior else id_
+            if not anterior:
+                con.execute("UPDATE versiones SET caso = ? WHERE id = ?", (caso, id_))
+            con.executemany(
+                "INSERT INTO parrafos (version, hash) VALUES (?, ?)", ((id_, h) for h in huellas)
+            )
+        return VersionCaso(id_, caso, numero, fecha, analisis, huellas)
@@ -1,28 +1,34 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import os
-import tempfile
+import threading
 import time
-import csv  # Agregamos la importación de csv
+import uuid
+import functools
 from datetime import datetime
 from pathlib import Path
 from typing import Literal
 
-import openai
 import streamlit as st
-from docx import Document
-from PyPDF2 import PdfReader
+import streamlit.components.v1 as components
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from experto_juridico import (
+    analisis, asistente, estado, expediente, exportacion, extraccion, formatos, identidad, imagenes, memoria,
+    metricas, perfilador, tema, versiones,
+)
+from experto_juridico.almacen_feedback import DIMENSIONES, AlmacenFeedback, ContextoFeedback
+from experto_juridico.historial import AlmacenHistorial
+
+# Inicio del rerun actual (Streamlit ejecuta el script completo en cada interacción)
+_inicio_rerun = time.perf_counter()
 
 ###############################################################################
 # Configuración de la página y tema                                           
 ###############################################################################
 
-import base64
-import requests
-from io import BytesIO
-from PIL import Image
-
 # Colores corporativos
 COLORS = {
     "primary": "#2D5DA0",    # Azul corporativo
@@ -39,36 +45,6 @@ COLORS = {
     "star_hover": "#FBBF24",  # Dorado claro para hover
 }
 
-def generar_imagen_corporativa():
-    """Genera una imagen corporativa usando DALL-E."""
-    image_path = os.path.join(os.path.dirname(__file__), "corporate_image.png")
-    
-    # Si la imagen ya existe, la retornamos
-    if os.path.exists(image_path):
-        return image_path
-        
-    try:
-        response = openai.images.generate(
-            model="dall-e-3",
-            prompt="Ejecutivo de negocios con traje oscuro interactuando con una interfaz holográfica azul; en el centro, un icono luminoso de balanza de la justicia rodeado de símbolos legales —mazo, edificio judicial, apretón de manos, lupa, grupo de personas, libro abierto y globo de diálogo— sobre un fondo oscuro difuminado que realza el efecto futurista y profesional.",
-            n=1,
-            size="1024x1024",
-            quality="hd",
-            style="vivid"
-        )
-        
-        image_url = response.data[0].url
-        image_data = requests.get(image_url).content
-        
-        with open(image_path, "wb") as f:
-            f.write(image_data)
-            
-        return image_path
-    except Exception as e:
-        st.error(f"Error generando la imagen corporativa: {str(e)}")
-        fallback_image = os.path.join(os.path.dirname(__file__), "abogada experta japon.png")
-        return fallback_image if os.path.exists(fallback_image) else None
-
 # Configuración de la página
 st.set_page_config(
     page_title="Experto Jurídico 7.0",
@@ -77,467 +53,68 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Inyección de CSS personalizado
+def es_admin() -> bool:
+    """Indica si la URL trae el token de administración (EJ_ADMIN_TOKEN)."""
+    token = os.getenv("EJ_ADMIN_TOKEN")
+    return bool(token) and st.query_params.get("admin") == token
+
+def perfil_solicitado() -> bool:
+    """Perfilado puntual pedido por un administrador con ``?perfil=1`` (además de EJ_PERFIL)."""
+    return st.query_params.get("perfil") == "1" and es_admin()
+
+def fragmento(func):
+    """Como st.fragment, midiendo además la duración de cada ejecución del fragmento.
+
+    Cuando el fragmento se re-ejecuta solo, también se perfila (si está activo).
+    """
+    @functools.wraps(func)
+    def medido(*args, **kwargs):
+        with perfilador.perfilar(perfilador.etiqueta(f"fragmento_{func.__name__}"), perfil_solicitado()), \
+                metricas.medir(func.__name__, metricas.DURACION_FRAGMENTO, fragmento=func.__name__):
+            return func(*args, **kwargs)
+    return st.fragment(medido)
+
+# Estilos: bundle compilado una vez por proceso e inyectado una vez por sesión
+TEMA = tema.construir_tema(COLORS)
+
+# Componente mínimo que aplica estilos y cookies en la página y confirma que llegaron
+cliente = components.declare_component("cliente", path=str(Path(__file__).parent / "componentes" / "cliente"))
+
+def enviar_al_cliente(clave: str, confirmacion: str, **args) -> bool:
+    """Envía ``args`` al componente cliente en cada rerun hasta que el navegador confirma.
+
+    La confirmación llega como valor del componente (y provoca un rerun).
+    Devuelve True si ya estaba confirmada, es decir, si no se envió nada.
+    """
+    confirmadas = st.session_state.setdefault("confirmaciones_cliente", {})
+    if st.session_state.get(f"{clave}_cliente") == confirmacion:
+        confirmadas[clave] = confirmacion
+    if confirmadas.get(clave) == confirmacion:
+        return True
+    cliente(confirmacion=confirmacion, key=f"{clave}_cliente", default=None, **args)
+    return False
+
+def inyectar_tema():
+    """Envía el bundle CSS al <head> de la página hasta que el navegador confirma que lo aplicó.
+
+    El <style> queda en el documento padre aunque Streamlit retire el iframe en
+    los reruns siguientes. Si un rerun inmediato retira el iframe antes de que
+    cargue, no llega la confirmación y el bundle se reenvía en el rerun
+    siguiente. Con EJ_TEMA_INLINE=1 se vuelve a incrustar en cada rerun.
+    """
+    enviados = 0
+    if os.getenv("EJ_TEMA_INLINE"):
+        st.markdown(f"<style>{TEMA.css}</style>", unsafe_allow_html=True)
+        enviados = len(TEMA.css.encode("utf-8"))
+    elif not enviar_al_cliente("tema", TEMA.hash, estilo={"id": "ej-tema", "hash": TEMA.hash, "css": TEMA.css}):
+        enviados = len(TEMA.css.encode("utf-8"))
+    tema.registrar_envio(TEMA, enviados)
+
+inyectar_tema()
+
+# Pie de página (HTML, se emite en cada rerun)
 st.markdown(
-    f"""
-    <style>
-        /* Tipografía y colores base */
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
-        
-        :root {{
-            --primary-color: {COLORS["primary"]};
-            --secondary-color: {COLORS["secondary"]};
-            --neutral-color: {COLORS["neutral"]};
-            --background-color: {COLORS["background"]};
-            --text-color: {COLORS["text"]};
-            --light-primary: {COLORS["light_primary"]};
-        }}
-        
-        .stApp {{
-            font-family: 'Inter', sans-serif;
-            background-color: var(--background-color);
-        }}
-        
-        /* Ocultar elementos no deseados */
-        #MainMenu {{display: none;}}
-        footer {{display: none;}}
-        
-        /* Contenedor principal más compacto */
-        .main .block-container {{
-            max-width: 75%;  /* Reducido al 75% del ancho */
-            padding: 2rem 3rem;
-            margin: 0 auto;
-            background-color: white;
-            border-radius: 12px;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-        }}
-        
-        /* Franja descriptiva */
-        .descriptive-band {{
-            background-color: var(--light-primary);
-            padding: 1rem;
-            border-radius: 8px;
-            margin: 1rem 0;
-            text-align: center;
-            color: var(--primary-color);
-        }}
-        
-        /* Info box */
-        .info-box {{
-            background-color: rgba(45, 93, 160, 0.05);
-            border-left: 3px solid var(--primary-color);
-            padding: 1rem;
-            margin: 1rem 0;
-            border-radius: 0 8px 8px 0;
-        }}
-        
-        /* Contacto */
-        .contact-info {{
-            background-color: white;
-            padding: 1.5rem;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            margin: 1rem 0;
-        }}
-        
-        .contact-info h4 {{
-            color: var(--primary-color);
-            margin-bottom: 1rem;
-        }}
-        
-        .contact-detail {{
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-            margin: 0.5rem 0;
-            color: var(--text-color);
-        }}
-        
-        /* Navegación superior */
-        .stNavigationContainer {{
-            background-color: white;
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            z-index: 100;
-            padding: 1rem;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        }}
-        
-        /* Botones */
-        .stButton > button {{
-            width: 100%;
-            border-radius: 8px;
-            font-weight: 500;
-            transition: all 0.2s;
-        }}
-        
-        .stButton > button:first-child {{
-            background-color: var(--primary-color);
-            color: white;
-        }}
-        
-        .stButton > button:not(:first-child) {{
-            background-color: var(--neutral-color);
-            color: white;
-        }}
-        
-        /* Radio buttons en línea */
-        .stRadio > div {{
-            display: flex;
-            gap: 1rem;
-            flex-wrap: wrap;
-        }}
-        
-        .stRadio label {{
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-        }}
-        
-        /* Paneles desplegables */
-        .streamlit-expanderHeader {{
-            background-color: white;
-            border-radius: 8px;
-            padding: 1rem;
-            margin-bottom: 1rem;
-        }}
-        
-        /* Modo oscuro */
-        @media (prefers-color-scheme: dark) {{
-            :root {{
-                --background-color: #1A202C;
-                --text-color: #F8FAFC;
-            }}
-            
-            .stApp {{
-                background-color: var(--background-color);
-                color: var(--text-color);
-            }}
-        }}
-        
-        /* Accesibilidad */
-        *:focus {{
-            outline: 3px solid var(--primary-color);
-            outline-offset: 2px;
-        }}
-        
-        /* Spinner personalizado */
-        .stSpinner {{
-            border-color: var(--primary-color);
-        }}
-        
-        /* Navegación superior mejorada */
-        .nav-container {{
-            display: grid;
-            grid-template-columns: repeat(6, 1fr);
-            gap: 0.5rem;
-            padding: 1rem;
-            background-color: white;
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            z-index: 100;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            max-width: 1200px;
-            margin: 0 auto;
-        }}
-        
-        /* Botones de navegación */
-        .stButton {{
-            width: 100%;
-        }}
-        
-        .stButton > button {{
-            width: 100% !important;
-            min-width: 0 !important;
-            padding: 0.75rem 0.5rem !important;
-            background-color: var(--primary-color) !important;
-            border: none !important;
-            color: {COLORS["button_text"]} !important;
-            font-size: 0.875rem !important;
-            font-weight: 500 !important;
-            line-height: 1.2 !important;
-            border-radius: 8px !important;
-            transition: all 0.2s ease !important;
-            height: auto !important;
-            white-space: nowrap !important;
-            overflow: hidden !important;
-            text-overflow: ellipsis !important;
-            display: flex !important;
-            align-items: center !important;
-            justify-content: center !important;
-            gap: 0.25rem !important;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1) !important;
-        }}
-        
-        .stButton > button:hover {{
-            background-color: {COLORS["primary"]}DD !important;
-            color: {COLORS["button_text_hover"]} !important;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.15) !important;
-            transform: translateY(-1px) !important;
-        }}
-        
-        .stButton > button:active {{
-            transform: translateY(1px) !important;
-            box-shadow: inset 0 2px 4px rgba(0,0,0,0.1) !important;
-        }}
-        
-        /* Contenedor principal ajustado para la navegación */
-        .main .block-container {{
-            padding-top: 5rem !important;  /* Espacio para la navegación fija */
-        }}
-        
-        /* Media queries para responsividad */
-        @media (max-width: 768px) {{
-            .nav-container {{
-                grid-template-columns: repeat(3, 1fr);
-                padding: 0.75rem;
-            }}
-            
-            .stButton > button {{
-                padding: 0.5rem 0.25rem !important;
-                font-size: 0.75rem !important;
-            }}
-        }}
-        
-        /* Sistema de estrellas */
-        .rating {{
-            display: inline-flex;
-            gap: 0.25rem;
-            padding: 0.5rem;
-            border-radius: 8px;
-        }}
-        
-        .star {{
-            font-size: 2rem;
-            cursor: pointer;
-            color: #ddd;
-            transition: color 0.2s ease;
-        }}
-        
-        .star.filled {{
-            color: {COLORS["secondary"]};
-        }}
-        
-        .star:hover,
-        .star:focus {{
-            color: {COLORS["secondary"]};
-            outline: none;
-        }}
-        
-        /* Pie de página personalizado */
-        .custom-footer {{
-            position: fixed;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            background-color: {COLORS["footer"]};
-            color: white;
-            padding: 1rem;
-            text-align: center;
-            font-size: 0.9rem;
-            z-index: 100;
-        }}
-        
-        .custom-footer a {{
-            color: white;
-            text-decoration: none;
-        }}
-        
-        /* Ajuste para el contenido principal */
-        .main .block-container {{
-            margin-bottom: 4rem;  /* Espacio para el footer */
-        }}
-        
-        /* Contador de estrellas */
-        .rating-count {{
-            margin-left: 1rem;
-            font-size: 1.1rem;
-            color: var(--text-color);
-            display: inline-flex;
-            align-items: center;
-            padding: 0.25rem 0.75rem;
-            background-color: var(--light-primary);
-            border-radius: 1rem;
-        }}
-        
-        /* Navegación superior mejorada */
-        .nav-container {{
-            display: flex;
-            gap: 0.5rem;
-            padding: 1rem;
-            background-color: white;
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            z-index: 100;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        
-        .nav-button {{
-            flex: 1;
-            background-color: var(--primary-color);
-            color: {COLORS["button_text"]} !important;
-            padding: 0.75rem 1rem;
-            border-radius: 8px;
-            border: none;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            transition: all 0.2s ease;
-            font-weight: 500;
-            text-align: center;
-            cursor: pointer;
-            text-decoration: none;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            min-width: 120px;
-            font-size: 0.95rem;
-            letter-spacing: 0.02em;
-        }}
-        
-        .nav-button:hover,
-        .nav-button:focus,
-        .nav-button:active {{
-            background-color: {COLORS["primary"]}DD;
-            color: {COLORS["button_text_hover"]} !important;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.15);
-            transform: translateY(-1px);
-            text-decoration: none;
-        }}
-        
-        /* Asegurar que los emojis en los botones tengan buen contraste */
-        .nav-button span {{
-            filter: brightness(1.1);
-            margin-right: 0.5rem;
-        }}
-        
-        /* Estilo para botón activo */
-        .nav-button.active {{
-            background-color: {COLORS["primary"]};
-            color: {COLORS["button_text_hover"]} !important;
-            box-shadow: inset 0 2px 4px rgba(0,0,0,0.1);
-            transform: translateY(1px);
-        }}
-        
-        /* Contenedor de imagen corporativa */
-        .corporate-image-container {{
-            width: 100%;
-            margin: 1rem 0;
-            border-radius: 12px;
-            overflow: hidden;
-            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-        }}
-        
-        .corporate-image-container img {{
-            width: 100%;
-            height: auto;
-            object-fit: cover;
-            display: block;
-        }}
-        
-        /* Botón de historial */
-        .history-button {{
-            display: block;
-            width: fit-content;
-            margin: 2rem auto;
-            padding: 1rem 2rem;
-            background-color: white;
-            color: var(--primary-color);
-            border: 2px solid var(--primary-color);
-            border-radius: 8px;
-            font-weight: 500;
-            transition: all 0.2s ease;
-            cursor: pointer;
-            text-align: center;
-        }}
-        
-        .history-button:hover {{
-            background-color: var(--primary-color);
-            color: white;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        }}
-        
-        /* Media queries para responsividad */
-        @media (max-width: 768px) {{
-            .nav-container {{
-                flex-wrap: wrap;
-            }}
-            
-            .nav-button {{
-                min-width: calc(33.33% - 0.5rem);
-            }}
-        }}
-
-        /* Sistema de valoración por estrellas */
-        .rating-container {{
-            display: flex;
-            align-items: center;
-            gap: 2rem;
-            padding: 1.5rem;
-            background-color: white;
-            border-radius: 12px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }}
-        
-        .stars-container {{
-            display: flex;
-            gap: 0.75rem;
-        }}
-        
-        .star-rating {{
-            display: inline-flex;
-            gap: 0.75rem;
-        }}
-        
-        .star-btn {{
-            background: none;
-            border: none;
-            cursor: pointer;
-            font-size: 2.5rem;
-            padding: 0.25rem;
-            transition: all 0.3s ease;
-            color: {COLORS["star_inactive"]};
-            position: relative;
-            outline: none;
-        }}
-        
-        .star-btn:hover ~ .star-btn {{
-            color: {COLORS["star_inactive"]};
-        }}
-        
-        .star-rating:hover .star-btn {{
-            color: {COLORS["star_hover"]};
-        }}
-        
-        .star-rating .star-btn:hover ~ .star-btn {{
-            color: {COLORS["star_inactive"]};
-        }}
-        
-        .star-btn.active {{
-            color: {COLORS["star_active"]};
-            transform: scale(1.1);
-        }}
-        
-        .star-btn.active ~ .star-btn {{
-            color: {COLORS["star_inactive"]};
-        }}
-        
-        .rating-value {{
-            font-size: 1.1rem;
-            font-weight: 500;
-            color: {COLORS["text"]};
-            background-color: {COLORS["light_primary"]};
-            padding: 0.75rem 1.25rem;
-            border-radius: 2rem;
-            min-width: 120px;
-            text-align: center;
-        }}
-    </style>
-    
+    """
     <div class="custom-footer">
         Soporte técnico: <a href="mailto:melgarejobejarano@gmail.com">melgarejobejarano@gmail.com</a> | +51 961 277 144 · © 2024 Experto Jurídico
     </div>
@@ -563,20 +140,39 @@ def mostrar_navegacion():
     
     for i, (page, icon, label) in enumerate(nav_items):
         with cols[i]:
-            if st.button(
+            # El cambio de página se aplica en el callback, antes del rerun del clic,
+            # en lugar de forzar un segundo rerun con st.rerun()
+            st.button(
                 f"{icon} {label}",
                 key=f"nav_{page}",
                 use_container_width=True,
-                type="primary" if page == st.session_state.page else "secondary"
-            ):
-                # Limpiar estados si cambiamos de página
-                if page != st.session_state.page:
-                    if page != "generar":
-                        for key in ['paso_actual', 'area', 'rol', 'analysis', 'document_text']:
-                            if key in st.session_state:
-                                del st.session_state[key]
-                    st.session_state.page = page
-                    st.rerun()
+                type="primary" if page == st.session_state.page else "secondary",
+                on_click=cambiar_pagina,
+                args=(page,)
+            )
+
+def cambiar_pagina(page: str):
+    """Callback de navegación: limpia el estado del asistente y cambia de página."""
+    # Limpiar estados si cambiamos de página
+    if page != st.session_state.page:
+        if page != "generar":
+            limpiar_caso(['paso_actual', 'area', 'rol', 'analysis', 'document_text'])
+        st.session_state.page = page
+
+def limpiar_caso(claves: list[str]):
+    """Elimina claves del asistente, incluidos los textos del gestor de memoria."""
+    for key in claves:
+        if key in estado.CLAVES_TEXTO:
+            memoria.gestor().eliminar(st.session_state.sesion_id, key)
+        elif key in st.session_state:
+            del st.session_state[key]
+
+def texto_sesion(clave: str) -> str | None:
+    """Texto grande de la sesión (document_text, draft_text), recargado de disco si se volcó."""
+    return memoria.gestor().obtener(st.session_state.sesion_id, clave)
+
+def guardar_texto_sesion(clave: str, texto: str):
+    memoria.gestor().guardar(st.session_state.sesion_id, clave, texto)
 
 def sistema_estrellas(key_prefix=""):
     """Componente de calificación por estrellas."""
@@ -633,220 +229,141 @@ def mostrar_feedback():
     if "feedback_enviado" not in st.session_state:
         st.session_state["feedback_enviado"] = False
     
-    # Estilos personalizados
+    # Crear columnas para centrar el contenido
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col2:
+        formulario_valoracion()
+    
+    # Mostrar estadísticas
+    mostrar_estadisticas_feedback()
+
+@fragmento
+def formulario_valoracion():
+    """Estrellas, comentario y envío; cada interacción re-ejecuta solo este fragmento."""
+    # Sistema de estrellas
+    stars_html = "".join([
+        f'<span class="star{" active" if i <= st.session_state["rating_value"] else ""}" '
+        f'onclick="selectRating({i})">★</span>'
+        for i in range(1, 6)
+    ])
+    
+    rating_text = (f"{st.session_state['rating_value']} de 5 estrellas" 
+                  if st.session_state["rating_value"] > 0 
+                  else "Sin valorar")
+    
     st.markdown(
-        """
-        <style>
-        .rating-container {
-            background-color: white;
-            padding: 1.5rem;
-            border-radius: 8px;
-            text-align: center;
-            margin: 1rem 0;
-        }
-        
-        .stars {
-            display: inline-flex;
-            gap: 0.75rem;
-            margin: 1rem 0;
-        }
-        
-        .star {
-            font-size: 3rem;
-            cursor: pointer;
-            color: #DDD;
-            transition: color 0.2s ease;
-        }
-        
-        .star.active {
-            color: #FFD700;
-        }
-        
-        .rating-value {
-            font-size: 1.2rem;
-            color: #666;
-            margin-top: 1rem;
-        }
-        </style>
+        f"""
+        <div class="rating-container">
+            <div class="stars">
+                {stars_html}
+            </div>
+            <div class="rating-value">
+                {rating_text}
+            </div>
+        </div>
+    
+        <script>
+            function selectRating(value) {{
+                const stars = document.querySelectorAll('.star');
+                stars.forEach((star, index) => {{
+                    if (index < value) {{
+                        star.classList.add('active');
+                        star.style.color = '#FFD700';
+                    }} else {{
+                        star.classList.remove('active');
+                        star.style.color = '#DDD';
+                    }}
+                }});
+    
+                window.parent.postMessage({{
+                    type: 'streamlit:setComponentValue',
+                    value: value
+                }}, '*');
+            }}
+    
+            // Inicializar estrellas
+            const currentRating = {st.session_state["rating_value"]};
+            if (currentRating > 0) {{
+                selectRating(currentRating);
+            }}
+        </script>
         """,
         unsafe_allow_html=True
     )
     
-    # Crear columnas para centrar el contenido
-    col1, col2, col3 = st.columns([1, 2, 1])
+    # Componente oculto para manejar el estado
+    rating = st.number_input(
+        "Valoración en estrellas",  # Agregamos un label descriptivo
+        min_value=0,
+        max_value=5,
+        value=st.session_state["rating_value"],
+        label_visibility="collapsed"  # Ocultamos el label pero mantenemos la accesibilidad
+    )
     
-    with col2:
-        # Sistema de estrellas
-        stars_html = "".join([
-            f'<span class="star{" active" if i <= st.session_state["rating_value"] else ""}" '
-            f'onclick="selectRating({i})">★</span>'
-            for i in range(1, 6)
-        ])
-        
-        rating_text = (f"{st.session_state['rating_value']} de 5 estrellas" 
-                      if st.session_state["rating_value"] > 0 
-                      else "Sin valorar")
-        
-        st.markdown(
-            f"""
-            <div class="rating-container">
-                <div class="stars">
-                    {stars_html}
-                </div>
-                <div class="rating-value">
-                    {rating_text}
-                </div>
-            </div>
-            
-            <script>
-                function selectRating(value) {{
-                    const stars = document.querySelectorAll('.star');
-                    stars.forEach((star, index) => {{
-                        if (index < value) {{
-                            star.classList.add('active');
-                            star.style.color = '#FFD700';
-                        }} else {{
-                            star.classList.remove('active');
-                            star.style.color = '#DDD';
-                        }}
-                    }});
-                    
-                    window.parent.postMessage({{
-                        type: 'streamlit:setComponentValue',
-                        value: value
-                    }}, '*');
-                }}
-                
-                // Inicializar estrellas
-                const currentRating = {st.session_state["rating_value"]};
-                if (currentRating > 0) {{
-                    selectRating(currentRating);
-                }}
-            </script>
-            """,
-            unsafe_allow_html=True
-        )
-        
-        # Componente oculto para manejar el estado
-        rating = st.number_input(
-            "Valoración en estrellas",  # Agregamos un label descriptivo
-            min_value=0,
-            max_value=5,
-            value=st.session_state["rating_value"],
-            label_visibility="collapsed"  # Ocultamos el label pero mantenemos la accesibilidad
-        )
-        
-        if rating != st.session_state["rating_value"]:
-            st.session_state["rating_value"] = rating
-            st.rerun()
-        
-        # Área de comentarios
-        comentario = st.text_area(
-            "Comentarios y sugerencias",  # Label más descriptivo
-            height=80,
-            placeholder="¿Qué te pareció el servicio? (opcional)"
+    if rating != st.session_state["rating_value"]:
+        st.session_state["rating_value"] = rating
+        st.rerun(scope="fragment")
+    
+    # Área de comentarios
+    comentario = st.text_area(
+        "Comentarios y sugerencias",  # Label más descriptivo
+        height=80,
+        placeholder="¿Qué te pareció el servicio? (opcional)"
+    )
+    
+    # Botón de envío
+    if st.button(
+        "Enviar valoración",
+        type="primary",
+        use_container_width=True,
+        disabled=st.session_state["rating_value"] == 0 or st.session_state["feedback_enviado"]
+    ):
+        # Guardar feedback (transacción SQLite; actualiza también los agregados
+        # y el rollup diario con el contexto del último documento generado)
+        almacen_feedback().registrar(
+            st.session_state["rating_value"],
+            comentario,
+            contexto=ContextoFeedback(**st.session_state.get("contexto_feedback", {})),
         )
-        
-        # Botón de envío
-        if st.button(
-            "Enviar valoración",
-            type="primary",
-            use_container_width=True,
-            disabled=st.session_state["rating_value"] == 0 or st.session_state["feedback_enviado"]
-        ):
-            # Guardar feedback
-            feedback = {
-                "fecha": datetime.now().isoformat(),
-                "rating": st.session_state["rating_value"],
-                "comentario": comentario
-            }
-            
-            # Guardar en CSV
-            csv_path = "feedbacks.csv"
-            is_new_file = not os.path.exists(csv_path)
-            
-            with open(csv_path, mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=["fecha", "rating", "comentario"])
-                if is_new_file:
-                    writer.writeheader()
-                writer.writerow(feedback)
-            
-            # Mostrar mensaje de éxito
-            st.session_state["feedback_enviado"] = True
-            st.success("¡Gracias por tu valoración! 🌟")
-        
-        # Botón para nueva valoración
-        if st.session_state["feedback_enviado"]:
-            if st.button("Nueva valoración"):
-                st.session_state["rating_value"] = 0
-                st.session_state["feedback_enviado"] = False
-                st.rerun()
     
-    # Mostrar estadísticas
-    if os.path.exists("feedbacks.csv"):
-        with open("feedbacks.csv", mode='r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            feedbacks = list(reader)
-        
-        if feedbacks:
-            st.markdown("---")
-            total_ratings = len(feedbacks)
-            avg_rating = sum(float(f["rating"]) for f in feedbacks) / total_ratings
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Promedio", f"{avg_rating:.1f} ⭐")
-            with col2:
-                st.metric("Total valoraciones", str(total_ratings))
-
-# Asegurarnos de que los estilos CSS no hagan referencia a st.session_state.rating
-st.markdown(
-    """
-    <style>
-        /* Estilos para el contenedor de valoración */
-        .rating-container {
-            display: flex;
-            align-items: center;
-            gap: 2rem;
-            padding: 1.5rem;
-            background-color: white;
-            border-radius: 12px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        
-        /* Estilos para los radio buttons */
-        .stRadio > div {
-            flex-direction: row !important;
-            gap: 1rem !important;
-        }
-        
-        .stRadio label {
-            cursor: pointer !important;
-            font-size: 1.5rem !important;
-            padding: 0.5rem !important;
-            border-radius: 8px !important;
-            transition: all 0.2s ease !important;
-        }
-        
-        .stRadio label:hover {
-            background-color: rgba(45, 93, 160, 0.1) !important;
-        }
+        # Rerun completo (una vez por envío) para actualizar las estadísticas
+        st.session_state["feedback_enviado"] = True
+        st.rerun()
+    
+    # Mensaje de éxito y botón para nueva valoración
+    if st.session_state["feedback_enviado"]:
+        st.success("¡Gracias por tu valoración! 🌟")
+        if st.button("Nueva valoración"):
+            st.session_state["rating_value"] = 0
+            st.session_state["feedback_enviado"] = False
+            st.rerun(scope="fragment")
+
+@st.cache_resource(show_spinner=False)
+def almacen_feedback() -> AlmacenFeedback:
+    """Almacén de valoraciones compartido por el proceso (importa el CSV heredado una vez)."""
+    almacen = AlmacenFeedback()
+    almacen.importar_csv("feedbacks.csv")
+    return almacen
+
+def mostrar_estadisticas_feedback():
+    """Muestra el promedio, el total y la distribución de valoraciones."""
+    # Lectura O(1) de los agregados, sin recorrer las valoraciones
+    estadisticas = almacen_feedback().estadisticas()
+    
+    if estadisticas.total:
+        st.markdown("---")
         
-        /* Ocultar el radio button original */
-        .stRadio input[type="radio"] {
-            position: absolute !important;
-            opacity: 0 !important;
-        }
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Promedio", f"{estadisticas.promedio:.1f} ⭐")
+        with col2:
+            st.metric("Total valoraciones", str(estadisticas.total))
         
-        /* Estilo para la opción seleccionada */
-        .stRadio input[type="radio"]:checked + label {
-            color: #F59E0B !important;
-            transform: scale(1.1) !important;
-        }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+        st.caption(" · ".join(
+            f"{estrellas} ⭐: {cantidad}"
+            for estrellas, cantidad in sorted(estadisticas.histograma.items(), reverse=True)
+        ))
 
 def mostrar_ayuda():
     """Muestra la sección de ayuda."""
@@ -927,6 +444,145 @@ def mostrar_contacto():
 # Inicialización de estado                                                    
 ###############################################################################
 
+@st.cache_resource(show_spinner=False)
+def almacen_historial() -> AlmacenHistorial:
+    """Historial de conversación persistente compartido por el proceso."""
+    return AlmacenHistorial()
+
+@st.cache_resource(show_spinner=False)
+def almacen_versiones() -> versiones.AlmacenVersiones:
+    """Versiones analizadas de los expedientes, compartidas por el proceso."""
+    return versiones.AlmacenVersiones()
+
+@st.cache_resource(show_spinner=False)
+def almacen_estado() -> estado.AlmacenEstado:
+    """Backend del estado de sesión (EJ_ESTADO) compartido por el proceso."""
+    almacen = estado.almacen_desde_entorno()
+    if isinstance(almacen, estado.EstadoMemoria):
+        # En memoria, el estado de una sesión abandonada se desaloja junto con sus textos
+        memoria.gestor().al_desalojar(almacen.eliminar)
+    return almacen
+
+def pestana_actual() -> str:
+    """Id de la sesión de Streamlit del rerun: una por pestaña del navegador."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else ""
+
+def pestana_viva(pestana: str) -> bool:
+    return runtime.exists() and runtime.get_instance().is_active_session(pestana)
+
+@st.cache_resource(show_spinner=False)
+def titulares_sesion() -> estado.TitularesSesion:
+    """Pestaña que tiene abierta cada sesión del caso en este proceso."""
+    return estado.TitularesSesion(pestana_viva)
+
+# Identidad del usuario: su cuenta si la app usa la autenticación de Streamlit
+# o, si no, un id aleatorio que su navegador guarda en una cookie firmada.
+# Agrupa sus sesiones para que la búsqueda encuentre casos de visitas anteriores
+COOKIE_USUARIO = "ej_usuario"
+DURACION_COOKIE_USUARIO = 365 * 24 * 3600
+
+def usuario_actual() -> str:
+    cuenta = getattr(st, "user", None)
+    if cuenta is not None and cuenta.get("is_logged_in") and cuenta.get("email"):
+        return f"cuenta:{cuenta.get('email')}"
+    usuario = identidad.verificar(st.context.cookies.get(COOKIE_USUARIO))
+    if usuario is None:
+        usuario = identidad.nuevo_id()
+        guardar_cookie(COOKIE_USUARIO, identidad.firmar(usuario), DURACION_COOKIE_USUARIO)
+    return usuario
+
+def guardar_cookie(nombre: str, valor: str, duracion: int):
+    """Encola una cookie para el navegador; ``enviar_cookies`` la entrega."""
+    st.session_state.setdefault("cookies_pendientes", {})[nombre] = (valor, duracion)
+
+def enviar_cookies():
+    """Guarda en el navegador las cookies pendientes (hasta que confirma que las recibió)."""
+    pendientes = st.session_state.get("cookies_pendientes")
+    if not pendientes:
+        return
+    cookies = [{"nombre": n, "valor": v, "duracion": d} for n, (v, d) in sorted(pendientes.items())]
+    confirmacion = hashlib.sha256(json.dumps(cookies).encode("utf-8")).hexdigest()[:12]
+    if enviar_al_cliente("cookies", confirmacion, cookies=cookies):
+        del st.session_state.cookies_pendientes
+
+if 'usuario' not in st.session_state:
+    st.session_state.usuario = usuario_actual()
+
+# Sesión nueva o reanudada: el id viaja en una cookie firmada (no en la URL)
+# para que una recarga, un reinicio o cualquier otra réplica puedan retomar el
+# caso. Solo se retoma si el estado guardado es del mismo usuario
+COOKIE_SESION = "ej_sesion"
+DURACION_COOKIE_SESION = 24 * 3600
+
+def aplicar_estado_guardado(guardado: dict, reemplazar: bool = False):
+    """Lleva a la sesión un estado del backend; los textos grandes van al gestor de memoria.
+
+    Con ``reemplazar`` (recarga tras un conflicto) también se descarta lo
+    que esta pestaña tenía y el backend no.
+    """
+    for clave in estado.CLAVES_TEXTO:
+        texto = guardado.get(clave)
+        if texto is not None and (reemplazar or texto_sesion(clave) is None):
+            guardar_texto_sesion(clave, texto)
+        elif texto is None and reemplazar:
+            memoria.gestor().eliminar(st.session_state.sesion_id, clave)
+    for clave in estado.CLAVES_PERSISTENTES:
+        if clave in estado.CLAVES_TEXTO:
+            continue
+        if clave in guardado:
+            st.session_state[clave] = guardado[clave]
+        elif reemplazar and clave in st.session_state:
+            del st.session_state[clave]
+    st.session_state.sincronizador_estado.restaurado(guardado)
+
+if 'sesion_id' not in st.session_state:
+    # Enlaces antiguos con ?sesion=<id>: el id ya no se acepta en la URL
+    if "sesion" in st.query_params:
+        del st.query_params["sesion"]
+    sesion = identidad.verificar(st.context.cookies.get(COOKIE_SESION))
+    guardado = almacen_estado().cargar(sesion) if sesion else None
+    if guardado is not None and guardado.get("usuario") != st.session_state.usuario:
+        guardado = None
+    # Abierta en otra pestaña viva del navegador: esta empieza su propio caso
+    if guardado is not None and not titulares_sesion().reclamar(sesion, pestana_actual()):
+        guardado = None
+    if guardado is not None:
+        st.session_state.sesion_id = sesion
+    else:
+        st.session_state.sesion_id = uuid.uuid4().hex
+        titulares_sesion().reclamar(st.session_state.sesion_id, pestana_actual())
+        almacen_historial().iniciar_sesion(st.session_state.sesion_id, 'gpt-4', usuario=st.session_state.usuario)
+        guardar_cookie(COOKIE_SESION, identidad.firmar(st.session_state.sesion_id), DURACION_COOKIE_SESION)
+    st.session_state.sincronizador_estado = estado.SincronizadorEstado(
+        almacen_estado(), st.session_state.sesion_id, memoria.gestor()
+    )
+    if guardado is not None:
+        aplicar_estado_guardado(guardado)
+
+def _recargar_estado():
+    """Conflicto: descarta lo de esta pestaña y carga la versión guardada por la otra."""
+    guardado = almacen_estado().cargar(st.session_state.sesion_id)
+    if guardado is not None:
+        aplicar_estado_guardado(guardado, reemplazar=True)
+
+def _conservar_estado():
+    """Conflicto: conserva lo de esta pestaña, que sobrescribe la versión guardada."""
+    st.session_state.sincronizador_estado.adoptar_version_guardada()
+
+def mostrar_conflicto_estado():
+    st.warning("Este caso se modificó en otra pestaña o ventana. ¿Qué versión desea conservar?")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Cargar la otra versión", key="conflicto_recargar", on_click=_recargar_estado,
+                  use_container_width=True)
+    with col2:
+        st.button("Conservar esta pestaña", key="conflicto_conservar", on_click=_conservar_estado,
+                  use_container_width=True)
+
+# Aviso de conflicto de versiones, que se rellena al sincronizar al final del rerun
+aviso_estado = st.empty()
+
 # Inicializar estados de la aplicación
 if 'page' not in st.session_state:
     st.session_state.page = "inicio"
@@ -934,300 +590,209 @@ if 'page' not in st.session_state:
 if 'paso_actual' not in st.session_state:
     st.session_state.paso_actual = 1
 
-if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = {
-        'messages': [],
-        'system_info': {
-            'start_time': datetime.now().isoformat(),
-            'openai_model': 'gpt-4',
-        }
-    }
+# El historial vive en disco; la sesión solo guarda sus identificadores
+if 'caso_id' not in st.session_state:
+    st.session_state.caso_id = uuid.uuid4().hex
 
-if 'openai_thread' not in st.session_state:
-    st.session_state.openai_thread = openai.beta.threads.create()
+# Actividad de la sesión para el gestor de memoria (volcado y desalojo por inactividad)
+memoria.gestor().tocar(st.session_state.sesion_id)
 
-###############################################################################
-# Funciones principales                                                       
-###############################################################################
+# Cookies pendientes para el navegador (p. ej. la del usuario en su primera visita)
+enviar_cookies()
 
-ASSISTANT_IDS = {
-    "Derecho Civil": "asst_JEqVhFH9ertyrJTGFNq1zIZ0",
-    "Derecho de Familia": "asst_k72lXItROiR9tgnDBiqmWf9j",
-}
-
-ROLES_PROCESALES = ["Demandante", "Demandado"]
-
-# Palabras clave para determinar el formato
-PALABRAS_FORMATO_ESCRITO = [
-    "subsanar", "ampliar", "aclarar", "mero trámite",
-    "téngase", "sírvase", "adjuntar", "presente"
-]
+# Solo el id del thread: es serializable y basta para retomarlo en otra réplica.
+# Se crea con la primera llamada al asistente, no al abrir la página
+def thread_sesion() -> str:
+    """Thread de OpenAI de la sesión (se crea la primera vez que se necesita)."""
+    if not st.session_state.get('openai_thread_id'):
+        st.session_state.openai_thread_id = asistente.crear_thread()
+    return st.session_state.openai_thread_id
 
-PALABRAS_FORMATO_REGULAR = [
-    "demanda", "denuncia", "apelación", "recurso",
-    "impugnación", "nulidad", "casación", "queja"
-]
+# El escrito se redacta con lo que el thread contiene: se anota qué documento
+# ya recibió completo el thread de la sesión para no reenviarlo
+def clave_documento_thread(document_text: str) -> str:
+    """Clave del documento en el thread de la sesión (``<thread>:<sha256>``)."""
+    return f"{thread_sesion()}:{hashlib.sha256(document_text.encode('utf-8')).hexdigest()}"
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
-    st.warning("⚠️  Defina la variable de entorno OPENAI_API_KEY para continuar.")
+# Endpoint /metrics opcional (una sola vez por proceso)
+metricas.iniciar_servidor_desde_entorno()
 
-MAX_DOC_CHARS = 100_000  # límite para evitar desbordar tokens
-
-def enviar_mensaje_y_esperar(mensaje: str, assistant_id: str) -> str:
-    """Envía un mensaje al thread y espera la respuesta."""
-    thread_id = st.session_state.openai_thread.id
-
-    # Verificar y esperar si hay runs activos
-    runs = openai.beta.threads.runs.list(thread_id=thread_id)
-    for run in runs.data:
-        if run.status not in {"completed", "failed", "cancelled", "expired"}:
-            while True:
-                time.sleep(1)
-                run = openai.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-                if run.status in {"completed", "failed", "cancelled", "expired"}:
-                    break
-
-    # Agregar el mensaje al thread existente
-    openai.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=mensaje
-    )
+###############################################################################
+# Funciones principales                                                       
+###############################################################################
 
-    # Ejecutar el asistente
-    run = openai.beta.threads.runs.create(
-        thread_id=thread_id,
-        assistant_id=assistant_id
-    )
+ASSISTANT_IDS = asistente.ASSISTANT_IDS
 
-    # Esperar la respuesta
-    while run.status not in {"completed", "failed", "cancelled", "expired"}:
-        time.sleep(1)
-        run = openai.beta.threads.runs.retrieve(
-            thread_id=thread_id,
-            run_id=run.id
-        )
+ROLES_PROCESALES = asistente.ROLES_PROCESALES
 
-    if run.status != "completed":
-        return None
+if not os.getenv("OPENAI_API_KEY"):
+    st.warning("⚠️  Defina la variable de entorno OPENAI_API_KEY para continuar.")
 
-    # Obtener la última respuesta
-    messages = openai.beta.threads.messages.list(
-        thread_id=thread_id
-    )
-    return messages.data[0].content[0].text.value.strip()
+MAX_DOC_CHARS = asistente.MAX_DOC_CHARS
 
 def add_to_history(role: str, content: str, metadata: dict = None):
-    """Agrega un mensaje al historial de conversación."""
-    message = {
-        'role': role,
-        'content': content,
-        'timestamp': datetime.now().isoformat(),
-    }
-    if metadata:
-        message['metadata'] = metadata
-    
-    st.session_state.conversation_history['messages'].append(message)
-
-def get_conversation_json() -> str:
-    """Devuelve el historial de conversación en formato JSON."""
-    return json.dumps(st.session_state.conversation_history, indent=2, ensure_ascii=False)
+    """Agrega un mensaje al historial persistente de la sesión y el caso actuales."""
+    almacen_historial().agregar(
+        st.session_state.sesion_id,
+        st.session_state.caso_id,
+        role,
+        content,
+        metadata,
+    )
 
-def _extract_text_from_pdf(file) -> str:
-    reader = PdfReader(file)
-    return "\n".join(page.extract_text() or "" for page in reader.pages)
+def exportar_historial(destino: Path, comprimir: bool):
+    """Exporta el historial de la sesión como NDJSON (gzip opcional), leído por lotes del almacén."""
+    with metricas.medir("exportacion_historial"), open(destino, "wb") as salida:
+        almacen_historial().exportar_ndjson(st.session_state.sesion_id, salida, comprimir)
 
+@st.cache_resource(show_spinner=False)
+def limpieza_exportaciones() -> None:
+    """Borra las exportaciones del historial de las sesiones desalojadas (se registra una vez por proceso)."""
+    def borrar(sesion: str):
+        for ruta in memoria.gestor().directorio.glob(f"{sesion}.historial.*"):
+            ruta.unlink(missing_ok=True)
+    memoria.gestor().al_desalojar(borrar)
 
-def _extract_text_from_docx(file) -> str:
-    doc = Document(file)
-    return "\n".join(p.text for p in doc.paragraphs)
+def extract_text(uploaded_file) -> str:
+    """Extrae texto de un PDF o Word subido (caché compartida por contenido)."""
+    resultado = extraccion.extraer(uploaded_file.name, uploaded_file)
+    if resultado.desde_cache:
+        st.toast(f"Documento ya procesado: se reutilizó el texto ({resultado.duracion:.1f} s ahorrados)")
+    return resultado.texto
+
+def extract_case_text(uploaded_files: list) -> str:
+    """Extrae en paralelo los documentos del caso y devuelve el corpus combinado."""
+    caso = expediente.extraer_expediente([(f.name, f) for f in uploaded_files])
+    for nombre, motivo in caso.errores.items():
+        st.warning(f"No se pudo leer «{nombre}»: {motivo}")
+    if not caso.documentos:
+        raise ValueError("No se pudo extraer el texto de ningún documento")
+    reutilizados = sum(d.desde_cache for d in caso.documentos)
+    if reutilizados:
+        st.toast(
+            f"{reutilizados} documento(s) ya procesado(s): se reutilizó el texto "
+            f"({caso.segundos_ahorrados:.1f} s ahorrados)"
+        )
+    return caso.corpus(MAX_DOC_CHARS)
 
+# Marca por hilo para distinguir aciertos de la caché de ai_analyze
+_llamada_cache = threading.local()
 
-def extract_text(uploaded_file) -> str:
-    """Extrae texto de un PDF o Word subido."""
-    suffix = Path(uploaded_file.name).suffix.lower()
-    if suffix == ".pdf":
-        return _extract_text_from_pdf(uploaded_file)
-    if suffix == ".docx":
-        return _extract_text_from_docx(uploaded_file)
-    raise ValueError("Formato no soportado: debe ser PDF o DOCX")
+# Las funciones cacheadas reciben la versión de los prompts como argumento:
+# forma parte de la clave, así que un cambio de prompts no sirve resultados viejos
 
 @st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
-def ai_analyze(document_text: str, assistant_id: str, area: str, rol: str) -> dict | None:
+def ai_analyze(document_text: str, assistant_id: str, area: str, rol: str, version_prompt: int) -> dict | None:
     """Envía el documento al asistente y obtiene la etapa procesal y soluciones."""
-    # Reducir a tamaño manejable
-    doc_chunk = document_text[:MAX_DOC_CHARS]
-
-    # Registrar la consulta en el historial
-    add_to_history('user', doc_chunk, {'area': area, 'assistant_id': assistant_id, 'rol': rol})
-
-    mensaje = (
-        f"Actúa como asistente jurídico en favor del {rol}. "
-        "Analiza el siguiente documento legal y responde EXCLUSIVAMENTE "
-                    "con un JSON que contenga las claves 'etapa_proceso' (string) "
-        "y 'soluciones' (lista de EXACTAMENTE 3 strings numerados del 1-3, "
-        f"que representen las mejores opciones legales para el {rol} "
-        "en el siguiente paso procesal). No incluyas ningún texto adicional.\n\n"
-                    f"Área de especialidad: {area}.\n\nDocumento:\n{doc_chunk}"
+    _llamada_cache.miss = True
+    return asistente.analizar(
+        document_text, assistant_id, area, rol, thread_sesion(), add_to_history
     )
 
-    reply = enviar_mensaje_y_esperar(mensaje, assistant_id)
-    if not reply:
-        add_to_history('assistant', 'Error: No se pudo completar el análisis', {'status': 'failed'})
-        return None
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def ai_analyze_incremental(nuevo_material: str, analisis_previo: dict, assistant_id: str, area: str, rol: str,
+                           version_prompt: int) -> dict | None:
+    """Actualiza un análisis previo enviando solo el material nuevo del expediente."""
+    _llamada_cache.miss = True
+    return asistente.analizar_incremental(
+        nuevo_material, analisis_previo, assistant_id, area, rol, thread_sesion(), add_to_history
+    )
 
-    # Registrar la respuesta en el historial
-    add_to_history('assistant', reply, {'thread_id': st.session_state.openai_thread.id})
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def ai_soluciones(document_text: str, etapa: str, assistant_id: str, area: str, rol: str, version_prompt: int) -> dict | None:
+    """Pide solo las soluciones, con la etapa procesal ya determinada localmente."""
+    _llamada_cache.miss = True
+    return asistente.pedir_soluciones(
+        document_text, etapa, assistant_id, area, rol, thread_sesion(), add_to_history
+    )
 
-    try:
-        data = json.loads(reply)
-    except json.JSONDecodeError:
-        # Intentar repararlo con un modelo de corrección rápida
-        mensaje_correccion = "Corrige para que sea JSON válido sin comentarios.\n\n" + reply
-        reply_corregido = enviar_mensaje_y_esperar(mensaje_correccion, assistant_id)
-        data = json.loads(reply_corregido)
-
-    return data
-
-def determinar_formato(solucion: str) -> str:
-    """Determina el formato necesario basado en el contenido de la solución."""
-    solucion_lower = solucion.lower()
-    
-    for palabra in PALABRAS_FORMATO_ESCRITO:
-        if palabra in solucion_lower:
-            return "ESCRITO"
-            
-    for palabra in PALABRAS_FORMATO_REGULAR:
-        if palabra in solucion_lower:
-            return "REGULAR"
-            
-    # Por defecto, usar formato ESCRITO para trámites más simples
-    return "ESCRITO"
+def analizar_documento(document_text: str, assistant_id: str, area: str, rol: str) -> dict | None:
+    """Analiza el documento; si es una versión nueva de un expediente ya analizado,
+    envía solo lo que cambió junto con el análisis anterior.
 
-def generar_prompt_redaccion(formato: str, solucion: str, area: str, rol: str, etapa: str) -> str:
-    """Genera el prompt específico según el formato requerido."""
-    
-    instrucciones_comunes = """
-    INSTRUCCIONES GENERALES:
-    - Usa lenguaje claro y motivado (art. 122 CPC, art. 50 LOPJ)
-    - Emplea conectores lógicos ("primero", "además", "por ende")
-    - Mantén un tono empático pero firme
-    - Vincula los hechos con derechos fundamentales afectados
-    - Verifica plazos procesales
-    - Cumple el Código de Ética del PJ y checklist CPC
+    Registra si la respuesta vino de la caché y la versión analizada.
     """
-    
-    if formato == "ESCRITO":
-        template = f"""
-        Redacta un ESCRITO JUDICIAL siguiendo EXACTAMENTE esta estructura:
-        
-        1. ENCABEZADO: órgano, expediente N°, materia (mayúsculas centradas)
-        2. IDENTIFICACIÓN: datos completos de partes y apoderados (DNI/RUC, domicilio, casilla, poder)
-        3. EXPOSICIÓN FÁCTICA: usa método PASTOR (Problem-Amplify-Story-Transformation-Offer-Request)
-        4. FUNDAMENTOS DE DERECHO: normas (CPC, CC, Constitución) y precedentes con conectores lógicos
-        5. PETITORIO: ítems numerados con verbos imperativos
-        6. MEDIOS PROBATORIOS: lista ANEXO 1-n con descripción y folios
-        7. FIRMA Y CIERRE: lugar, fecha, firma, CAPE, casilla
-        
-        Área: {area}
-        Rol procesal: {rol}
-        Etapa actual: {etapa}
-        Solución elegida: {solucion}
-        
-        {instrucciones_comunes}
-        """
-    else:  # REGULAR
-        template = f"""
-        Redacta una PIEZA PROCESAL COMPLETA siguiendo EXACTAMENTE esta estructura:
-        
-        1. ENCABEZADO: órgano, tipo de acción, expediente
-        2. PARTES Y APODERADOS: datos completos y legitimación
-        3. COMPETENCIA: fundamento legal (territorial/cuantía)
-        4. PETITORIO: pretensiones principales y subsidiarias valoradas
-        5. FUNDAMENTOS DE HECHO: cronología con cierre jurídico
-        6. FUNDAMENTOS DE DERECHO: artículos y precedentes (incluir arts. 2-3-139 Const.)
-        7. REQUISITOS DE ADMISIBILIDAD: checklist CPC 130-135
-        8. MEDIOS PROBATORIOS: descripción + finalidad probatoria
-        9. ANEXOS: documentos numerados y foliados
-        10. PLAZO/AGRAVIO: cómputo detallado si aplica
-        11. PETICIÓN Y COSTAS: art. 56 CPC
-        12. FIRMA Y CIERRE: datos completos con CAPE
-        
-        Área: {area}
-        Rol procesal: {rol}
-        Etapa actual: {etapa}
-        Solución elegida: {solucion}
-        
-        {instrucciones_comunes}
-        """
-    
-    return template
+    plan = analisis.planificar(document_text, area, rol, almacen_versiones(), st.session_state.usuario)
+    if plan.via == "sin_cambios":
+        st.toast(f"Sin cambios respecto de la versión {plan.anterior.numero} del expediente: se reutiliza su análisis")
+        return plan.anterior.analisis
+
+    _llamada_cache.miss = False
+    if plan.via == "incremental":
+        analysis = ai_analyze_incremental(
+            plan.cambios.nuevo, plan.anterior.analisis, assistant_id, area, rol, asistente.PROMPT_VERSION
+        )
+        cache = "ai_analyze_incremental"
+    elif plan.via == "etapa_local":
+        # Etapa clasificada localmente con confianza suficiente: prompt reducido
+        analysis = ai_soluciones(document_text, plan.etapa, assistant_id, area, rol, asistente.PROMPT_VERSION)
+        cache = "ai_soluciones"
+    else:
+        analysis = ai_analyze(document_text, assistant_id, area, rol, asistente.PROMPT_VERSION)
+        cache = "ai_analyze"
+    metricas.CACHE.inc(cache=cache, resultado="miss" if _llamada_cache.miss else "hit")
+    if plan.envia_documento and _llamada_cache.miss:
+        st.session_state.documento_thread = clave_documento_thread(document_text)
+
+    if analysis:
+        version = analisis.registrar_version(
+            plan, document_text, area, rol, analysis, almacen_versiones(), st.session_state.usuario
+        )
+        if plan.via == "incremental":
+            st.toast(
+                f"Versión {version.numero} del expediente: se analizaron solo {plan.cambios.parrafos_nuevos} "
+                f"párrafo(s) nuevo(s) ({plan.cambios.fraccion_nueva:.1%} del texto)"
+            )
+    return analysis
 
 def ai_draft(solution: str, stage: str, assistant_id: str, area: str, rol: str, original_text: str) -> str:
-    """Solicita al asistente la redacción del escrito judicial."""
-    
-    # Determinar el formato necesario
-    formato = determinar_formato(solution)
-    
-    # Generar el prompt específico
-    prompt = generar_prompt_redaccion(formato, solution, area, rol, stage)
-    
-    # Registrar la solicitud de redacción
-    add_to_history('user', prompt, {
-        'area': area,
-        'stage': stage,
-        'solution': solution,
-        'formato': formato,
-        'rol': rol,
-        'assistant_id': assistant_id
-    })
-
-    response = enviar_mensaje_y_esperar(prompt, assistant_id)
+    """Solicita al asistente la redacción del escrito judicial.
+
+    Si el thread aún no tiene el documento completo (análisis reutilizado,
+    incremental, desde la caché o sobre un extracto), se le envía antes.
+    """
+    clave = clave_documento_thread(original_text)
+    documento = None if st.session_state.get('documento_thread') == clave else original_text
+    response = asistente.redactar(
+        solution, stage, assistant_id, area, rol, thread_sesion(), add_to_history, documento
+    )
+    st.session_state.documento_thread = clave
     if not response:
         return "Error: No se pudo generar el documento."
-
-    # Registrar la respuesta
-    add_to_history('assistant', response, {
-        'thread_id': st.session_state.openai_thread.id,
-        'formato': formato
-    })
-
     return response
 
-def generar_historial():
-    """Genera un historial completo de documentos."""
-    if not st.session_state.conversation_history['messages']:
+def generar_historial(antes_de: int | None = None):
+    """Genera una página del historial de documentos (del más reciente al más antiguo).
+
+    Devuelve el historial y el cursor de la página siguiente (None si es la última).
+    """
+    pagina = almacen_historial().pagina(
+        st.session_state.sesion_id, antes_de=antes_de, solo_borradores=True
+    )
+    if not pagina.mensajes and antes_de is None:
         st.warning("No hay historial de documentos disponible.")
-        return None
+        return None, None
         
     historial = {
         'fecha_generacion': datetime.now().isoformat(),
-        'documentos': []
+        'documentos': [
+            {
+                'timestamp': msg.fecha,
+                'contenido': msg.contenido,
+                'formato': msg.metadata['formato'],
+            }
+            for msg in pagina.mensajes
+        ]
     }
     
-    for msg in st.session_state.conversation_history['messages']:
-        if msg['role'] == 'assistant' and 'formato' in msg.get('metadata', {}):
-            historial['documentos'].append({
-                'timestamp': msg['timestamp'],
-                'contenido': msg['content'],
-                'formato': msg['metadata']['formato']
-            })
-    
-    return historial
+    return historial, pagina.siguiente
 
 ###############################################################################
 # Interfaz principal                                                           
 ###############################################################################
 
-# Mostrar navegación
-mostrar_navegacion()
-
-# Contenido según la página actual
-if st.session_state.page == "inicio":
+def mostrar_inicio():
+    """Muestra la página de inicio."""
     st.title("Experto Jurídico 7.0")
 
     # Logo y descripción en diseño responsivo
@@ -1263,23 +828,19 @@ if st.session_state.page == "inicio":
             unsafe_allow_html=True
         )
         
-        if st.button("Comenzar ▶️", type="primary"):
-            st.session_state.page = "generar"
+        st.button("Comenzar ▶️", type="primary", on_click=cambiar_pagina, args=("generar",))
             
     with col2:
-        image_path = generar_imagen_corporativa()
+        # Nunca bloquea: si falta la imagen se genera en segundo plano y se usa la de respaldo
+        image_path = imagenes.imagen_corporativa()
         if image_path:
-            st.markdown(
-                f"""
-                <div class="corporate-image-container">
-                    <img src="data:image/png;base64,{base64.b64encode(open(image_path, 'rb').read()).decode()}" 
-                         alt="Asistente Jurídico">
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+            # Variante WebP reducida y cacheada por proceso; st.image la sirve por
+            # HTTP (/media) en lugar de incrustarla en base64 en cada rerun.
+            with metricas.medir("imagen_corporativa"):
+                st.image(imagenes.variante(image_path), caption=None, use_container_width=True)
 
-elif st.session_state.page == "generar":
+def mostrar_generar():
+    """Muestra el asistente de generación de documentos (pasos 1 a 5)."""
     st.title("Generación de documentos")
     
     # Inicializar paso_actual si no existe
@@ -1290,229 +851,270 @@ elif st.session_state.page == "generar":
     progress = (st.session_state.paso_actual - 1) * 25
     st.progress(progress)
     
-    # Paso 1: Especialidad jurídica
     if st.session_state.paso_actual == 1:
-        st.header("Paso 1: Especialidad jurídica")
-        area = st.radio(
+        paso_especialidad()
+    elif st.session_state.paso_actual == 2:
+        paso_rol()
+    elif st.session_state.paso_actual == 3:
+        paso_documentos()
+    elif st.session_state.paso_actual == 4:
+        paso_opciones()
+    elif st.session_state.paso_actual == 5:
+        paso_resultado()
+
+def paso_especialidad():
+    """Paso 1: especialidad jurídica (formulario: elegir una opción no provoca reruns)."""
+    st.header("Paso 1: Especialidad jurídica")
+    with st.form("form_especialidad", border=False):
+        st.radio(
             "Seleccione su área de especialidad:",
             ["⚖️ Derecho Civil", "👨‍👩‍👧‍👦 Derecho de Familia"],
             format_func=lambda x: x.split(" ", 1)[1],
-            horizontal=True
+            horizontal=True,
+            key="area_opcion"
         )
-        if st.button("Continuar ▶️", type="primary") and area:
-            st.session_state.area = area.split(" ", 1)[1]
-            st.session_state.paso_actual = 2
-            st.rerun()
-    
-    # Paso 2: Rol procesal
-    elif st.session_state.paso_actual == 2:
-        st.header("Paso 2: Rol procesal")
-        rol = st.radio(
+        st.form_submit_button("Continuar ▶️", type="primary", on_click=_confirmar_especialidad)
+
+def _confirmar_especialidad():
+    area = st.session_state.get("area_opcion")
+    if area:
+        st.session_state.area = area.split(" ", 1)[1]
+        st.session_state.paso_actual = 2
+
+def paso_rol():
+    """Paso 2: rol procesal (formulario: elegir una opción no provoca reruns)."""
+    st.header("Paso 2: Rol procesal")
+    with st.form("form_rol", border=False):
+        st.radio(
             "Seleccione su rol en el proceso:",
             ["⚔️ Demandante", "🛡️ Demandado"],
             format_func=lambda x: x.split(" ", 1)[1],
-            horizontal=True
+            horizontal=True,
+            key="rol_opcion"
         )
-        if st.button("Continuar ▶️", type="primary") and rol:
-            st.session_state.rol = rol.split(" ", 1)[1]
+        st.form_submit_button("Continuar ▶️", type="primary", on_click=_confirmar_rol)
+
+def _confirmar_rol():
+    rol = st.session_state.get("rol_opcion")
+    if rol:
+        st.session_state.rol = rol.split(" ", 1)[1]
+        st.session_state.paso_actual = 3
+
+@fragmento
+def paso_documentos():
+    """Paso 3: carga y análisis; subir un archivo solo re-ejecuta este fragmento."""
+    st.header("Paso 3: Documentos")
+    uploaded_files = st.file_uploader(
+        "Subir documentos",
+        type=["pdf", "docx"],
+        accept_multiple_files=True,
+        help="Puede subir varios documentos del mismo caso (demanda, resoluciones, escritos) en PDF o Word (.docx)",
+        label_visibility="collapsed"
+    )
+    
+    if uploaded_files:
+        # Mostrar información de los archivos
+        st.info(
+            "Documento cargado correctamente" if len(uploaded_files) == 1
+            else f"{len(uploaded_files)} documentos cargados: se analizarán juntos como un solo caso"
+        )
+        for uploaded_file in uploaded_files:
+            st.text(f"{uploaded_file.name} · {uploaded_file.type} · {uploaded_file.size / 1024:.1f} KB")
+        
+        etiqueta = "Analizar documento ▶️" if len(uploaded_files) == 1 else "Analizar documentos ▶️"
+        if st.button(etiqueta, type="primary"):
+            try:
+                with st.spinner("Analizando documentos..."):
+                    inicio = time.perf_counter()
+                    text = extract_case_text(uploaded_files)
+                    assistant_id = ASSISTANT_IDS[st.session_state.area]
+                    analysis = analizar_documento(text, assistant_id, st.session_state.area, st.session_state.rol)
+                    
+                    if analysis:
+                        st.session_state.analysis = analysis
+                        guardar_texto_sesion("document_text", text)
+                        # Contexto para la analítica de valoraciones; sobrevive a la
+                        # navegación y a "Nuevo documento" hasta el siguiente análisis
+                        st.session_state.contexto_feedback = {
+                            "area": st.session_state.area,
+                            "rol": st.session_state.rol,
+                            "latencia_ms": round((time.perf_counter() - inicio) * 1000),
+                        }
+                        st.session_state.paso_actual = 4
+                        st.toast("¡Análisis completado! 🎉")
+                        st.rerun()
+                    else:
+                        st.error("No se pudo analizar el documento.")
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+    else:
+        st.info("👆 Sube uno o varios documentos para continuar")
+
+@fragmento
+def paso_opciones():
+    """Paso 4: opciones sugeridas; cambiar de opción solo re-ejecuta este fragmento."""
+    st.header("Paso 4: Opciones sugeridas")
+    
+    if "analysis" not in st.session_state:
+        st.error("No hay análisis disponible. Por favor, vuelve al paso anterior.")
+        if st.button("⬅️ Volver al paso anterior"):
             st.session_state.paso_actual = 3
             st.rerun()
+        return
     
-    # Paso 3: Documentos
-    elif st.session_state.paso_actual == 3:
-        st.header("Paso 3: Documentos")
-        uploaded_file = st.file_uploader(
-            "Subir documento",
-            type=["pdf", "docx"],
-            help="El documento debe estar en formato PDF o Word (.docx)",
-            label_visibility="collapsed"
-        )
-        
-        if uploaded_file:
-            # Mostrar información del archivo
-            file_details = {
-                "Nombre": uploaded_file.name,
-                "Tipo": uploaded_file.type,
-                "Tamaño": f"{uploaded_file.size / 1024:.1f} KB"
-            }
-            
-            st.info("Documento cargado correctamente")
-            for key, value in file_details.items():
-                st.text(f"{key}: {value}")
-            
-            if st.button("Analizar documento ▶️", type="primary"):
-                try:
-                    with st.spinner("Analizando documento..."):
-                        text = extract_text(uploaded_file)
-                        assistant_id = ASSISTANT_IDS[st.session_state.area]
-                        analysis = ai_analyze(text, assistant_id, st.session_state.area, st.session_state.rol)
+    analysis = st.session_state.analysis
+    st.info(f"**Etapa procesal:** {analysis['etapa_proceso']}")
+    
+    # Mostrar las opciones como radio buttons
+    choice = st.radio(
+        "Seleccione la acción a realizar:",
+        analysis['soluciones'],
+        format_func=lambda x: x.strip("123. "),
+        key="option_choice"
+    )
+    
+    if choice:
+        formato = formatos.determinar_formato(choice)
+        st.info(f"**Formato sugerido:** {formato}")
+        
+        # Botón centrado
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            if st.button("Generar documento ▶️", type="primary", use_container_width=True):
+                with st.spinner("Generando documento..."):
+                    try:
+                        inicio = time.perf_counter()
+                        draft_text = ai_draft(
+                            choice,
+                            analysis['etapa_proceso'],
+                            ASSISTANT_IDS[st.session_state.area],
+                            st.session_state.area,
+                            st.session_state.rol,
+                            texto_sesion("document_text")
+                        )
                         
-                        if analysis:
-                            st.session_state.analysis = analysis
-                            st.session_state.document_text = text
-                            st.session_state.paso_actual = 4
-                            st.toast("¡Análisis completado! 🎉")
+                        if draft_text:
+                            guardar_texto_sesion("draft_text", draft_text)
+                            # Latencia total percibida: análisis + redacción
+                            contexto = st.session_state.setdefault("contexto_feedback", {})
+                            contexto["formato"] = formato
+                            contexto["latencia_ms"] = contexto.get("latencia_ms", 0) + round(
+                                (time.perf_counter() - inicio) * 1000
+                            )
+                            st.session_state.paso_actual = 5
+                            st.toast("¡Documento generado! 📄")
                             st.rerun()
                         else:
-                            st.error("No se pudo analizar el documento.")
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
-        else:
-            st.info("👆 Sube un documento para continuar")
+                            st.error("No se pudo generar el documento.")
+                    except Exception as e:
+                        st.error(f"Error al generar el documento: {str(e)}")
 
-    # Paso 4: Opciones
-    elif st.session_state.paso_actual == 4:
-        st.header("Paso 4: Opciones sugeridas")
-        
-        if "analysis" not in st.session_state:
-            st.error("No hay análisis disponible. Por favor, vuelve al paso anterior.")
-            if st.button("⬅️ Volver al paso anterior"):
-                st.session_state.paso_actual = 3
-                st.rerun()
-        else:
-            analysis = st.session_state.analysis
-            st.info(f"**Etapa procesal:** {analysis['etapa_proceso']}")
-            
-            # Contenedor para las opciones
-            st.markdown(
-                """
-                <style>
-                .option-container {
-                    background-color: white;
-                    padding: 1rem;
-                    border-radius: 8px;
-                    margin: 1rem 0;
-                    border: 1px solid #E2E8F0;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-            
-            # Mostrar las opciones como radio buttons
-            choice = st.radio(
-                "Seleccione la acción a realizar:",
-                analysis['soluciones'],
-                format_func=lambda x: x.strip("123. "),
-                key="option_choice"
-            )
-            
-            if choice:
-                formato = determinar_formato(choice)
-                st.info(f"**Formato sugerido:** {formato}")
-                
-                # Botón centrado
-                col1, col2, col3 = st.columns([1, 2, 1])
-                with col2:
-                    if st.button("Generar documento ▶️", type="primary", use_container_width=True):
-                        with st.spinner("Generando documento..."):
-                            try:
-                                draft_text = ai_draft(
-                                    choice,
-                                    analysis['etapa_proceso'],
-                                    ASSISTANT_IDS[st.session_state.area],
-                                    st.session_state.area,
-                                    st.session_state.rol,
-                                    st.session_state.document_text
-                                )
-                                
-                                if draft_text:
-                                    st.session_state.draft_text = draft_text
-                                    st.session_state.paso_actual = 5
-                                    st.toast("¡Documento generado! 📄")
-                                    st.rerun()
-                                else:
-                                    st.error("No se pudo generar el documento.")
-                            except Exception as e:
-                                st.error(f"Error al generar el documento: {str(e)}")
+def paso_resultado():
+    """Paso 5: documento generado y descargas."""
+    st.header("Paso 5: Documento generado")
     
-    # Paso 5: Resultado
-    elif st.session_state.paso_actual == 5:
-        st.header("Paso 5: Documento generado")
-        
-        if "draft_text" not in st.session_state:
-            st.error("No hay documento generado. Por favor, vuelve al paso anterior.")
-            if st.button("⬅️ Volver al paso anterior"):
-                st.session_state.paso_actual = 4
-                st.rerun()
-        else:
-            # Contenedor para el documento
-            st.markdown(
-                """
-                <style>
-                .document-container {
-                    background-color: white;
-                    padding: 2rem;
-                    border-radius: 8px;
-                    border: 1px solid #E2E8F0;
-                    margin: 1rem 0;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-            
-            with st.expander("Ver documento", expanded=True):
-                st.text_area(
-                    "Contenido del documento",
-                    value=st.session_state.draft_text,
-                    height=500,
-                    help="Puede copiar el texto o descargarlo en formato Word"
+    draft_text = texto_sesion("draft_text")
+    if draft_text is None:
+        st.error("No hay documento generado. Por favor, vuelve al paso anterior.")
+        if st.button("⬅️ Volver al paso anterior"):
+            st.session_state.paso_actual = 4
+            st.rerun()
+        return
+    
+    with st.expander("Ver documento", expanded=True):
+        st.text_area(
+            "Contenido del documento",
+            value=draft_text,
+            height=500,
+            help="Puede copiar el texto o descargarlo en formato Word"
+        )
+    
+    descargas_resultado()
+    
+    # Botón para nuevo documento
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.button("Nuevo documento 🔄", type="primary", use_container_width=True, on_click=_nuevo_documento)
+
+def _nuevo_documento():
+    # Limpiar estados relevantes
+    limpiar_caso(['paso_actual', 'area', 'rol', 'analysis', 'document_text', 'draft_text'])
+    st.session_state.paso_actual = 1
+    # Los mensajes siguientes pertenecen a un caso nuevo
+    st.session_state.caso_id = uuid.uuid4().hex
+
+@fragmento
+def descargas_resultado():
+    """Botones de descarga; pulsarlos solo re-ejecuta este fragmento."""
+    col1, col2 = st.columns(2)
+    draft_text = texto_sesion("draft_text") or ""
+    
+    with col1:
+        try:
+            # El DOCX se serializa en memoria solo cuando se pide y queda
+            # cacheado por el hash del texto para los reruns siguientes
+            docx_bytes = exportacion.docx_en_cache(draft_text)
+            if docx_bytes is None:
+                if st.button("📄 Preparar DOCX", use_container_width=True):
+                    exportacion.exportar_docx(draft_text)
+                    st.rerun(scope="fragment")
+            else:
+                st.download_button(
+                    label="📥 Descargar DOCX",
+                    data=docx_bytes,
+                    file_name="documento_legal.docx",
+                    mime=exportacion.MIME_DOCX,
+                    use_container_width=True
                 )
-            
-            # Botones de descarga
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                try:
-                    # Generar documento Word
-                    doc = Document()
-                    doc.add_paragraph(st.session_state.draft_text)
-                    
-                    # Guardar temporalmente
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-                        doc.save(tmp.name)
-                        # Leer el archivo para la descarga
-                        with open(tmp.name, "rb") as docx_file:
-                            docx_bytes = docx_file.read()
-                            st.download_button(
-                                label="📥 Descargar DOCX",
-                                data=docx_bytes,
-                                file_name="documento_legal.docx",
-                                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                use_container_width=True
-                            )
-                        # Limpiar archivo temporal
-                        os.unlink(tmp.name)
-                except Exception as e:
-                    st.error(f"Error al generar el archivo DOCX: {str(e)}")
-            
-            with col2:
-                try:
-                    # Botón para descargar el historial
-                    conversation_json = get_conversation_json()
-                    st.download_button(
-                        label="📥 Descargar historial",
-                        data=conversation_json,
-                        file_name=f"historial_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json",
-                        use_container_width=True
-                    )
-                except Exception as e:
-                    st.error(f"Error al generar el historial: {str(e)}")
-            
-            # Botón para nuevo documento
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                if st.button("Nuevo documento 🔄", type="primary", use_container_width=True):
-                    # Limpiar estados relevantes
-                    for key in ['paso_actual', 'area', 'rol', 'analysis', 'document_text', 'draft_text']:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    st.session_state.paso_actual = 1
-                    st.rerun()
+        except Exception as e:
+            st.error(f"Error al generar el archivo DOCX: {str(e)}")
+    
+    with col2:
+        descarga_historial()
 
-elif st.session_state.page == "historial":
+def descarga_historial():
+    """Exportación del historial bajo demanda; nada se serializa hasta que se pide."""
+    try:
+        comprimir = st.checkbox("Comprimir (gzip)", value=True, key="historial_gzip")
+        # La exportación se reutiliza mientras no haya mensajes nuevos. Vive en un
+        # archivo temporal, no en session_state: solo se lee mientras el botón
+        # de descarga está en pantalla y se borra al descargarla
+        clave = (almacen_historial().ultimo_id(st.session_state.sesion_id), comprimir)
+        exportado = st.session_state.get("historial_exportado")
+        if exportado is None or exportado[0] != clave or not exportado[1].exists():
+            st.button(
+                "📋 Preparar historial",
+                use_container_width=True,
+                on_click=_preparar_historial,
+                args=(clave,),
+            )
+        else:
+            st.download_button(
+                label="📥 Descargar historial",
+                data=exportado[1].read_bytes(),
+                file_name=f"historial_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson{'.gz' if comprimir else ''}",
+                mime="application/gzip" if comprimir else "application/x-ndjson",
+                use_container_width=True,
+                on_click=_liberar_historial,
+            )
+    except Exception as e:
+        st.error(f"Error al generar el historial: {str(e)}")
+
+def _preparar_historial(clave: tuple):
+    limpieza_exportaciones()
+    _liberar_historial()
+    ruta = memoria.gestor().directorio / f"{st.session_state.sesion_id}.historial.ndjson{'.gz' if clave[1] else ''}"
+    exportar_historial(ruta, comprimir=clave[1])
+    st.session_state.historial_exportado = (clave, ruta)
+
+def _liberar_historial():
+    """Borra la exportación preparada (tras descargarla o al preparar otra)."""
+    exportado = st.session_state.pop("historial_exportado", None)
+    if exportado is not None:
+        exportado[1].unlink(missing_ok=True)
+
+def mostrar_historial():
+    """Muestra la página de historial de documentos."""
     st.title("Historial de documentos")
     
     st.markdown(
@@ -1524,37 +1126,173 @@ elif st.session_state.page == "historial":
         unsafe_allow_html=True
     )
     
+    mostrar_busqueda_historial()
+    
     # Botón para generar historial
-    st.markdown(
-        """
-        <button class="history-button" onclick="document.dispatchEvent(new CustomEvent('generate-history'))">
-            📋 Generar historial
-        </button>
-        """,
-        unsafe_allow_html=True
-    )
+    st.button("📋 Generar historial", on_click=_mostrar_historial)
     
     if st.session_state.get('show_history'):
-        historial = generar_historial()
+        # Pila de cursores: el último es el de la página visible
+        cursores = st.session_state.setdefault('historial_cursores', [None])
+        historial, siguiente = generar_historial(cursores[-1])
         if historial:
+            st.caption(
+                f"Página {len(cursores)} · "
+                f"{almacen_historial().contar(st.session_state.sesion_id, solo_borradores=True)} documentos"
+            )
             st.json(historial)
             
-            # Botón de descarga
-            st.download_button(
-                label="📥 Descargar historial",
-                data=json.dumps(historial, indent=2, ensure_ascii=False),
-                file_name=f"historial_documentos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json"
-            )
+            col1, col2 = st.columns(2)
+            with col1:
+                if len(cursores) > 1 and st.button("⬅️ Más recientes"):
+                    cursores.pop()
+                    st.rerun()
+            with col2:
+                if siguiente is not None and st.button("Más antiguos ➡️"):
+                    cursores.append(siguiente)
+                    st.rerun()
+            
+            # Exportación completa de la sesión (NDJSON, bajo demanda)
+            descarga_historial()
+
+def _mostrar_historial():
+    st.session_state.show_history = True
+    st.session_state.historial_cursores = [None]
+
+def mostrar_busqueda_historial():
+    """Búsqueda de texto completo en los análisis y escritos guardados."""
+    with st.form("form_busqueda_historial"):
+        texto = st.text_input("Buscar en análisis y escritos", placeholder="p. ej. nulidad de acto jurídico")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            area = st.selectbox("Área", ["Todas", *ASSISTANT_IDS])
+        with col2:
+            rol = st.selectbox("Rol", ["Todos", *ROLES_PROCESALES])
+        with col3:
+            formato = st.selectbox("Formato", ["Todos", "ESCRITO", "REGULAR"])
+        col1, col2 = st.columns(2)
+        with col1:
+            desde = st.date_input("Desde", value=None)
+        with col2:
+            hasta = st.date_input("Hasta", value=None)
+        # Cada usuario busca en todas sus sesiones; los administradores, en todos los casos guardados
+        todas = es_admin() and st.checkbox("Todos los usuarios")
+        buscar = st.form_submit_button("🔍 Buscar")
+    
+    if not buscar:
+        return
+    inicio = time.perf_counter()
+    with metricas.medir("busqueda_historial"):
+        resultados = almacen_historial().buscar(
+            texto,
+            usuario=None if todas else st.session_state.usuario,
+            area=None if area == "Todas" else area,
+            rol=None if rol == "Todos" else rol,
+            formato=None if formato == "Todos" else formato,
+            desde=desde.isoformat() if desde else None,
+            hasta=hasta.isoformat() if hasta else None,
+        )
+    st.caption(f"{len(resultados)} resultados en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+    for resultado in resultados:
+        mensaje = resultado.mensaje
+        detalles = " · ".join(
+            filter(None, [mensaje.fecha[:16].replace("T", " "), mensaje.metadata.get("area"),
+                          mensaje.metadata.get("rol"), mensaje.metadata.get("formato")])
+        )
+        with st.expander(f"{resultado.tipo.capitalize()} · {detalles}"):
+            st.caption(resultado.fragmento)
+            st.text(mensaje.contenido)
+
+def mostrar_metricas():
+    """Página oculta de administración con las métricas en formato Prometheus."""
+    st.title("Métricas")
+    st.caption("Formato de texto Prometheus; también disponible en /metrics si EJ_METRICAS_PUERTO está definido.")
+    informe = memoria.gestor().informe()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Sesiones", f"{informe.sesiones} ({informe.sesiones_volcadas} en disco)")
+    with col2:
+        st.metric("Textos en memoria", f"{informe.bytes_memoria / 1024:.0f} KB")
+    with col3:
+        st.metric("Textos en disco", f"{informe.bytes_disco / 1024:.0f} KB")
+    st.code(metricas.REGISTRO.exponer(), language="text")
 
-elif st.session_state.page == "ayuda":
-    mostrar_ayuda()
+def mostrar_analitica_feedback():
+    """Página oculta de administración con la analítica de valoraciones.
 
-elif st.session_state.page == "contacto":
-    mostrar_contacto()
+    Todas las consultas se sirven desde el rollup diario materializado.
+    """
+    st.title("Analítica de valoraciones")
+    estadisticas = almacen_feedback().estadisticas()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Promedio global", f"{estadisticas.promedio:.2f} ⭐")
+    with col2:
+        st.metric("Total valoraciones", str(estadisticas.total))
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        dimension = st.selectbox("Agrupar por", list(DIMENSIONES), format_func=DIMENSIONES.get)
+    with col2:
+        desde = st.date_input("Desde", value=None)
+    with col3:
+        hasta = st.date_input("Hasta", value=None)
+
+    filas = almacen_feedback().resumen_por(
+        dimension,
+        desde.isoformat() if desde else None,
+        hasta.isoformat() if hasta else None,
+    )
+    if not filas:
+        st.info("No hay valoraciones en el rango seleccionado.")
+        return
+    etiqueta = DIMENSIONES[dimension]
+    st.bar_chart(filas, x=etiqueta, y="Promedio")
+    st.dataframe(filas, hide_index=True, use_container_width=True)
+
+# Vistas ocultas para administradores (?admin=<token>&vista=...)
+VISTAS_ADMIN = {
+    "metricas": mostrar_metricas,
+    "analitica": mostrar_analitica_feedback,
+}
+
+PAGINAS = {
+    "inicio": mostrar_inicio,
+    "generar": mostrar_generar,
+    "historial": mostrar_historial,
+    "ayuda": mostrar_ayuda,
+    "contacto": mostrar_contacto,
+    "feedback": mostrar_feedback,
+}
 
-elif st.session_state.page == "feedback":
-    mostrar_feedback() 
+_etiqueta_rerun = perfilador.etiqueta(
+    st.session_state.page,
+    st.session_state.get("paso_actual") if st.session_state.page == "generar" else None,
+)
+# Perfilado opcional del rerun (EJ_PERFIL, o ?perfil=1 para administradores): la
+# página y el guardado del estado; el perfil se cierra aunque el rerun falle
+with perfilador.perfilar(_etiqueta_rerun, perfil_solicitado()):
+    try:
+        with metricas.medir("rerun", metricas.DURACION_RERUN, inicio=_inicio_rerun, pagina=st.session_state.page):
+            vista = st.query_params.get("vista")
+            if es_admin() and vista in VISTAS_ADMIN:
+                VISTAS_ADMIN[vista]()
+                st.stop()
+
+            # Mostrar navegación
+            mostrar_navegacion()
+
+            # Contenido según la página actual
+            PAGINAS[st.session_state.page]()
+    finally:
+        # Guardar el estado del caso en el backend (solo si cambió en este rerun)
+        with metricas.medir("sincronizacion_estado"):
+            try:
+                st.session_state.sincronizador_estado.sincronizar(st.session_state)
+            except estado.ConflictoEstado:
+                # No se guarda (ni en los reruns siguientes) hasta que el usuario elija
+                with aviso_estado.container():
+                    mostrar_conflicto_estado()
 
 # Actualizar el manejo del estado en Streamlit
 if 'rating_value' not in st.session_state:
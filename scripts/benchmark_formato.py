@@ -0,0 +1,99 @@
+"""Micro-benchmark de ``determinar_formato``: búsqueda secuencial original frente
+al clasificador por raíces sin caché, texto a texto y por lotes, y en renders repetidos.
+
+Uso:
+    python scripts/benchmark_formato.py [--textos 3000] [--repeticiones 5]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from experto_juridico import formatos  # noqa: E402
+
+# Implementación anterior (listas con tildes y búsqueda de subcadenas)
+_ESCRITO_ORIGINAL = ["subsanar", "ampliar", "aclarar", "mero trámite", "téngase", "sírvase", "adjuntar", "presente"]
+_REGULAR_ORIGINAL = ["demanda", "denuncia", "apelación", "recurso", "impugnación", "nulidad", "casación", "queja"]
+
+
+def determinar_formato_original(solucion: str) -> str:
+    solucion_lower = solucion.lower()
+    for palabra in _ESCRITO_ORIGINAL:
+        if palabra in solucion_lower:
+            return "ESCRITO"
+    for palabra in _REGULAR_ORIGINAL:
+        if palabra in solucion_lower:
+            return "REGULAR"
+    return "ESCRITO"
+
+
+PLANTILLAS = (
+    "{n}. Presentar escrito de subsanación de la {x} dentro del plazo de ley",
+    "{n}. Interponer recurso de apelación contra la resolución que declara {x}",
+    "{n}. Solicitar que se tenga presente el nuevo domicilio procesal para {x}",
+    "{n}. Deducir nulidad de actuados por defecto en la notificación de {x}",
+    "{n}. Formular queja de derecho ante la denegatoria del recurso sobre {x}",
+    "{n}. Pedir aclaración de la sentencia respecto de {x}",
+    "{n}. Ofrecer nuevos medios probatorios sobre {x}",
+)
+CASOS_DIFICILES = (
+    "Apelar la resolución que declara improcedente la demanda",
+    "Impugnar el dictamen pericial",
+    "Fundamentar el presente recurso de apelación",
+    "Apelacion de la sentencia de primera instancia",
+    "Subsanacion de la demanda dentro del plazo",
+)
+RELLENO = "la pretension principal el monto de la pension alimenticia el regimen de visitas la tenencia del menor".split()
+
+
+def textos_de_prueba(cantidad: int, semilla: int = 0) -> list[str]:
+    azar = random.Random(semilla)
+    return [
+        azar.choice(PLANTILLAS).format(n=i % 3 + 1, x=" ".join(azar.choices(RELLENO, k=azar.randint(3, 25))))
+        for i in range(cantidad)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--textos", type=int, default=3000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    textos = textos_de_prueba(args.textos)
+    casos = {
+        "original (in secuencial)": lambda: [determinar_formato_original(t) for t in textos],
+        "raíces, texto a texto": lambda: [formatos.CLASIFICADOR.clasificar(t) for t in textos],
+        "raíces, un lote": lambda: formatos.determinar_formatos(textos),
+    }
+    # Paso 4: cada render pregunta por las mismas tres soluciones
+    renders = [textos[i % 3] for i in range(len(textos))]
+    casos["original, renders"] = lambda: [determinar_formato_original(t) for t in renders]
+    casos["determinar_formato (caché)"] = lambda: [formatos.determinar_formato(t) for t in renders]
+
+    print(f"{len(textos)} soluciones, mejor de {args.repeticiones} repeticiones\n")
+    for nombre, funcion in casos.items():
+        mejor = min(timeit.repeat(funcion, number=1, repeat=args.repeticiones))
+        print(f"{nombre:<30}{mejor * 1000:>9.2f} ms{mejor / len(textos) * 1e6:>9.2f} µs/texto")
+
+    print("\nCasos con tildes omitidas, flexiones y subcadenas:")
+    for texto in CASOS_DIFICILES:
+        print(f"  {determinar_formato_original(texto):<8} -> {formatos.determinar_formato(texto):<8} {texto}")
+
+    originales = [determinar_formato_original(t) for t in textos]
+    nuevos = formatos.determinar_formatos(textos)
+    distintos = sum(a != b for a, b in zip(originales, nuevos))
+    print(f"\nClasificaciones distintas de la original: {distintos} ({distintos / len(textos):.1%})")
+    for texto, antes, ahora in zip(textos, originales, nuevos):
+        if antes != ahora:
+            print(f"  ej.: {antes} -> {ahora}: {texto[:90]}")
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Entrena, evalúa y mide el clasificador local de etapa procesal.
+
+Los ejemplos salen del historial (documento enviado + etapa que devolvió el
+asistente) o de un JSONL con objetos ``{"texto": ..., "etapa": ...}``. Se
+reserva una parte para prueba y se informa de la exactitud, la precisión y
+exhaustividad por etapa, la matriz de confusión, la cobertura y exactitud por
+umbral de confianza (para elegir ``EJ_ETAPA_UMBRAL``) y la latencia de
+predicción. Con ``--guardar`` se reentrena con todos los ejemplos y se escribe
+el modelo que carga la aplicación (``EJ_MODELO_ETAPA``).
+
+Uso:
+    python scripts/evaluar_etapa.py --historial historial.db --guardar modelo_etapa.json
+    python scripts/evaluar_etapa.py --datos ejemplos.jsonl --prueba 0.25
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from experto_juridico import etapas  # noqa: E402
+from experto_juridico.historial import AlmacenHistorial  # noqa: E402
+
+UMBRALES = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95)
+
+
+def ejemplos_historial(ruta: str) -> list[tuple[str, str]]:
+    ejemplos = []
+    for documento, respuesta in AlmacenHistorial(ruta).analisis_registrados():
+        try:
+            etapa = json.loads(respuesta.contenido).get("etapa_proceso", "")
+        except (json.JSONDecodeError, AttributeError):
+            continue
+        clave = etapas.normalizar_etapa(str(etapa))
+        if clave:
+            ejemplos.append((documento.contenido, clave))
+    return ejemplos
+
+
+def ejemplos_jsonl(ruta: str) -> list[tuple[str, str]]:
+    ejemplos = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                dato = json.loads(linea)
+                clave = etapas.normalizar_etapa(dato["etapa"])
+                if clave:
+                    ejemplos.append((dato["texto"], clave))
+    return ejemplos
+
+
+def dividir(ejemplos: list, fraccion: float, semilla: int) -> tuple[list, list]:
+    """División estratificada por etapa."""
+    por_etapa = defaultdict(list)
+    for ejemplo in ejemplos:
+        por_etapa[ejemplo[1]].append(ejemplo)
+    azar = random.Random(semilla)
+    entrenamiento, prueba = [], []
+    for grupo in por_etapa.values():
+        azar.shuffle(grupo)
+        corte = round(len(grupo) * fraccion) if len(grupo) > 1 else 0
+        prueba.extend(grupo[:corte])
+        entrenamiento.extend(grupo[corte:])
+    return entrenamiento, prueba
+
+
+def percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+def evaluar(modelo: etapas.ClasificadorEtapa, prueba: list[tuple[str, str]], repeticiones: int) -> None:
+    predicciones, tiempos = [], []
+    for texto, _ in prueba:
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            prediccion = modelo.predecir(texto)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+        predicciones.append(prediccion)
+
+    reales = [etapa for _, etapa in prueba]
+    aciertos = sum(p.etapa == r for p, r in zip(predicciones, reales))
+    print(f"\nExactitud: {aciertos / len(prueba):.1%} ({aciertos}/{len(prueba)})")
+
+    print(f"\n{'Etapa':<14}{'Precisión':>10}{'Exhaust.':>10}{'F1':>8}{'Soporte':>9}")
+    for clave in etapas.CLAVES_ETAPA:
+        vp = sum(p.etapa == clave and r == clave for p, r in zip(predicciones, reales))
+        predichas = sum(p.etapa == clave for p in predicciones)
+        soporte = reales.count(clave)
+        precision = vp / predichas if predichas else 0.0
+        exhaustividad = vp / soporte if soporte else 0.0
+        f1 = 2 * precision * exhaustividad / (precision + exhaustividad) if precision + exhaustividad else 0.0
+        print(f"{clave:<14}{precision:>10.1%}{exhaustividad:>10.1%}{f1:>8.2f}{soporte:>9}")
+
+    print("\nMatriz de confusión (filas: real, columnas: predicha)")
+    confusion = Counter((r, p.etapa) for p, r in zip(predicciones, reales))
+    print(" " * 14 + "".join(f"{c[:8]:>9}" for c in etapas.CLAVES_ETAPA))
+    for real in etapas.CLAVES_ETAPA:
+        print(f"{real:<14}" + "".join(f"{confusion[(real, c)]:>9}" for c in etapas.CLAVES_ETAPA))
+
+    print(f"\n{'Umbral':>7}{'Cobertura':>11}{'Exactitud':>11}")
+    for umbral in UMBRALES:
+        aceptadas = [(p, r) for p, r in zip(predicciones, reales) if p.confianza >= umbral]
+        exactitud = sum(p.etapa == r for p, r in aceptadas) / len(aceptadas) if aceptadas else 0.0
+        print(f"{umbral:>7.2f}{len(aceptadas) / len(prueba):>11.1%}{exactitud:>11.1%}")
+
+    caracteres = sum(len(texto) for texto, _ in prueba) * repeticiones
+    print(
+        f"\nLatencia de predicción: p50 {statistics.median(tiempos):.2f} ms, "
+        f"p95 {percentil(tiempos, 0.95):.2f} ms, máx {max(tiempos):.2f} ms "
+        f"({caracteres / sum(tiempos):,.0f} caracteres/ms)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--historial", help="base SQLite del historial (EJ_HISTORIAL_DB)")
+    origen.add_argument("--datos", help='JSONL con {"texto": ..., "etapa": ...}')
+    parser.add_argument("--prueba", type=float, default=0.2, help="fracción reservada para prueba")
+    parser.add_argument("--epocas", type=int, default=30)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--repeticiones", type=int, default=3, help="predicciones por documento al medir latencia")
+    parser.add_argument("--guardar", help="reentrena con todos los ejemplos y guarda el modelo en esta ruta")
+    args = parser.parse_args()
+
+    ejemplos = ejemplos_historial(args.historial) if args.historial else ejemplos_jsonl(args.datos)
+    if not ejemplos:
+        sys.exit("No hay ejemplos con una etapa reconocible.")
+    print(f"Ejemplos: {len(ejemplos)} · " + ", ".join(f"{k}: {n}" for k, n in sorted(Counter(e for _, e in ejemplos).items())))
+
+    entrenamiento, prueba = dividir(ejemplos, args.prueba, args.semilla)
+    t0 = time.perf_counter()
+    modelo = etapas.ClasificadorEtapa.entrenar(entrenamiento, epocas=args.epocas, semilla=args.semilla)
+    print(f"Entrenamiento: {len(entrenamiento)} ejemplos en {time.perf_counter() - t0:.1f} s")
+    if prueba:
+        evaluar(modelo, prueba, args.repeticiones)
+
+    if args.guardar:
+        modelo = etapas.ClasificadorEtapa.entrenar(ejemplos, epocas=args.epocas, semilla=args.semilla)
+        modelo.guardar(args.guardar)
+        print(f"\nModelo entrenado con {len(ejemplos)} ejemplos guardado en {args.guardar}")
+
+
+if __name__ == "__main__":
+    main()
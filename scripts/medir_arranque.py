@@ -0,0 +1,127 @@
+"""Mide el tiempo de importación y de arranque en frío de los módulos del paquete.
+
+Cada medición se hace en un intérprete nuevo (``python -X importtime``), de
+modo que no influyen los módulos ya cargados. Para cada módulo se informa de
+la mediana del tiempo de importación acumulado y de qué dependencias pesadas
+(openai, python-docx, PyPDF2, Pillow, Streamlit...) quedaron cargadas: en el
+núcleo deben aparecer solo cuando se usan por primera vez. También se mide lo
+que cuesta cada dependencia diferida (lo que paga el primer uso), el arranque
+de las CLI (``--help``) y, con ``--app``, el primer render de la aplicación
+con ``AppTest``.
+
+Uso:
+    python scripts/medir_arranque.py
+    python scripts/medir_arranque.py --repeticiones 10 --app
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+MODULOS = (
+    "experto_juridico.metricas",
+    "experto_juridico.formatos",
+    "experto_juridico.historial",
+    "experto_juridico.almacen_feedback",
+    "experto_juridico.etapas",
+    "experto_juridico.identidad",
+    "experto_juridico.versiones",
+    "experto_juridico.extraccion",
+    "experto_juridico.expediente",
+    "experto_juridico.exportacion",
+    "experto_juridico.asistente",
+    "experto_juridico.analisis",
+    "experto_juridico.imagenes",
+    "experto_juridico.lote",
+    "experto_juridico.batch",
+)
+PESADAS = ("openai", "docx", "PyPDF2", "PIL", "streamlit", "requests", "httpx", "pydantic")
+CLI = ("experto_juridico.lote", "experto_juridico.batch")
+
+_CODIGO_APP = """
+import time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({ruta!r}, default_timeout=120)
+at.run()
+print(time.perf_counter() - t0, len(at.exception))
+"""
+
+
+def _entorno() -> dict:
+    return {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (str(RAIZ), os.getenv("PYTHONPATH"))))}
+
+
+def importar(modulo: str) -> tuple[float, list[str]]:
+    """Tiempo de importación (ms) de ``modulo`` y dependencias pesadas que arrastra."""
+    codigo = (
+        f"import sys, json; import {modulo}; "
+        f"print(json.dumps([m for m in {PESADAS!r} if m in sys.modules]))"
+    )
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True, text=True, cwd=RAIZ, env=_entorno(), check=True,
+    )
+    acumulado = 0
+    for linea in proceso.stderr.splitlines():
+        partes = linea.split("|")
+        if len(partes) == 3 and partes[2].strip() == modulo:
+            acumulado = int(partes[1])
+    return acumulado / 1000, json.loads(proceso.stdout.strip().splitlines()[-1])
+
+
+def cronometrar(argumentos: list[str]) -> float:
+    """Tiempo de pared (ms) de un proceso de Python nuevo."""
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, *argumentos], capture_output=True, cwd=RAIZ, env=_entorno(), check=True)
+    return (time.perf_counter() - t0) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeticiones", type=int, default=5, help="intérpretes nuevos por medición")
+    parser.add_argument("--app", action="store_true", help="mide también el primer render de la aplicación")
+    args = parser.parse_args()
+
+    print(f"Intérprete base: {statistics.median(cronometrar(['-c', 'pass']) for _ in range(args.repeticiones)):.0f} ms\n")
+
+    print(f"{'Módulo':<34}{'Importación':>12}  Dependencias pesadas cargadas")
+    for modulo in MODULOS:
+        tiempos, pesadas = [], []
+        for _ in range(args.repeticiones):
+            ms, pesadas = importar(modulo)
+            tiempos.append(ms)
+        print(f"{modulo:<34}{statistics.median(tiempos):>9.1f} ms  {', '.join(pesadas) or '-'}")
+
+    print(f"\n{'Dependencia diferida':<34}{'Primer uso':>12}")
+    for dependencia in PESADAS[:5]:
+        ms = statistics.median(importar(dependencia)[0] for _ in range(args.repeticiones))
+        print(f"{dependencia:<34}{ms:>9.1f} ms")
+
+    print(f"\n{'Arranque de la CLI':<34}{'Pared':>12}")
+    for modulo in CLI:
+        ms = statistics.median(cronometrar(["-m", modulo, "--help"]) for _ in range(args.repeticiones))
+        print(f"{'python -m ' + modulo + ' --help':<34}{ms:>9.0f} ms")
+
+    if args.app:
+        # En un directorio temporal: las bases SQLite por defecto no quedan en el repositorio
+        with tempfile.TemporaryDirectory() as directorio:
+            proceso = subprocess.run(
+                [sys.executable, "-c", _CODIGO_APP.format(ruta=str(RAIZ / "experto_juridico_app.py"))],
+                capture_output=True, text=True, cwd=directorio, env=_entorno(), check=True,
+            )
+        segundos, excepciones = proceso.stdout.split()[-2:]
+        print(f"\nPrimer render de la aplicación (AppTest): {float(segundos) * 1000:.0f} ms, {excepciones} excepciones")
+
+
+if __name__ == "__main__":
+    main()